@@ -0,0 +1,153 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import defaultdict
+
+import aiohttp
+
+# Load driver for a running stack. Start it with EMBEDDING_PROVIDER=fake and LLM_PROVIDER=fake
+# to run offline without spending anything, e.g.
+#   python loadtest.py --conversations 20 --turns 5 --uploads 2
+BASE_URL = "http://localhost:8010/api/v1/"
+
+WORDS = ("weekend climbing brother money career training coffee travel family music "
+         "deadline garden running books friends cooking weather interview project").split()
+
+
+def percentile(samples: list, share: float):
+    ## linear interpolation between closest ranks
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    position = (len(ordered) - 1) * share
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+
+def synthetic_text(rng: random.Random, paragraphs: int) -> str:
+    return "\n\n".join(
+        " ".join(rng.choice(WORDS) for _ in range(rng.randint(40, 120))).capitalize() + "."
+        for _ in range(paragraphs)
+    )
+
+
+class Recorder:
+    ## latencies (ms) and failures per endpoint
+    def __init__(self):
+        self.latency = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    async def call(self, name: str, request):
+        start = time.perf_counter()
+        try:
+            async with request as response:
+                body = await response.read()
+                ok = response.status < 400
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            body, ok = None, False
+        elapsed = (time.perf_counter() - start) * 1000
+        if ok:
+            self.latency[name].append(elapsed)
+            return json.loads(body) if body and not name.endswith("stream") else body
+        self.errors[name] += 1
+        return None
+
+    def report(self, wall_s: float) -> dict:
+        result = {}
+        for name in sorted(set(self.latency) | set(self.errors)):
+            samples = self.latency[name]
+            result[name] = {
+                "ok": len(samples),
+                "errors": self.errors[name],
+                "throughput_rps": round(len(samples) / wall_s, 3) if wall_s else None,
+            }
+            for share in (0.5, 0.95, 0.99):
+                value = percentile(samples, share)
+                result[name][f"p{round(share * 100)}_ms"] = round(value, 1) if value is not None else None
+        return result
+
+
+async def conversation(session, recorder: Recorder, base_url: str, turns: int, stream: bool, rng: random.Random):
+    created = await recorder.call("interact/create", session.post(base_url + "interact/create"))
+    if not created:
+        return
+    endpoint = "interact/message/stream" if stream else "interact/message"
+    for _ in range(turns):
+        message = "What do you think about " + " and ".join(rng.sample(WORDS, 2)) + "?"
+        await recorder.call(endpoint, session.post(base_url + endpoint,
+                                                   json={"id": created["interaction_id"], "message": message}))
+
+
+async def upload(session, recorder: Recorder, base_url: str, text: str, poll_s: float, timeout_s: float):
+    ## the upload request itself, then the whole pipeline until its task finishes
+    form = aiohttp.FormData()
+    form.add_field("file", text.encode("utf-8"), filename="loadtest.txt", content_type="text/plain")
+    start = time.perf_counter()
+    queued = await recorder.call("interact/upload", session.post(base_url + "interact/upload", data=form))
+    if not queued:
+        return
+    status = None
+    while time.perf_counter() - start < timeout_s:
+        await asyncio.sleep(poll_s)
+        try:
+            async with session.get(base_url + f"analysis/task/{queued['task_id']}") as response:
+                status = (await response.json())["task_status"]
+        except (aiohttp.ClientError, asyncio.TimeoutError, KeyError):
+            continue
+        if status in ("SUCCESS", "FAILURE"):
+            break
+    elapsed = (time.perf_counter() - start) * 1000
+    if status == "SUCCESS":
+        recorder.latency["upload pipeline"].append(elapsed)
+    else:
+        recorder.errors["upload pipeline"] += 1
+
+
+async def main(args) -> dict:
+    rng = random.Random(args.seed)
+    recorder = Recorder()
+    if args.upload_file:
+        with open(args.upload_file, encoding="utf-8") as file:
+            text = file.read()
+    else:
+        text = synthetic_text(rng, args.paragraphs)
+
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(limit=args.conversations + args.uploads)
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        start = time.perf_counter()
+        await asyncio.gather(
+            *[conversation(session, recorder, args.base_url, args.turns, args.stream, random.Random(rng.random()))
+              for _ in range(args.conversations)],
+            *[upload(session, recorder, args.base_url, text, args.poll, args.timeout)
+              for _ in range(args.uploads)],
+        )
+        wall_s = time.perf_counter() - start
+
+    return {
+        "conversations": args.conversations,
+        "turns": args.turns,
+        "uploads": args.uploads,
+        "wall_s": round(wall_s, 3),
+        "endpoints": recorder.report(wall_s),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Concurrent conversations and uploads against a running stack. "
+                                                 "Reports throughput and latency percentiles per endpoint as JSON.")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--conversations", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=5, help="messages per conversation")
+    parser.add_argument("--stream", action="store_true", help="use /interact/message/stream")
+    parser.add_argument("--uploads", type=int, default=1)
+    parser.add_argument("--upload-file", help="text file to upload, synthetic text if left out")
+    parser.add_argument("--paragraphs", type=int, default=40, help="size of the synthetic upload")
+    parser.add_argument("--poll", type=float, default=1.0, help="seconds between upload status checks")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds before a request or upload counts as failed")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    print(json.dumps(asyncio.run(main(args)), indent=2))
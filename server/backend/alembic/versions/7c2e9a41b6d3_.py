@@ -0,0 +1,40 @@
+"""empty message
+
+Revision ID: 7c2e9a41b6d3
+Revises: 4df3f476a25f
+Create Date: 2025-03-22 14:05:11.482907
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from project.config import settings
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2e9a41b6d3'
+down_revision = '4df3f476a25f'
+branch_labels = None
+depends_on = None
+
+# HNSW indexes for l2_distance ordering - tune with HNSW_M / HNSW_EF_CONSTRUCTION
+# https://github.com/pgvector/pgvector#hnsw
+HNSW_INDEXES = {
+    'memory_embedding_hnsw_idx': 'memory',
+    'belief_embedding_hnsw_idx': 'belief',
+    'topic_embedding_hnsw_idx': 'topic',
+    'category_embedding_hnsw_idx': 'category',
+}
+
+
+def upgrade() -> None:
+    for name, table in HNSW_INDEXES.items():
+        op.create_index(name, table, ['embedding'], unique=False,
+                        postgresql_using='hnsw',
+                        postgresql_with={'m': settings.HNSW_M,
+                                         'ef_construction': settings.HNSW_EF_CONSTRUCTION},
+                        postgresql_ops={'embedding': 'vector_l2_ops'})
+
+
+def downgrade() -> None:
+    for name, table in HNSW_INDEXES.items():
+        op.drop_index(name, table_name=table, postgresql_using='hnsw')
@@ -0,0 +1,39 @@
+"""empty message
+
+Revision ID: a93f0d27c15e
+Revises: 7c2e9a41b6d3
+Create Date: 2025-03-29 11:42:37.901245
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from project.config import settings
+from project.utils.db_types import Embedding
+
+
+# revision identifiers, used by Alembic.
+revision = 'a93f0d27c15e'
+down_revision = '7c2e9a41b6d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('writing_sample',
+    sa.Column('slot', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('memory_id', sa.Uuid(), nullable=False),
+    sa.Column('text', sa.Text(), nullable=True),
+    sa.Column('embedding', Embedding(dim=512), nullable=True),
+    sa.ForeignKeyConstraint(['memory_id'], ['memory.id'], name='memory_id_writing_sample_fkey', onupdate='CASCADE', ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('slot')
+    )
+    # seed the pool from whatever memories already exist
+    op.execute(sa.text(
+        'INSERT INTO writing_sample (slot, memory_id, text, embedding) '
+        'SELECT row_number() OVER () - 1, id, text, embedding '
+        'FROM (SELECT id, text, embedding FROM memory ORDER BY random() LIMIT :size) AS seed'
+    ).bindparams(size=settings.STYLE_SAMPLE_POOL_SIZE))
+
+
+def downgrade() -> None:
+    op.drop_table('writing_sample')
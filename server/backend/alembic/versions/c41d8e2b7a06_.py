@@ -0,0 +1,40 @@
+"""empty message
+
+Revision ID: c41d8e2b7a06
+Revises: b7f2e19d4c35
+Create Date: 2025-04-12 15:03:27.518420
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from project.utils.db_types import Embedding
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41d8e2b7a06'
+down_revision = 'b7f2e19d4c35'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # reservoir positions continue from the memories that already exist
+    op.execute(sa.text('CREATE SEQUENCE writing_sample_position_seq MINVALUE 0 START WITH 0'))
+    op.execute(sa.text("SELECT setval('writing_sample_position_seq', (SELECT count(*) FROM memory), false)"))
+    op.add_column('writing_sample', sa.Column('position', sa.BigInteger(), nullable=True))
+    op.execute(sa.text('UPDATE writing_sample SET position = slot'))
+    op.alter_column('writing_sample', 'position', nullable=False)
+    # samples read their memory instead of keeping a copy of it
+    op.drop_column('writing_sample', 'embedding')
+    op.drop_column('writing_sample', 'text')
+
+
+def downgrade() -> None:
+    op.add_column('writing_sample', sa.Column('text', sa.Text(), nullable=True))
+    op.add_column('writing_sample', sa.Column('embedding', Embedding(dim=512), nullable=True))
+    op.execute(sa.text(
+        'UPDATE writing_sample SET text = memory.text, embedding = memory.embedding '
+        'FROM memory WHERE memory.id = writing_sample.memory_id'
+    ))
+    op.drop_column('writing_sample', 'position')
+    op.execute(sa.text('DROP SEQUENCE writing_sample_position_seq'))
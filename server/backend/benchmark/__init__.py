@@ -0,0 +1,2 @@
+# Retrieval benchmark - synthetic corpus, latency percentiles and ANN recall as JSON.
+# python -m benchmark --help
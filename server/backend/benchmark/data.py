@@ -0,0 +1,114 @@
+from uuid import uuid4
+
+import numpy as np
+from sqlalchemy import text
+
+from project.database import Base
+from project.interact.models import Memory
+from project.knowledge.models import Topic, Belief, TopicBelief, BeliefMemory
+from project.utils.bulk import bulk_insert
+
+# Synthetic corpus shaped like a real one - beliefs and memories sit in clusters around their
+# topic, which is what the HNSW indexes see in production. Uniform random vectors would be a
+# much harder (and unrealistic) case for them
+DIMENSIONS = 512
+BELIEF_SPREAD = 0.03
+MEMORY_SPREAD = 0.04
+QUERY_SPREAD = 0.04
+BELIEF_TYPES = ("value", "opinion", "emotion")
+
+
+def unit(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def clustered(rng: np.random.Generator, centers: np.ndarray, assignment: np.ndarray, spread: float) -> np.ndarray:
+    ## unit vectors scattered around the centers they are assigned to
+    noise = rng.normal(scale=spread, size=(len(assignment), centers.shape[1]))
+    return unit(centers[assignment] + noise).astype(np.float32)
+
+
+def reset_tables(engine):
+    ## fresh tables, without the HNSW indexes - build_indexes adds them after the load, which
+    ## is much faster than maintaining them row by row
+    with engine.begin() as conn:
+        conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        conn.execute(text('CREATE EXTENSION IF NOT EXISTS "uuid-ossp"'))
+    Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        for index in hnsw_indexes():
+            index.drop(conn)
+
+
+def build_indexes(engine):
+    with engine.begin() as conn:
+        for index in hnsw_indexes():
+            index.create(conn)
+        conn.execute(text("ANALYZE"))
+
+
+def hnsw_indexes():
+    return [index for table in Base.metadata.sorted_tables for index in table.indexes
+            if index.dialect_options["postgresql"]["using"] == "hnsw"]
+
+
+def topic_centers(seed: int, topics: int) -> np.ndarray:
+    ## topic embeddings - the same for the same seed, so queries can be drawn for a corpus
+    ## loaded by an earlier run
+    rng = np.random.default_rng(seed)
+    return unit(rng.normal(size=(topics, DIMENSIONS))).astype(np.float32)
+
+
+def generate(db_session, rng: np.random.Generator, centers: np.ndarray, beliefs: int, memories: int,
+             batch_size: int = 10000):
+    ## Writes the corpus a batch at a time (binary COPY through bulk_insert), so 1M rows never
+    ## sit in memory at once. Every belief gets one topic, every memory one belief of the same topic
+    topics = len(centers)
+    topic_ids = [str(uuid4()) for _ in range(topics)]
+    bulk_insert(db_session, Topic, [
+        {"id": topic_ids[idx], "name": f"topic {idx}", "embedding": centers[idx]}
+        for idx in range(topics)
+    ])
+    db_session.commit()
+
+    belief_topics = rng.integers(0, topics, size=beliefs)
+    belief_ids = np.array([str(uuid4()) for _ in range(beliefs)], dtype=object)
+    for start in range(0, beliefs, batch_size):
+        assignment = belief_topics[start:start + batch_size]
+        embeddings = clustered(rng, centers, assignment, BELIEF_SPREAD)
+        ids = belief_ids[start:start + batch_size]
+        bulk_insert(db_session, Belief, [
+            {"id": belief_id, "text": f"belief {start + idx}", "embedding": embedding,
+             "type": BELIEF_TYPES[(start + idx) % len(BELIEF_TYPES)]}
+            for idx, (belief_id, embedding) in enumerate(zip(ids, embeddings))
+        ])
+        bulk_insert(db_session, TopicBelief, [
+            {"topic_id": topic_ids[topic], "belief_id": belief_id}
+            for topic, belief_id in zip(assignment, ids)
+        ])
+        db_session.commit()
+
+    # beliefs of each topic, for linking memories
+    order = np.argsort(belief_topics, kind="stable")
+    bounds = np.searchsorted(belief_topics[order], np.arange(topics + 1))
+    for start in range(0, memories, batch_size):
+        assignment = rng.integers(0, topics, size=min(batch_size, memories - start))
+        embeddings = clustered(rng, centers, assignment, MEMORY_SPREAD)
+        rows, links = [], []
+        for idx, (topic, embedding) in enumerate(zip(assignment, embeddings)):
+            memory_id = str(uuid4())
+            rows.append({"id": memory_id, "text": f"memory {start + idx}", "summary": f"summary {start + idx}",
+                         "embedding": embedding, "impact": 0.0})
+            if bounds[topic + 1] > bounds[topic]:
+                belief = order[rng.integers(bounds[topic], bounds[topic + 1])]
+                links.append({"belief_id": belief_ids[belief], "memory_id": memory_id})
+        bulk_insert(db_session, Memory, rows)
+        bulk_insert(db_session, BeliefMemory, links)
+        db_session.commit()
+
+
+def draw_queries(rng: np.random.Generator, centers: np.ndarray, count: int) -> list:
+    ## context embeddings near random topics, like a chat turn about something in the corpus
+    assignment = rng.integers(0, len(centers), size=count)
+    return clustered(rng, centers, assignment, QUERY_SPREAD).tolist()
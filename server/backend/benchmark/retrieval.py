@@ -0,0 +1,90 @@
+import time
+
+import numpy as np
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from project.interact.models import Memory
+from project.knowledge.models import Belief
+from project.knowledge.utils import get_topics, extract_knowledge, retrieve_knowledge
+from project.utils.db_types import hnsw_ef_search
+
+
+def percentiles(samples: list) -> dict:
+    ## latency summary in milliseconds
+    if not samples:
+        return {"runs": 0, "p50_ms": None, "p95_ms": None, "p99_ms": None}
+    p50, p95, p99 = np.percentile(samples, [50, 95, 99])
+    return {"runs": len(samples), "p50_ms": round(float(p50), 3),
+            "p95_ms": round(float(p95), 3), "p99_ms": round(float(p99), 3)}
+
+
+def recall_at_k(approximate: list, exact: list) -> float:
+    ## share of the exact results the approximate search also found
+    if not exact:
+        return 1.0
+    return len(set(approximate) & set(exact)) / len(set(exact))
+
+
+def knowledge_beliefs(knowledge: dict) -> list:
+    return [belief["belief"] for topic in knowledge.values() for belief in topic["beliefs"]]
+
+
+async def nearest_ids(model, embedding: list, k: int, session: AsyncSession) -> list:
+    ## plain k nearest rows of a table - what the HNSW index alone gets right
+    await session.execute(hnsw_ef_search(max(k, 40)))
+    rows = (await session.execute(
+        select(model.id)
+        .order_by(model.embedding.l2_distance(embedding))
+        .limit(k)
+    )).all()
+    return [str(row[0]) for row in rows]
+
+
+async def _run(session: AsyncSession, call, exact: bool):
+    ## one query in its own transaction. Exact runs turn index scans off (SET LOCAL), so the
+    ## same statement falls back to a sequential scan with exact distances
+    try:
+        if exact:
+            await session.execute(text("SET LOCAL enable_indexscan = off"))
+        start = time.perf_counter()
+        result = await call()
+        elapsed = (time.perf_counter() - start) * 1000
+    finally:
+        await session.rollback()
+    return result, elapsed
+
+
+QUERIES = ("get_topics", "extract_knowledge", "retrieve_knowledge", "nearest_beliefs", "nearest_memories")
+
+
+async def benchmark_retrieval(session: AsyncSession, queries: list, k: int = 10, warmup: int = 5) -> dict:
+    ## Latency percentiles of every retrieval query, and recall of the indexed (approximate)
+    ## results against exact search on the same data. The first `warmup` queries aren't counted
+    latency = {name: [] for name in QUERIES}
+    recall = {name: [] for name in QUERIES}
+
+    for idx, query in enumerate(queries):
+        # extract_knowledge runs on the topics get_topics found, as in the chat path
+        topics, _ = await _run(session, lambda: get_topics(query, session), exact=False)
+        calls = {
+            "get_topics": lambda: get_topics(query, session),
+            "extract_knowledge": lambda: extract_knowledge(query, topics, session),
+            "retrieve_knowledge": lambda: retrieve_knowledge(query, session),
+            "nearest_beliefs": lambda: nearest_ids(Belief, query, k, session),
+            "nearest_memories": lambda: nearest_ids(Memory, query, k, session),
+        }
+        for name, call in calls.items():
+            approximate, elapsed = await _run(session, call, exact=False)
+            exact, _ = await _run(session, call, exact=True)
+            if isinstance(approximate, dict):
+                approximate, exact = knowledge_beliefs(approximate), knowledge_beliefs(exact)
+            if idx >= warmup:
+                latency[name].append(elapsed)
+                recall[name].append(recall_at_k(approximate, exact))
+
+    return {
+        name: {**percentiles(latency[name]),
+               "recall": round(float(np.mean(recall[name])), 4) if recall[name] else None}
+        for name in QUERIES
+    }
@@ -1,3 +1,4 @@
+from contextlib import asynccontextmanager
 from celery import Celery
 from celery.schedules import crontab
 from fastapi import APIRouter, FastAPI
@@ -5,15 +6,33 @@ from fastapi.middleware.cors import CORSMiddleware
 from project.celery_utils import create_celery
 from project.websockets import asgi, manager
 from project.database import manage_conn_pools
+from project.embedding.voyage import open_voyage_pool, close_voyage_pool
+from project.cache import close_async_redis
 from project.config import settings
+from project.metrics import metrics_router
+from project.interact.utils import UploadSizeLimit
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # database pools, then the provider clients' shared sessions and the async redis client
+    async with asynccontextmanager(manage_conn_pools)(app):
+        await open_voyage_pool()
+        try:
+            yield
+        finally:
+            await close_voyage_pool()
+            await close_async_redis()
 
 
 # https://testdriven.io/blog/fastapi-and-celery/
 def create_app() -> FastAPI:
-    app = FastAPI(lifespan=manage_conn_pools)
+    app = FastAPI(lifespan=lifespan)
     # do this before loading routes
     app.celery_app = create_celery()
 
+    # before CORS, so a 413 still carries the CORS headers
+    app.add_middleware(UploadSizeLimit)
     app.add_middleware(
         CORSMiddleware,
         allow_origins=["*"],  # can alter with time
@@ -31,6 +50,10 @@ def create_app() -> FastAPI:
     version_router.include_router(knowledge_router)
     version_router.include_router(analysis_router)
     app.include_router(version_router)
+    # prometheus scrape target - outside /api/v1, where scrapers expect it
+    app.include_router(metrics_router)
+    # socket.io - asgi's socketio_path already includes the /ws prefix
+    app.mount("/ws", asgi)
 
     # Define root behavior so can verify externally if api is up
     @app.get("/")
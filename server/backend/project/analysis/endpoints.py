@@ -1,13 +1,18 @@
-from uuid import uuid4
-from fastapi import APIRouter, Request, Depends
+from uuid import UUID, uuid4
+from datetime import datetime, timezone, timedelta
+from fastapi import APIRouter, Request, Depends, HTTPException, Query
 from project.knowledge.models import Category
+from project.analysis.models import UploadJob, UploadChunk, CHUNK_STAGES
 from project.database import get_db_sess
+from project.config import settings
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, insert
+from sqlalchemy import select, insert, func
 
 from celery.result import AsyncResult
 
-from project.embedding.voyage import voyage_embedding
+from project.embedding.voyage import async_voyage_embedding
+from project.analysis import tasks
+from opentelemetry.propagate import inject
 
 
 analysis_router = APIRouter(
@@ -16,15 +21,91 @@ analysis_router = APIRouter(
 # ------------------------------------------------------------------------------
 # INTERACTION ENDPOINTS ********************************************************
 # ------------------------------------------------------------------------------
+async def _job_progress(job: UploadJob, session: AsyncSession):
+    ## chunks that finished each stage of the upload pipeline
+    rows = (await session.execute(
+        select(UploadChunk.stage, func.count())
+        .where(UploadChunk.job_id == job.id)
+        .group_by(UploadChunk.stage)
+    )).all()
+    counts = {row[0]: row[1] for row in rows}
+    # a chunk at a later stage has finished the earlier ones too
+    stages = {stage: sum(counts.get(later, 0) for later in CHUNK_STAGES[idx:])
+              for idx, stage in enumerate(CHUNK_STAGES)}
+    return {
+        "job_id": str(job.id),
+        "status": job.status,
+        "error": job.error,
+        "chunks": sum(counts.values()),
+        "stages": stages,
+    }
+
+
 @analysis_router.get("/task/{id}")
-async def status(id: str, request: Request):
+async def status(id: str, request: Request, session: AsyncSession = Depends(get_db_sess)):
     app = request.app
     task_result = AsyncResult(id, app=app.celery_app)
-    return {
+    result = {
         "task_id": id,
         "task_status": task_result.state,
         "task_result": task_result.result if task_result.state == 'SUCCESS' else None 
     }
+    job = (await session.scalars(
+        select(UploadJob)
+        .where(UploadJob.task_id == id)
+    )).first()
+    if job is not None:
+        result["job"] = await _job_progress(job, session)
+    return result
+
+
+async def _job_heartbeat(job: UploadJob, session: AsyncSession):
+    ## last time the pipeline wrote to the job or one of its chunks - every stage commits as it goes
+    last_chunk = await session.scalar(
+        select(func.max(UploadChunk.updated_time))
+        .where(UploadChunk.job_id == job.id)
+    )
+    return max(time for time in (job.updated_time, job.created_time, last_chunk) if time is not None)
+
+
+@analysis_router.post("/upload/{job_id}/resume")
+async def resume_upload(job_id: UUID, request: Request, parallelism: int = Query(None, ge=1),
+                        force: bool = False, session: AsyncSession = Depends(get_db_sess)):
+    ## reruns the upload pipeline - chunks keep the stage they reached, so only unfinished work is redone.
+    ## force skips the running check, for a job known to be dead that isn't stale yet
+    job_id = str(job_id)
+    job = (await session.scalars(
+        select(UploadJob)
+        .where(UploadJob.id == job_id)
+    )).first()
+    if job is None:
+        raise HTTPException(status_code=404, detail="Upload job not found")
+    if job.status == "done":
+        return {"task_id": job.task_id, "job_id": job_id}
+    if job.status == "expired":
+        raise HTTPException(status_code=410, detail="Upload file expired, upload it again")
+    # a second chain next to a running one would analyze the same chunks again. A chain whose
+    # worker died stays PENDING - once nothing was written for UPLOAD_STALE_SECONDS it's taken as dead
+    if not force and job.status != "failed" and not AsyncResult(job.task_id, app=request.app.celery_app).ready():
+        idle = datetime.now(timezone.utc) - await _job_heartbeat(job, session)
+        if idle < timedelta(seconds=settings.UPLOAD_STALE_SECONDS):
+            raise HTTPException(status_code=409, detail="Upload job is still running")
+
+    headers = {}
+    inject(headers)
+    pipe = tasks.upload_pipeline(job_id, headers, parallelism).apply_async()
+    job.task_id = str(pipe.id)
+    job.status = "queued"
+    job.error = None
+    await session.commit()
+    return {"task_id": str(pipe.id), "job_id": job_id}
+
+@analysis_router.post("/topics/consolidate")
+async def consolidate_topics():
+    ## merges near-duplicate topics in the background - poll /analysis/task/{id}
+    task = tasks.consolidate_topics.delay()
+    return {"task_id": str(task.id)}
+
 
 @analysis_router.post("/initialize")
 async def intialize(request: Request, session: AsyncSession = Depends(get_db_sess)):
@@ -40,7 +121,7 @@ async def intialize(request: Request, session: AsyncSession = Depends(get_db_ses
                   "Career", 
                   "Education",
                 ]
-    embeddings = voyage_embedding(categories, False, single=False)
+    embeddings = await async_voyage_embedding(categories, False, single=False)
 
     inserts = []
     for i in range(len(categories)):
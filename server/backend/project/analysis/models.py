@@ -0,0 +1,60 @@
+from typing import List
+import uuid
+from sqlalchemy import Column, Integer, Text, String, ForeignKey, DateTime, types, text
+from sqlalchemy.sql import func
+from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.orm import mapped_column, Mapped, relationship
+from project.database import Base
+from project.interact.models import Memory
+
+# Order chunks move through the upload pipeline - gen_file_memories, analyze_memories,
+# persist_knowledge, cluster_memories
+CHUNK_STAGES = ("embedded", "analyzed", "persisted", "linked")
+
+
+class UploadJob(Base):
+    __tablename__ = "upload_job"
+    id = mapped_column(types.Uuid, primary_key=True, server_default=text("uuid_generate_v4()"))
+
+    # file on the shared upload volume - cleared once its memories are committed, or once the
+    # job expires (analysis.tasks.expire_uploads)
+    filename = mapped_column(String(256), nullable=True)
+    path = mapped_column(Text, nullable=True)
+    # celery id of the latest run of the upload chain, what /analysis/task/{id} is polled with
+    task_id = mapped_column(String(64), nullable=True, index=True)
+    # values are "queued", "done", "failed", "expired" (failed before its file was embedded, and
+    # not resumed within UPLOAD_RESUME_SECONDS). Progress is tracked per chunk
+    status = mapped_column(String(20), nullable=False, server_default="queued")
+    error = mapped_column(Text, nullable=True)
+    # beliefs written by persist_knowledge, for cluster_memories to link
+    belief_ids = mapped_column(JSONB, nullable=True)
+
+    chunks: Mapped[List["UploadChunk"]] = relationship(cascade="all, delete")
+
+    updated_time = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+    created_time = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class UploadChunk(Base):
+    __tablename__ = "upload_chunk"
+    job_id: Mapped[uuid.UUID] = mapped_column(ForeignKey("upload_job.id", name="job_id_chunk_fkey", ondelete='CASCADE', onupdate='CASCADE'), primary_key=True)
+    seq = mapped_column(Integer, primary_key=True)
+    memory_id: Mapped[uuid.UUID] = mapped_column(ForeignKey("memory.id", name="memory_id_chunk_fkey", ondelete='SET NULL', onupdate='CASCADE'), nullable=True)
+
+    # last pipeline stage the chunk finished, one of CHUNK_STAGES
+    stage = mapped_column(String(20), nullable=False, server_default="embedded")
+    # analyze_memories output, {topic: {"beliefs": [...]}} - kept so retries never ask Claude twice
+    analysis = mapped_column(JSONB, nullable=True)
+
+    updated_time = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
+
+class AnalysisCache(Base):
+    __tablename__ = "analysis_cache"
+    # analysis.utils.analysis_key - sha256 of the model and the rendered analysis prompt
+    key = mapped_column(String(64), primary_key=True)
+    model = mapped_column(String(64), nullable=True)
+    # parsed analysis, {topic: {"beliefs": [...]}}
+    analysis = mapped_column(JSONB, nullable=False)
+
+    created_time = Column(DateTime(timezone=True), server_default=func.now())
@@ -1,100 +1,343 @@
+import os
+import random
+from contextlib import suppress
+from itertools import islice
+from datetime import datetime, timezone, timedelta
 import orjson as json
+import redis
 from uuid import uuid4
-from celery import shared_task, chord
-from sqlalchemy import delete, select, insert, update, func
+from celery import shared_task, chain, chord, group
+from sqlalchemy import delete, select, insert, update, func, true, union, union_all, literal, cast, bindparam
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import aliased
 from sqlalchemy.orm.exc import NoResultFound
 from project.database import get_sync_sess
+from project.cache import get_redis
+from project.config import settings
 
-from project.interact.models import Memory, Interaction, Exchange
+from project.interact.models import Memory, Interaction, Exchange, WritingSample, writing_sample_positions
+from project.analysis.models import UploadJob, UploadChunk, AnalysisCache
 from project.knowledge.models import Belief, Topic, TopicBelief, Category, BeliefMemory
-from project.embedding.voyage import voyage_embedding
-from project.prompt.claude import claude_norm_exchange, claude_call, claude_belief_analysis
-from project.analysis.utils import chunk_file
+from project.embedding.voyage import voyage_embedding, voyage_embedding_batched
+from project.prompt.claude import CLAUDE_MODEL, claude_norm_exchange, claude_call, claude_belief_analysis, claude_summarize_history
+from project.interact.utils import load_history, history_tokens, history_key, history_since_key, history_score, summary_key, raw, PRUNE_HISTORY_SCRIPT
+from project.analysis.utils import iter_file_chunks, batched, analysis_key
 from project.analysis.schemas import get_belief_analysis_schema
+from project.utils.db_types import Embedding, hnsw_ef_search
+from project.utils.bulk import bulk_insert
+from project.knowledge.cache import bump_knowledge_version, cosine_distance
 
 from opentelemetry.propagate import inject, extract
 from opentelemetry import trace
 from opentelemetry.trace.status import StatusCode
 
 
+def update_writing_samples(db_session, memories: list):
+    ## Reservoir sampling (Algorithm R) over every memory ever added - keeps the pool a uniform
+    ## sample of the corpus without rereading it (memory rows as written by bulk_insert).
+    ## Positions come from writing_sample_position_seq, so concurrent uploads never share one,
+    ## and a slot only takes a later position than it holds, whatever order uploads commit in
+    ## https://en.wikipedia.org/wiki/Reservoir_sampling#Simple:_Algorithm_R
+    size = settings.STYLE_SAMPLE_POOL_SIZE
+    positions = db_session.scalars(
+        select(writing_sample_positions.next_value())
+        .select_from(func.generate_series(1, len(memories)))
+    ).all()
+    replacements = {}
+    for memory, position in zip(memories, positions):
+        slot = position if position < size else random.randint(0, position)
+        if slot < size and (slot not in replacements or replacements[slot]["position"] < position):
+            replacements[slot] = {"slot": slot, "memory_id": memory["id"], "position": position}
+
+    if replacements:
+        upsert = pg_insert(WritingSample).values(list(replacements.values()))
+        db_session.execute(upsert.on_conflict_do_update(
+            index_elements=[WritingSample.slot],
+            set_={"memory_id": upsert.excluded.memory_id, "position": upsert.excluded.position},
+            where=WritingSample.position < upsert.excluded.position,
+        ))
+
+
+def dedup_topics(names: list, embeddings: list):
+    ## {name: earlier name} for every name within TOPIC_MERGE_DISTANCE (cosine) of an earlier
+    ## name in the same list. Earlier names win
+    duplicates = {}
+    kept = []
+    for name, embedding in zip(names, embeddings):
+        same = next((other for other, other_embedding in kept
+                     if cosine_distance(embedding, other_embedding) <= settings.TOPIC_MERGE_DISTANCE), None)
+        if same is None:
+            kept.append((name, embedding))
+        else:
+            duplicates[name] = same
+    return duplicates
+
+
+def match_existing_topics(db_session, names: list, embeddings: list):
+    ## {name: topic id} for every name within TOPIC_MERGE_DISTANCE (cosine) of an existing
+    ## topic. One query - the nearest topic per name through the HNSW index
+    if not names:
+        return {}
+    candidates = union_all(*[
+        select(literal(idx).label("idx"),
+               cast(bindparam(f"topic_{idx}", embedding, type_=Embedding(512)), Embedding(512)).label("embedding"))
+        for idx, embedding in enumerate(embeddings)
+    ]).cte("candidates")
+    db_session.execute(hnsw_ef_search())
+    nearest = (
+        select(Topic.id.label("topic_id"),
+               Topic.embedding.cosine_distance(candidates.c.embedding).label("distance"))
+        .order_by(Topic.embedding.l2_distance(candidates.c.embedding))
+        .limit(1)
+        .lateral()
+    )
+    rows = db_session.execute(
+        select(candidates.c.idx, nearest.c.topic_id, nearest.c.distance)
+        .join_from(candidates, nearest, true())
+    ).all()
+    return {names[row[0]]: str(row[1]) for row in rows
+            if row[2] is not None and row[2] <= settings.TOPIC_MERGE_DISTANCE}
+
+
+def upload_pipeline(job_id: str, headers, parallelism: int = None):
+    ## The upload chain for an UploadJob. Every stage skips the chunks an earlier run already
+    ## took past it, so the same chain starts a job and resumes one that failed part way
+    return chain(gen_file_memories.s(job_id),
+                 gen_new_knowledge.s(headers=headers, parallelism=parallelism),
+                 cluster_memories.s())
+
+
+def retry_job(task, job_id: str, exc: Exception):
+    ## Retries a pipeline task, marking the job failed once its retries are spent. Whatever
+    ## was checkpointed stays, the upload file included, so a failed job can be resumed later
+    if task.request.retries >= task.max_retries:
+        with get_sync_sess() as db_session:
+            db_session.execute(
+                update(UploadJob)
+                .where(UploadJob.id == job_id)
+                .values(status="failed", error=str(exc))
+            )
+            db_session.commit()
+    return task.retry(exc=exc)
+
+
+def knowledge_from_analysis(analysis: dict):
+    ## Claude's belief analysis as {topic: {"beliefs": [...]}}, with our belief type names
+    knowledge_map = {}
+    for item in analysis["topics"]["topics"]:
+        topic = item["topic"]
+        if topic not in knowledge_map:
+            knowledge_map[topic] = {"beliefs": []}
+
+        additions = item["beliefs"]
+        for belief in additions:
+            if belief["type"] == "core belief":
+                belief["type"] = "value"
+            elif belief["type"] == "key opinion":
+                belief["type"] = "opinion"
+            elif belief["type"] == "emotional reflection":
+                belief["type"] = "emotion"
+        knowledge_map[topic]["beliefs"] += additions
+    return knowledge_map
+
+
 # https://stackoverflow.com/questions/39815771/how-to-combine-celery-with-asyncio
-@shared_task(max_retries=3, default_retry_delay=60)
-def gen_file_memories(content: bytes, filename: str, chunk_size: int = 750):
-    ## Process uploaded text file into memories
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def gen_file_memories(self, job_id: str, chunk_size: int = 750):
+    ## Process an uploaded file (saved by interact.utils.save_upload) into memories, with an
+    ## upload_chunk row per memory. Chunks are committed BULK_INSERT_BATCH_SIZE at a time and a
+    ## retry or resume picks up after the last one. The file is removed with the last batch -
+    ## until then it's kept for resuming, see expire_uploads
     with get_sync_sess() as db_session:
         try:
-            chunks = chunk_file(content, filename, chunk_size)
-            # print(f"Worker Debug: Created {len(chunks)} chunks")
-            memory_ids = []
-
-            for chunk in chunks:
-                memory_id = str(uuid4())
-                embedding = voyage_embedding([chunk], query=False) 
-                # print(f"Worker Debug: Embedding type: {type(embedding)}, shape: {len(embedding) if isinstance(embedding, list) else 'not a list'}")
-                memory = Memory(
-                    id=memory_id,
-                    text=chunk,
-                    embedding=embedding,
-                    impact=0.0
-                )
-                db_session.add(memory)
-                memory_ids.append(memory_id)
+            expire_uploads(db_session)
+            job = db_session.get(UploadJob, job_id)
+            path, filename = job.path, job.filename
+            if path is None:
+                # resumed - every chunk was committed by an earlier run
+                return job_id
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Upload {filename} is no longer stored, upload it again")
+            last = db_session.scalar(select(func.max(UploadChunk.seq)).where(UploadChunk.job_id == job_id))
+            count = 0 if last is None else last + 1
+
+            # chunks are read, embedded and written a round at a time, so worker memory stays
+            # flat however large the file is. Chunking is deterministic, so the first `count`
+            # are the ones already committed
+            chunks = islice(iter_file_chunks(path, filename, chunk_size), count, None)
+            uncommitted = 0
+            round_size = settings.EMBEDDING_BATCH_SIZE * settings.EMBEDDING_WORKERS
+            for batch in batched(chunks, round_size):
+                embeddings = voyage_embedding_batched(batch, query=False)
+                if embeddings is None:
+                    raise RuntimeError(f"Failed to embed chunks of {filename}")
+                memories = []
+                for chunk, embedding in zip(batch, embeddings):
+                    memories.append({"id": str(uuid4()), "text": chunk,
+                                     "embedding": embedding, "impact": 0.0})
+
+                # memories have to exist before samples and chunks can reference them
+                bulk_insert(db_session, Memory, memories)
+                bulk_insert(db_session, UploadChunk, [
+                    {"job_id": job_id, "seq": count + idx, "memory_id": memory["id"], "stage": "embedded"}
+                    for idx, memory in enumerate(memories)
+                ])
+                update_writing_samples(db_session, memories)
+                count += len(memories)
+                uncommitted += len(memories)
+                if uncommitted >= settings.BULK_INSERT_BATCH_SIZE:
+                    db_session.commit()
+                    uncommitted = 0
 
+            job = db_session.get(UploadJob, job_id)
+            job.path = None
             db_session.commit()
-            return memory_ids
+            os.remove(path)
+            return job_id
 
-        except Exception as e:
-            print(f"Worker Debug: Error in process_upload: {str(e)}")
+        except Exception as exc:
+            print(f"Worker Debug: Error in process_upload: {str(exc)}")
             db_session.rollback()
-            raise
+            raise retry_job(self, job_id, exc)
 
 
-@shared_task(max_retries=3, default_retry_delay=60)
-def gen_new_knowledge(memory_ids: list, headers):
+def expire_uploads(db_session):
+    ## Files of failed jobs are kept so the job can be resumed - for UPLOAD_RESUME_SECONDS after
+    ## it failed. Past that the file is removed and the job marked "expired". Run at the start of
+    ## every upload, so the upload directory never grows without new uploads coming in
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=settings.UPLOAD_RESUME_SECONDS)
+    jobs = db_session.scalars(
+        select(UploadJob)
+        .where(UploadJob.status == "failed", UploadJob.path.is_not(None),
+               UploadJob.updated_time < cutoff)
+        .with_for_update(skip_locked=True)
+    ).all()
+    for job in jobs:
+        with suppress(FileNotFoundError):
+            os.remove(job.path)
+        job.path = None
+        job.status = "expired"
+    db_session.commit()
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def gen_new_knowledge(self, job_id: str, headers, parallelism: int = None):
+    ## Fan belief extraction out over at most `parallelism` analyze_memories tasks, then merge
+    ## and write everything in persist_knowledge. The rest of the chain runs after the chord.
+    # chunks analyzed by an earlier run keep their results - only the rest go back to Claude
+    with get_sync_sess() as db_session:
+        seqs = db_session.scalars(
+            select(UploadChunk.seq)
+            .where(UploadChunk.job_id == job_id, UploadChunk.stage == "embedded")
+            .order_by(UploadChunk.seq)
+        ).all()
+    if not seqs:
+        return self.replace(persist_knowledge.si([], job_id, headers))
+
+    # Capped so one large upload can't take every worker in the cluster
+    parallelism = max(1, min(parallelism or settings.ANALYSIS_PARALLELISM, settings.ANALYSIS_MAX_PARALLELISM))
+    batch_size = max(1, -(-len(seqs) // parallelism))
+    batches = [seqs[i:i + batch_size] for i in range(0, len(seqs), batch_size)]
+
+    workflow = chord(
+        group(analyze_memories.s(job_id, batch, headers) for batch in batches),
+        persist_knowledge.s(job_id, headers)
+    )
+    # https://docs.celeryq.dev/en/stable/userguide/tasks.html#replace
+    return self.replace(workflow)
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def analyze_memories(self, job_id: str, seqs: list, headers):
+    ## Belief extraction for one batch of an upload's chunks. Each result is saved on its chunk
+    ## as soon as Claude answers, so a retry picks up at the first chunk still unanalyzed.
+    ## Passages analyzed before (re-uploads, overlapping exports) come from the analysis cache
     tracer = trace.get_tracer(__name__)
     context = extract(headers)
-    
-    # If task takes long we need a lock to prevent multiple instances created updates at the same time
-    # https://docs.celeryq.dev/en/latest/tutorials/task-cookbook.html#cookbook-task-serial
-    with get_sync_sess() as db_session:  # execute until yield. Session is yielded value
+    schema = get_belief_analysis_schema()
+
+    with get_sync_sess() as db_session:
+        rows = db_session.execute(
+            select(UploadChunk.seq, Memory.text)
+            .join(Memory, Memory.id == UploadChunk.memory_id)
+            .where(UploadChunk.job_id == job_id, UploadChunk.seq.in_(seqs),
+                   UploadChunk.stage == "embedded")
+            .order_by(UploadChunk.seq)
+        ).all()
+        prompts = [claude_belief_analysis(schema, row[1]) for row in rows]
+        keys = [analysis_key(prompt, CLAUDE_MODEL) for prompt in prompts]
+        cached = dict(db_session.execute(
+            select(AnalysisCache.key, AnalysisCache.analysis)
+            .where(AnalysisCache.key.in_(keys))
+        ).all())
+
+    for (seq, text), analysis_prompt, key in zip(rows, prompts, keys):
         try:
-            rows = db_session.execute(
-                select(Memory.id, Memory.text, Memory.summary, Memory.embedding)
-                .where(Memory.id.in_(memory_ids))
-                .order_by(Memory.created_time.desc())
-            ).all()
-             
-            knowledge_map = {}
-            for row in rows:
-                memory_id = str(row[0])
-                text = row[1]
+            knowledge_map = cached.get(key)
+            fresh = knowledge_map is None
+            if fresh:
                 # Call helper functions using memory attributes to extract beliefs
                 with tracer.start_as_current_span("ChatAnthropic", context=context) as span:
-                    schema = get_belief_analysis_schema()
-                    analysis_prompt = claude_belief_analysis(schema, text)
                     analysis_raw = claude_call(analysis_prompt)
-                    analysis = json.loads(analysis_raw)
+                    try:
+                        knowledge_map = knowledge_from_analysis(json.loads(analysis_raw))
+                    except (ValueError, KeyError, TypeError) as exc:
+                        # asking again costs another call for what is likely the same answer - the
+                        # chunk just contributes no beliefs. Not cached, a later upload may do better
+                        print(f"Worker Debug: Unparseable analysis of chunk {seq} of {job_id}: {str(exc)}")
+                        knowledge_map = {}
+                        fresh = False
                     span.set_input({"text": text, "schema": schema})
-                    span.set_output({"analysis": analysis})
+                    span.set_output({"analysis": knowledge_map})
                     span.set_status(StatusCode.OK)
 
-                analysis = analysis["topics"]["topics"]
-                for item in analysis:
-                    topic = item["topic"]
+            with get_sync_sess() as db_session:
+                db_session.execute(
+                    update(UploadChunk)
+                    .where(UploadChunk.job_id == job_id, UploadChunk.seq == seq)
+                    .values(stage="analyzed", analysis=knowledge_map)
+                )
+                if fresh:
+                    db_session.execute(
+                        pg_insert(AnalysisCache)
+                        .values(key=key, model=CLAUDE_MODEL, analysis=knowledge_map)
+                        .on_conflict_do_nothing()
+                    )
+                    # repeats within the batch
+                    cached[key] = knowledge_map
+                db_session.commit()
+        except Exception as exc:
+            print(f"Worker Debug: Error analyzing chunk {seq} of {job_id}: {str(exc)}")
+            raise retry_job(self, job_id, exc)
+    return len(rows)
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def persist_knowledge(self, results: list, job_id: str, headers):
+    ## Chord callback - merges the analyses saved on the job's chunks and writes topics and
+    ## beliefs in bulk. Beliefs and the chunks' "persisted" stage commit together, so a retry
+    ## can't write the same beliefs twice
+    # If task takes long we need a lock to prevent multiple instances created updates at the same time
+    # https://docs.celeryq.dev/en/latest/tutorials/task-cookbook.html#cookbook-task-serial
+    with get_sync_sess() as db_session:  # execute until yield. Session is yielded value
+        try:
+            chunks = db_session.execute(
+                select(UploadChunk.seq, UploadChunk.analysis)
+                .where(UploadChunk.job_id == job_id, UploadChunk.stage == "analyzed")
+                .order_by(UploadChunk.seq)
+                .with_for_update()
+            ).all()
+            if not chunks:
+                db_session.rollback()
+                return job_id
+
+            knowledge_map = {}
+            for _, analysis in chunks:
+                for topic, item in (analysis or {}).items():
                     if topic not in knowledge_map:
                         knowledge_map[topic] = {"beliefs": []}
+                    knowledge_map[topic]["beliefs"] += item["beliefs"]
 
-                    additions = item["beliefs"]
-                    for belief in additions:
-                        if belief["type"] == "core belief":
-                            belief["type"] = "value"
-                        elif belief["type"] == "key opinion":
-                            belief["type"] = "opinion"
-                        elif belief["type"] == "emotional reflection":
-                            belief["type"] = "emotion"
-                    knowledge_map[topic]["beliefs"] += additions
-            
             topics = [topic for topic in knowledge_map]
             topic_ids = [str(uuid4()) for topic in topics]
 
@@ -108,34 +351,48 @@ def gen_new_knowledge(memory_ids: list, headers):
             ).all()
             old_topics = [str(row[1]) for row in existing]
             new_topics = [topic for topic in topics if topic not in old_topics]
-            topic_embeddings = voyage_embedding(new_topics, False, single=False)
+            topic_embeddings = voyage_embedding(new_topics, False, single=False) if new_topics else []
 
             old_topic_ids = [str(row[0]) for row in existing]
             for idx, topic in enumerate(old_topics):
                 topic_map[topic] = old_topic_ids[idx]
-            
+
+            # near-duplicate names ("Career", "career growth") join the topic they resolve to
+            # instead of becoming topics of their own - first within the upload, then against
+            # the existing topics
+            duplicates = dedup_topics(new_topics, topic_embeddings)
+            kept = [idx for idx, topic in enumerate(new_topics) if topic not in duplicates]
+            new_topics = [new_topics[idx] for idx in kept]
+            topic_embeddings = [topic_embeddings[idx] for idx in kept]
+            matches = match_existing_topics(db_session, new_topics, topic_embeddings)
+            topic_map.update(matches)
+            for topic, same in duplicates.items():
+                topic_map[topic] = topic_map[same]
+            kept = [idx for idx, topic in enumerate(new_topics) if topic not in matches]
+            new_topics = [new_topics[idx] for idx in kept]
+            topic_embeddings = [topic_embeddings[idx] for idx in kept]
+
             topic_inserts = []
             for idx, topic in enumerate(new_topics):
                 topic_inserts.append({"id": topic_map[topic],
-                                      "name": topic, 
+                                      "name": topic,
                                       "embedding": topic_embeddings[idx]})
-            
-            db_session.execute(insert(Topic), topic_inserts)
-            db_session.commit()
 
-            subquery = ( 
-                select(Topic.id.label("topic_id"), Category.id.label("category_id"), 
-                    func.rank().over(
-                        order_by=Category.embedding.l2_distance(Topic.embedding),
-                        partition_by=Topic.id
-                    ).label('rank'))
-                .where(Topic.id.in_(topic_ids))
-                .join_from(Topic, Category, Topic.category_id.is_(None))
-                .subquery()
+            if topic_inserts:
+                db_session.execute(insert(Topic), topic_inserts)
+
+            # closest category per new topic
+            db_session.execute(hnsw_ef_search())
+            nearest_category = (
+                select(Category.id.label("category_id"))
+                .order_by(Category.embedding.l2_distance(Topic.embedding))
+                .limit(1)
+                .lateral()
             )
             rows = db_session.execute(
-                select(subquery.c.topic_id, subquery.c.category_id, subquery.c.rank)
-                .where(subquery.c.rank < 2)
+                select(Topic.id, nearest_category.c.category_id)
+                .join_from(Topic, nearest_category, true())
+                .where(Topic.id.in_(topic_ids), Topic.category_id.is_(None))
             ).all()
 
             topic_updates = []
@@ -143,68 +400,244 @@ def gen_new_knowledge(memory_ids: list, headers):
                 topic_id = str(row[0])
                 category_id = str(row[1])
                 topic_updates.append({"id": topic_id, "category_id": category_id})
-            db_session.execute(update(Topic), topic_updates)
-            db_session.commit()
+            if topic_updates:
+                db_session.execute(update(Topic), topic_updates)
 
 
-            # Update the database with extracted beliefs
+            # Update the database with extracted beliefs - embedded together, not per topic
+            pairs = [(topic, belief) for topic in knowledge_map for belief in knowledge_map[topic]["beliefs"]]
+            embeddings = voyage_embedding_batched([belief["belief"] for _, belief in pairs], query=False) if pairs else []
+            if embeddings is None:
+                raise RuntimeError(f"Failed to embed beliefs of {job_id}")
             belief_inserts = []
             topic_belief_inserts = []
-            for topic in knowledge_map:
-                beliefs = knowledge_map[topic]["beliefs"]
-                embeddings = voyage_embedding([belief["belief"] for belief in beliefs], False, single=False)
-                for idx, belief in enumerate(beliefs):
-                    belief_id = str(uuid4())
-                    belief_inserts.append({"id": belief_id, 
-                                           "text": belief["belief"], 
-                                           "embedding": embeddings[idx], 
-                                           "type": belief["type"]})
-                    topic_belief_inserts.append({"topic_id": topic_map[topic], 
-                                                 "belief_id": belief_id})
-
-            db_session.execute(insert(Belief), belief_inserts)
-            db_session.execute(insert(TopicBelief), topic_belief_inserts)
+            for idx, (topic, belief) in enumerate(pairs):
+                belief_id = str(uuid4())
+                belief_inserts.append({"id": belief_id,
+                                       "text": belief["belief"],
+                                       "embedding": embeddings[idx],
+                                       "type": belief["type"]})
+                topic_belief_inserts.append({"topic_id": topic_map[topic],
+                                             "belief_id": belief_id})
+
+            bulk_insert(db_session, Belief, belief_inserts)
+            bulk_insert(db_session, TopicBelief, topic_belief_inserts)
+            # cluster_memories links the new beliefs as well as the new memories
+            job = db_session.get(UploadJob, job_id)
+            job.belief_ids = (job.belief_ids or []) + [belief["id"] for belief in belief_inserts]
+            db_session.execute(
+                update(UploadChunk)
+                .where(UploadChunk.job_id == job_id, UploadChunk.seq.in_([seq for seq, _ in chunks]))
+                .values(stage="persisted")
+            )
             db_session.commit()
-            return memory_ids
+            if belief_inserts:
+                bump_knowledge_version()
+            return job_id
         except Exception as exc:
             db_session.rollback()
-            print(exc)
+            print(f"Worker Debug: Error persisting knowledge of {job_id}: {str(exc)}")
+            raise retry_job(self, job_id, exc)
 
 
-@shared_task(max_retries=3, default_retry_delay=60)
-def cluster_memories(memory_ids: list):
-    # If task takes long we need a lock to prevent multiple instances created updates at the same time
-    # https://docs.celeryq.dev/en/latest/tutorials/task-cookbook.html#cookbook-task-serial
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def cluster_memories(self, job_id: str):
+    ## Links an upload into the belief graph with indexed nearest-neighbor lookups - the k
+    ## closest beliefs of every new memory, and the k closest memories (old or new) of every
+    ## new belief. Cost follows the size of the upload, not of the corpus
+    k = settings.BELIEF_MEMORY_LINKS
+
     with get_sync_sess() as db_session:  # execute until yield. Session is yielded value
         try:
-            rows = db_session.execute(
-                select(Memory.id, Memory.text, Memory.summary, Memory.embedding)
-                .where(Memory.id.in_(memory_ids))
-                .order_by(Memory.created_time.desc())
+            job = db_session.get(UploadJob, job_id)
+            belief_ids = job.belief_ids or []
+            memory_ids = db_session.scalars(
+                select(UploadChunk.memory_id)
+                .where(UploadChunk.job_id == job_id, UploadChunk.stage == "persisted")
             ).all()
-            
-            subquery = ( 
-                select(Belief.id.label("belief_id"), Memory.id.label("memory_id"), 
-                    func.rank().over(
-                        order_by=Belief.embedding.l2_distance(Memory.embedding),
-                        partition_by=Belief.id
-                    ).label('rank'))
-                .where(Memory.id.in_(memory_ids))
-                .join_from(Belief, Memory, Memory.id.is_not(None))
-                .subquery()
+
+            if memory_ids:
+                db_session.execute(hnsw_ef_search())
+                nearest_beliefs = (
+                    select(Belief.id.label("belief_id"))
+                    .order_by(Belief.embedding.l2_distance(Memory.embedding))
+                    .limit(k)
+                    .lateral()
+                )
+                memory_links = (
+                    select(nearest_beliefs.c.belief_id, Memory.id.label("memory_id"))
+                    .join_from(Memory, nearest_beliefs, true())
+                    .where(Memory.id.in_(memory_ids))
+                )
+                nearest_memories = (
+                    select(Memory.id.label("memory_id"))
+                    .order_by(Memory.embedding.l2_distance(Belief.embedding))
+                    .limit(k)
+                    .lateral()
+                )
+                belief_links = (
+                    select(Belief.id.label("belief_id"), nearest_memories.c.memory_id)
+                    .join_from(Belief, nearest_memories, true())
+                    .where(Belief.id.in_(belief_ids))
+                )
+                # INSERT ... SELECT - the links never leave the database. Rerunning it is
+                # harmless, so linking is checkpointed with the job as a whole
+                db_session.execute(
+                    pg_insert(BeliefMemory)
+                    .from_select(["belief_id", "memory_id"], union(memory_links, belief_links))
+                    .on_conflict_do_nothing()
+                )
+                db_session.execute(
+                    update(UploadChunk)
+                    .where(UploadChunk.job_id == job_id, UploadChunk.stage == "persisted")
+                    .values(stage="linked")
+                )
+
+            job.status = "done"
+            job.error = None
+            db_session.commit()
+            if memory_ids:
+                bump_knowledge_version()
+            return job_id
+        except Exception as exc:
+            db_session.rollback()
+            print(f"Worker Debug: Error linking {job_id}: {str(exc)}")
+            raise retry_job(self, job_id, exc)
+
+
+@shared_task(max_retries=3, default_retry_delay=60)
+def summarize_interaction(interaction_id: str):
+    ## Folds all but the last HISTORY_RECENT_EXCHANGES exchanges into the interaction's rolling
+    ## summary, so chat prompts carry summary + recent turns instead of the whole conversation
+    try:
+        return _summarize_interaction(interaction_id)
+    finally:
+        # lets the chat endpoint queue the next run (interact.utils.claim_summary)
+        try:
+            get_redis().delete(summary_key(interaction_id))
+        except redis.RedisError as e:
+            print(f"History cache unavailable: {str(e)}")
+
+
+def _summarize_interaction(interaction_id: str):
+    tracer = trace.get_tracer(__name__)
+    with get_sync_sess() as db_session:
+        try:
+            interaction = db_session.get(Interaction, interaction_id)
+            summary, since = interaction.summary, interaction.summarized_until
+            query = (
+                select(Exchange.id, Exchange.text, Exchange.created_time)
+                .where(Exchange.interaction_id == interaction_id)
+                .order_by(Exchange.created_time.asc())
             )
-            rows = db_session.execute(
-                select(subquery.c.belief_id, subquery.c.memory_id, subquery.c.rank)
-                .where(subquery.c.rank <= 3)
+            if since is not None:
+                query = query.where(Exchange.created_time > since)
+            rows = db_session.execute(query).all()
+            # no transaction (or lock) open during the Claude call
+            db_session.rollback()
+
+            keep = settings.HISTORY_RECENT_EXCHANGES
+            older = rows[:-keep] if keep else rows
+            # the same test the chat endpoint triggers on - only the older turns count
+            if not older or history_tokens(load_history(older)) <= settings.HISTORY_SUMMARY_TOKENS:
+                return interaction_id
+
+            with tracer.start_as_current_span("summarize_history", openinference_span_kind="llm") as span:
+                formatted = "".join(raw(message) for message in load_history(older))
+                span.set_input({"summary": summary, "history": formatted})
+                response = claude_call(claude_summarize_history(summary, formatted))
+                summary = json.loads(response)["summary"]
+                span.set_output({"summary": summary})
+                span.set_status(StatusCode.OK)
+
+            # row lock for the update only - a run that got here first already moved the
+            # summary on, and this one's would drop what it added
+            interaction = db_session.scalars(
+                select(Interaction)
+                .where(Interaction.id == interaction_id)
+                .with_for_update()
+                .execution_options(populate_existing=True)
+            ).one()
+            if interaction.summarized_until != since:
+                db_session.rollback()
+                return interaction_id
+            until = older[-1][2]
+            interaction.summary = summary
+            interaction.summarized_until = until
+            db_session.commit()
+        except Exception as e:
+            db_session.rollback()
+            print(f"Worker Debug: Error summarizing interaction {interaction_id}: {str(e)}")
+            return interaction_id
+
+    # the cached set still holds the exchanges that are now in the summary
+    try:
+        prune = get_redis().register_script(PRUNE_HISTORY_SCRIPT)
+        prune(keys=[history_key(interaction_id), history_since_key(interaction_id)], args=[history_score(until)])
+    except redis.RedisError as e:
+        print(f"History cache unavailable: {str(e)}")
+    return interaction_id
+
+
+@shared_task(bind=True, max_retries=3, default_retry_delay=60)
+def consolidate_topics(self):
+    ## Offline clean-up of duplicates created before topics were matched by embedding. Largest
+    ## topics first, each absorbs the unclaimed neighbors within TOPIC_MERGE_DISTANCE (cosine):
+    ## their beliefs move over and the duplicates are deleted
+    with get_sync_sess() as db_session:
+        try:
+            db_session.execute(hnsw_ef_search())
+            other = aliased(Topic)
+            neighbors = (
+                select(other.id.label("topic_id"),
+                       other.embedding.cosine_distance(Topic.embedding).label("distance"))
+                .where(other.id != Topic.id)
+                .order_by(other.embedding.l2_distance(Topic.embedding))
+                .limit(settings.TOPIC_MERGE_NEIGHBORS)
+                .lateral()
+            )
+            pairs = db_session.execute(
+                select(Topic.id, neighbors.c.topic_id)
+                .join_from(Topic, neighbors, true())
+                .where(neighbors.c.distance <= settings.TOPIC_MERGE_DISTANCE)
             ).all()
+            if not pairs:
+                return {"merged": 0}
 
-            belief_memory_inserts = []
-            for row in rows:
-                belief_id = str(row[0])
-                memory_id = str(row[1])
-                belief_memory_inserts.append({"belief_id": belief_id, "memory_id": memory_id})
-            db_session.execute(insert(BeliefMemory), belief_memory_inserts)
+            sizes = dict(db_session.execute(
+                select(TopicBelief.topic_id, func.count())
+                .group_by(TopicBelief.topic_id)
+            ).all())
+            close = {}
+            for topic_id, neighbor_id in pairs:
+                close.setdefault(topic_id, set()).add(neighbor_id)
+                close.setdefault(neighbor_id, set()).add(topic_id)
+
+            claimed = set()
+            merges = {}
+            for topic_id in sorted(close, key=lambda topic_id: (-sizes.get(topic_id, 0), str(topic_id))):
+                if topic_id in claimed:
+                    continue
+                claimed.add(topic_id)
+                duplicates = [neighbor_id for neighbor_id in close[topic_id] if neighbor_id not in claimed]
+                claimed.update(duplicates)
+                if duplicates:
+                    merges[topic_id] = duplicates
+
+            for topic_id, duplicates in merges.items():
+                db_session.execute(
+                    pg_insert(TopicBelief)
+                    .from_select(["topic_id", "belief_id"],
+                                 select(literal(topic_id, type_=Topic.id.type), TopicBelief.belief_id)
+                                 .where(TopicBelief.topic_id.in_(duplicates)))
+                    .on_conflict_do_nothing()
+                )
+                # topic_belief rows of the duplicates go with them (ON DELETE CASCADE)
+                db_session.execute(delete(Topic).where(Topic.id.in_(duplicates)))
             db_session.commit()
+            bump_knowledge_version()
+            return {"merged": sum(len(duplicates) for duplicates in merges.values())}
         except Exception as exc:
             db_session.rollback()
-            print(exc)
+            print(f"Worker Debug: Error consolidating topics: {str(exc)}")
+            raise self.retry(exc=exc)
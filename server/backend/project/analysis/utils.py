@@ -1,9 +1,12 @@
+import hashlib
 import orjson as json
 # for other text file processing
 import docx
 from odf import text, teletype
 from odf.opendocument import load
 import io
+import zipfile
+from xml.etree import ElementTree
 
 def format_exchange(exchange: str):
     role_map = {
@@ -64,46 +67,164 @@ def extract_text_from_file(content: bytes, filename: str) -> str:
     else: ## we dont support .doc because that is old word format
         raise ValueError(f"Unsupported file type: {filename}")
 
-def chunk_file(content: bytes, filename: str, limit: int = 750) -> list[str]:
-    text = extract_text_from_file(content, filename)
-    # print(f"Debug: Starting to chunk text from {filename}")
-    
-    # Normalize each paragraph. right now this is naive normalization
-    ## in the future we will need to account for essays, manifestos etc
-    paragraphs = [p.strip() for p in text.split('\n\n') if p.strip()]
-    
-    chunks = []
+# A txt "paragraph" with no blank lines is handed to the chunker in pieces of about this
+# many characters, so one giant paragraph can't hold the whole file in memory either
+MAX_PARAGRAPH_CHARS = 1024 * 1024
+
+W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+TEXT = "{urn:oasis:names:tc:opendocument:xmlns:text:1.0}"
+
+
+def _txt_paragraphs(stream):
+    reader = io.TextIOWrapper(stream, encoding="utf-8")
+    lines = []
+    size = 0
+    while line := reader.readline(MAX_PARAGRAPH_CHARS):
+        if not line.strip():
+            if lines:
+                yield "".join(lines)
+                lines, size = [], 0
+            continue
+        lines.append(line)
+        size += len(line)
+        if size >= MAX_PARAGRAPH_CHARS:
+            yield "".join(lines)
+            lines, size = [], 0
+    if lines:
+        yield "".join(lines)
+
+
+def _docx_run_text(run) -> str:
+    # same as python-docx Run.text
+    text = []
+    for child in run:
+        if child.tag == W + "t":
+            text.append(child.text or "")
+        elif child.tag == W + "tab":
+            text.append("\t")
+        elif child.tag in (W + "br", W + "cr"):
+            text.append("\n")
+    return "".join(text)
+
+
+def _outermost(document, tag: str, skip: str = None):
+    ## iterparse that yields each outermost `tag` element once it is complete (none inside
+    ## `skip` elements), then drops it from the tree so memory stays flat
+    path = []
+    for event, element in ElementTree.iterparse(document, events=("start", "end")):
+        if event == "start":
+            path.append(element)
+            continue
+        path.pop()
+        if element.tag == tag and not any(parent.tag in (tag, skip) for parent in path):
+            yield element
+            if path:
+                path[-1].remove(element)
+        elif element.tag == skip and not any(parent.tag == skip for parent in path) and path:
+            path[-1].remove(element)
+
+
+def _docx_paragraphs(stream):
+    ## Body paragraphs of word/document.xml (what Document.paragraphs returns). Unlike
+    ## Paragraph.text in python-docx 0.8.11, hyperlink text is kept, where it sits in the sentence
+    with zipfile.ZipFile(stream) as archive, archive.open("word/document.xml") as document:
+        for paragraph in _outermost(document, W + "p", skip=W + "tbl"):
+            text = []
+            for child in paragraph:
+                if child.tag == W + "r":
+                    text.append(_docx_run_text(child))
+                elif child.tag == W + "hyperlink":
+                    text += [_docx_run_text(run) for run in child.findall(W + "r")]
+            yield "".join(text)
+
+
+def _odt_text(element) -> list:
+    # same as odf.teletype.extractText - spaces, tabs and line breaks are elements in odt
+    text = [element.text or ""]
+    for child in element:
+        if child.tag == TEXT + "s":
+            text.append(" " * int(child.get(TEXT + "c", "1")))
+        elif child.tag == TEXT + "tab":
+            text.append("\t")
+        elif child.tag == TEXT + "line-break":
+            text.append("\n")
+        else:
+            text += _odt_text(child)
+        text.append(child.tail or "")
+    return text
+
+
+def _odt_paragraphs(stream):
+    with zipfile.ZipFile(stream) as archive, archive.open("content.xml") as content:
+        for paragraph in _outermost(content, TEXT + "p"):
+            yield "".join(_odt_text(paragraph))
+
+
+def iter_paragraphs(stream, filename: str):
+    ## Paragraphs of a .txt, .docx or .odt file, read from a binary file object one at a time
+    if filename.lower().endswith('.txt'):
+        yield from _txt_paragraphs(stream)
+    elif filename.lower().endswith('.docx'):
+        yield from _docx_paragraphs(stream)
+    elif filename.lower().endswith('.odt'):
+        yield from _odt_paragraphs(stream)
+    else: ## we dont support .doc because that is old word format
+        raise ValueError(f"Unsupported file type: {filename}")
+
+
+def chunk_paragraphs(paragraphs, limit: int = 750):
+    ## Packs paragraphs into chunks of up to `limit` words. A paragraph longer than that is
+    ## split into `limit`-word chunks of its own. Linear in the input, holds one chunk at a time
     current_chunk = []
     current_length = 0
-    
+
     for para in paragraphs:
-        para_words = len(para.split())
-        
+        para = para.strip()
+        if not para:
+            continue
+        words = para.split()
+
         # If adding this paragraph would exceed limit and we have content
-        if current_length + para_words > limit:
-            # If we have current content, create a chunk
+        if current_length + len(words) > limit:
             if current_chunk:
-                chunks.append(' '.join(current_chunk))
+                yield ' '.join(current_chunk)
                 current_chunk = []
                 current_length = 0
-            
+
             # If single paragraph is too long, split it
-            if para_words > limit:
-                words = para.split()
-                while words:
-                    chunk_words = words[:limit]
-                    chunks.append(' '.join(chunk_words))
-                    words = words[limit:]
+            if len(words) > limit:
+                for start in range(0, len(words), limit):
+                    yield ' '.join(words[start:start + limit])
                 continue
-        
+
         current_chunk.append(para)
-        current_length += para_words
-    
+        current_length += len(words)
+
     # Don't forget remaining content
     if current_chunk:
-        chunks.append(' '.join(current_chunk))
-        
-    return chunks
+        yield ' '.join(current_chunk)
+
+
+def iter_file_chunks(path: str, filename: str, limit: int = 750):
+    ## chunk_file for a file on disk, without reading it all in
+    with open(path, "rb") as stream:
+        yield from chunk_paragraphs(iter_paragraphs(stream, filename), limit)
+
+
+def chunk_file(content: bytes, filename: str, limit: int = 750) -> list[str]:
+    return list(chunk_paragraphs(iter_paragraphs(io.BytesIO(content), filename), limit))
+
+
+def batched(iterable, size: int):
+    ## itertools.batched before python 3.12
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
 
 
 def chunk_exchange(exchanges: list, limit: int):
@@ -157,4 +278,11 @@ def chunk_exchange(exchanges: list, limit: int):
                 long.append(True)
                 i += 1
     
-    return chunks, long
\ No newline at end of file
+    return chunks, long
+
+
+def analysis_key(prompt: list, model: str) -> str:
+    ## Content address of an analysis - the rendered prompt carries the passage, the prompt
+    ## template and the schema, so changing any of them (or the model) misses the cache
+    payload = json.dumps({"model": model, "prompt": prompt}, option=json.OPT_SORT_KEYS)
+    return hashlib.sha256(payload).hexdigest()
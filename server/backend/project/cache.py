@@ -0,0 +1,30 @@
+import redis
+import redis.asyncio as aioredis
+from project.config import settings
+
+# Shared redis clients for caches. Both keep their own connection pool and connect lazily,
+# so they are safe to create at import time in the web process and in forked celery workers
+# https://redis.readthedocs.io/en/stable/connections.html#connectionpool
+_redis: redis.Redis = None
+_async_redis: aioredis.Redis = None
+
+
+def get_redis() -> redis.Redis:
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(settings.REDIS_URL)
+    return _redis
+
+
+def get_async_redis() -> aioredis.Redis:
+    global _async_redis
+    if _async_redis is None:
+        _async_redis = aioredis.Redis.from_url(settings.REDIS_URL)
+    return _async_redis
+
+
+async def close_async_redis():
+    global _async_redis
+    if _async_redis is not None:
+        await _async_redis.aclose()
+        _async_redis = None
@@ -18,12 +18,100 @@ class BaseConfig:
     # If having problems with async, make sure always eager is set to false
     CELERY_broker_url: str = os.environ.get("CELERY_BROKER_URL", "redis://127.0.0.1:6379/0")
     result_backend: str = os.environ.get("CELERY_RESULT_BACKEND", "redis://127.0.0.1:6379/0")
+    # Application caches - kept off the broker db so they can be flushed independently
+    REDIS_URL: str = os.environ.get("REDIS_URL", "redis://127.0.0.1:6379/1")
+
+    # pgvector HNSW index tuning. m and ef_construction only apply when the
+    # index is (re)built, ef_search is set per query.
+    HNSW_M: int = int(os.environ.get("HNSW_M", "16"))
+    HNSW_EF_CONSTRUCTION: int = int(os.environ.get("HNSW_EF_CONSTRUCTION", "64"))
+    HNSW_EF_SEARCH: int = int(os.environ.get("HNSW_EF_SEARCH", "40"))
 
     # Embedding APIs
     VOYAGE_API_KEY: str = os.environ.get("VOYAGE_API_KEY")
+    # "voyage", or "fake" for offline load tests - hash-seeded vectors after a log-normal
+    # delay (median FAKE_EMBEDDING_LATENCY_MS, spread FAKE_EMBEDDING_LATENCY_SIGMA)
+    EMBEDDING_PROVIDER: str = os.environ.get("EMBEDDING_PROVIDER", "voyage")
+    FAKE_EMBEDDING_LATENCY_MS: float = float(os.environ.get("FAKE_EMBEDDING_LATENCY_MS", "50"))
+    FAKE_EMBEDDING_LATENCY_SIGMA: float = float(os.environ.get("FAKE_EMBEDDING_LATENCY_SIGMA", "0.5"))
+    # Embedding cache - in-process LRU (entries) in front of redis (seconds to live)
+    EMBEDDING_CACHE_SIZE: int = int(os.environ.get("EMBEDDING_CACHE_SIZE", "4096"))
+    EMBEDDING_CACHE_TTL: int = int(os.environ.get("EMBEDDING_CACHE_TTL", str(30 * 24 * 3600)))
+    # Request coalescing in the web process - wait up to WINDOW_MS for other requests, and
+    # cap each Voyage call at SIZE texts / TOKENS estimated tokens (provider limits are higher)
+    EMBEDDING_BATCH_WINDOW_MS: float = float(os.environ.get("EMBEDDING_BATCH_WINDOW_MS", "5"))
+    EMBEDDING_BATCH_SIZE: int = int(os.environ.get("EMBEDDING_BATCH_SIZE", "128"))
+    EMBEDDING_BATCH_TOKENS: int = int(os.environ.get("EMBEDDING_BATCH_TOKENS", "100000"))
+    # Belief extraction fan-out per upload (number of parallel analysis tasks)
+    ANALYSIS_PARALLELISM: int = int(os.environ.get("ANALYSIS_PARALLELISM", "4"))
+    ANALYSIS_MAX_PARALLELISM: int = int(os.environ.get("ANALYSIS_MAX_PARALLELISM", "16"))
+    # Per-interaction message history cached in redis (seconds to live)
+    HISTORY_CACHE_TTL: int = int(os.environ.get("HISTORY_CACHE_TTL", str(24 * 3600)))
+    # Older turns are compacted into a rolling summary once the unsummarized turns before the
+    # last HISTORY_RECENT_EXCHANGES pass HISTORY_SUMMARY_TOKENS (estimated). The recent ones
+    # stay verbatim
+    HISTORY_SUMMARY_TOKENS: int = int(os.environ.get("HISTORY_SUMMARY_TOKENS", "2000"))
+    HISTORY_RECENT_EXCHANGES: int = int(os.environ.get("HISTORY_RECENT_EXCHANGES", "4"))
+    # At most one summary run queued per interaction - the marker expires after this many
+    # seconds in case the worker dies before clearing it
+    HISTORY_SUMMARY_LOCK_TTL: int = int(os.environ.get("HISTORY_SUMMARY_LOCK_TTL", "600"))
+    # Most recent exchanges a chat turn reads - anything older is left to the summary
+    HISTORY_WINDOW_EXCHANGES: int = int(os.environ.get("HISTORY_WINDOW_EXCHANGES", "20"))
+    # Style exemplars - size of the writing sample pool, and whether to pick the sample
+    # closest to the generated message (one extra embedding per turn) instead of at random
+    STYLE_SAMPLE_POOL_SIZE: int = int(os.environ.get("STYLE_SAMPLE_POOL_SIZE", "32"))
+    STYLE_SAMPLE_NEAREST: bool = os.environ.get("STYLE_SAMPLE_NEAREST", "false").lower() == "true"
+    # Estimated token budgets (prompt.assembler) - whole belief prompt, whole style prompt,
+    # and the recent-conversation text embedded as the retrieval query
+    PROMPT_TOKEN_BUDGET: int = int(os.environ.get("PROMPT_TOKEN_BUDGET", "6000"))
+    STYLE_PROMPT_TOKEN_BUDGET: int = int(os.environ.get("STYLE_PROMPT_TOKEN_BUDGET", "2000"))
+    RETRIEVAL_CONTEXT_TOKENS: int = int(os.environ.get("RETRIEVAL_CONTEXT_TOKENS", "250"))
+    # Per-interaction retrieval reuse - skip retrieval while the context embedding stays within
+    # this cosine distance of the one the cached knowledge was retrieved for (0 disables)
+    RETRIEVAL_CACHE_DISTANCE: float = float(os.environ.get("RETRIEVAL_CACHE_DISTANCE", "0.05"))
+    RETRIEVAL_CACHE_TTL: int = int(os.environ.get("RETRIEVAL_CACHE_TTL", "3600"))
+    # Topic names within this cosine distance of an existing topic are merged into it. The
+    # offline consolidate_topics job checks each topic's TOPIC_MERGE_NEIGHBORS nearest topics
+    TOPIC_MERGE_DISTANCE: float = float(os.environ.get("TOPIC_MERGE_DISTANCE", "0.15"))
+    TOPIC_MERGE_NEIGHBORS: int = int(os.environ.get("TOPIC_MERGE_NEIGHBORS", "10"))
+    # Nearest beliefs linked to each new memory, and nearest memories to each new belief
+    BELIEF_MEMORY_LINKS: int = int(os.environ.get("BELIEF_MEMORY_LINKS", "3"))
+    # Uploads are streamed to storage shared by web and worker (the temp_storage volume),
+    # UPLOAD_CHUNK_SIZE bytes at a time, and rejected past UPLOAD_MAX_BYTES
+    UPLOAD_DIR: str = os.environ.get("UPLOAD_DIR", "/temp_storage")
+    UPLOAD_MAX_BYTES: int = int(os.environ.get("UPLOAD_MAX_BYTES", str(50 * 1024 * 1024)))
+    UPLOAD_CHUNK_SIZE: int = int(os.environ.get("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+    # An upload job with no progress written for this long is taken as dead and can be resumed.
+    # Keep it above the longest single stage (persist_knowledge, cluster_memories)
+    UPLOAD_STALE_SECONDS: int = int(os.environ.get("UPLOAD_STALE_SECONDS", "900"))
+    # A failed upload keeps its file this long to be resumed, then the job expires
+    UPLOAD_RESUME_SECONDS: int = int(os.environ.get("UPLOAD_RESUME_SECONDS", str(7 * 24 * 3600)))
+    # rows per executemany batch when bulk_insert can't use COPY
+    BULK_INSERT_BATCH_SIZE: int = int(os.environ.get("BULK_INSERT_BATCH_SIZE", "1000"))
+    # concurrent Voyage calls per celery task when embedding uploads
+    EMBEDDING_WORKERS: int = int(os.environ.get("EMBEDDING_WORKERS", "4"))
+    # max open connections to the Voyage API per web process
+    VOYAGE_POOL_SIZE: int = int(os.environ.get("VOYAGE_POOL_SIZE", "20"))
+    # Voyage rate limits shared by web and workers (voyage-3-lite basic tier, 0 disables)
+    VOYAGE_RPM: int = int(os.environ.get("VOYAGE_RPM", "2000"))
+    VOYAGE_TPM: int = int(os.environ.get("VOYAGE_TPM", "16000000"))
 
     # Models
     ANTHROPIC_API_KEY: str = os.environ.get("ANTHROPIC_API_KEY")
+    # "anthropic", or "fake" for offline load tests - templated responses after a log-normal
+    # delay (median FAKE_LLM_LATENCY_MS, spread FAKE_LLM_LATENCY_SIGMA). Fake providers skip
+    # the rate limits and use their own cache keys
+    LLM_PROVIDER: str = os.environ.get("LLM_PROVIDER", "anthropic")
+    FAKE_LLM_LATENCY_MS: float = float(os.environ.get("FAKE_LLM_LATENCY_MS", "800"))
+    FAKE_LLM_LATENCY_SIGMA: float = float(os.environ.get("FAKE_LLM_LATENCY_SIGMA", "0.5"))
+    # max concurrent Claude requests per web process
+    CLAUDE_MAX_CONCURRENCY: int = int(os.environ.get("CLAUDE_MAX_CONCURRENCY", "8"))
+    # Anthropic rate limits shared by web and workers - requests and input tokens per minute
+    # (0 disables). Set them to your organization's tier
+    ANTHROPIC_RPM: int = int(os.environ.get("ANTHROPIC_RPM", "50"))
+    ANTHROPIC_TPM: int = int(os.environ.get("ANTHROPIC_TPM", "40000"))
+    # share of every provider budget background work (celery) leaves to chat requests
+    RATE_LIMIT_RESERVE: float = float(os.environ.get("RATE_LIMIT_RESERVE", "0.2"))
     
     AUTH_SECRET: str = os.environ.get("AUTH_SECRET", "PLACEHOLDER")
     ACCESS_TOKEN_LIFETIME: int = int(os.environ.get("ACCESS_TOKEN_LIFETIME", "3600"))
@@ -11,6 +11,7 @@ from sqlalchemy.orm import Session, DeclarativeBase
 from sqlalchemy.engine import Engine as SyncDB
 
 from project.config import settings
+from project.metrics import TimedAsyncPool
 
 import logging
 logging.basicConfig(level=logging.DEBUG)
@@ -33,7 +34,9 @@ async def manage_conn_pools(app: FastAPI):
     try:
         _db_conn = create_async_engine(
             settings.DATABASE_URL, 
-            connect_args=settings.ASYNC_DATABASE_CONNECT_DICT
+            connect_args=settings.ASYNC_DATABASE_CONNECT_DICT,
+            # default pool, plus checkout wait times for /metrics
+            poolclass=TimedAsyncPool
         ) 
         yield  
         await _db_conn.dispose()
@@ -0,0 +1,97 @@
+import asyncio
+from project.utils.tokens import estimate_tokens
+
+
+class _PendingBatch:
+    def __init__(self):
+        self.items = []  # (text, future, caller)
+        self.tokens = 0
+        self.timer = None
+
+
+class EmbeddingBatcher:
+    ## Coalesces concurrent embedding requests in the web process into shared Voyage calls.
+    ## Requests collect for up to window_ms (or until max_batch texts / max_tokens) and are
+    ## sent as one call per input type. Each caller awaits futures for just its own texts.
+    ## If a shared call fails, each caller's texts are retried on their own, so one bad
+    ## input only fails the request it came from.
+    def __init__(self, embed, window_ms: float, max_batch: int, max_tokens: int):
+        self._embed = embed  # async (texts, input_type) -> embeddings
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self.max_tokens = max_tokens
+        self._pending = {}
+        self._in_flight = set()
+
+    async def embed(self, texts: list, input_type: str) -> list:
+        loop = asyncio.get_running_loop()
+        futures = []
+        caller = object()
+        for text in texts:
+            future = loop.create_future()
+            self._add(loop, input_type, text, future, caller)
+            futures.append(future)
+        return list(await asyncio.gather(*futures))
+
+    def _add(self, loop, input_type: str, text: str, future, caller):
+        tokens = estimate_tokens(text)
+        batch = self._pending.get(input_type)
+        if batch is not None and batch.tokens + tokens > self.max_tokens:
+            self._flush(input_type)
+            batch = None
+        if batch is None:
+            batch = _PendingBatch()
+            batch.timer = loop.call_later(self.window, self._flush, input_type)
+            self._pending[input_type] = batch
+
+        batch.items.append((text, future, caller))
+        batch.tokens += tokens
+        if len(batch.items) >= self.max_batch:
+            self._flush(input_type)
+
+    def _flush(self, input_type: str):
+        batch = self._pending.pop(input_type, None)
+        if batch is None:
+            return
+        batch.timer.cancel()
+        # keep a reference so the task isn't garbage collected mid-flight
+        task = asyncio.ensure_future(self._send(input_type, batch.items))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, input_type: str, items: list, retry: bool = True):
+        try:
+            embeddings = await self._embed([text for text, _, _ in items], input_type)
+            for (_, future, _), embedding in zip(items, embeddings):
+                if not future.done():
+                    future.set_result(embedding)
+        except Exception as e:
+            callers = {}
+            for item in items:
+                callers.setdefault(item[2], []).append(item)
+            if retry and len(callers) > 1:
+                await asyncio.gather(*[self._send(input_type, own, retry=False)
+                                       for own in callers.values()])
+                return
+            for _, future, _ in items:
+                if not future.done():
+                    future.set_exception(e)
+
+
+def split_batches(texts: list, max_items: int, max_tokens: int) -> list:
+    ## Consecutive batches within the provider limits, preserving order.
+    ## A single text over max_tokens gets a batch to itself (Voyage truncates it)
+    batches = []
+    current = []
+    current_tokens = 0
+    for text in texts:
+        tokens = estimate_tokens(text)
+        if current and (len(current) >= max_items or current_tokens + tokens > max_tokens):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(text)
+        current_tokens += tokens
+    if current:
+        batches.append(current)
+    return batches
@@ -0,0 +1,121 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import redis
+from project.config import settings
+from project.cache import get_redis, get_async_redis
+
+
+def embedding_key(model: str, input_type: str, text: str) -> str:
+    # content addressed - the same text embedded by the same model always hits
+    digest = hashlib.sha256(f"{model}\x00{input_type}\x00{text}".encode("utf-8")).hexdigest()
+    return f"embedding:{digest}"
+
+
+def encode_embedding(embedding: list) -> bytes:
+    # pgvector stores float32 anyway, so this loses nothing we keep
+    return np.asarray(embedding, dtype=np.float32).tobytes()
+
+
+def decode_embedding(raw: bytes) -> list:
+    return np.frombuffer(raw, dtype=np.float32).tolist()
+
+
+class EmbeddingCache:
+    ## Two tiers: an in-process LRU in front of redis (shared by web and celery workers).
+    ## Both hold float32 bytes. Redis errors are treated as misses so the cache can never
+    ## take embeddings down with it.
+    def __init__(self, capacity: int, ttl: int):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._local = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"local_hits": 0, "redis_hits": 0, "misses": 0}
+
+    def stats(self) -> dict:
+        with self._lock:
+            return dict(self._stats)
+
+    def _record(self, stat: str, count: int):
+        if count:
+            with self._lock:
+                self._stats[stat] += count
+
+    def _get_local(self, keys: list) -> dict:
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._local:
+                    self._local.move_to_end(key)
+                    found[key] = self._local[key]
+        return found
+
+    def _set_local(self, items: dict):
+        with self._lock:
+            for key, raw in items.items():
+                self._local[key] = raw
+                self._local.move_to_end(key)
+            while len(self._local) > self.capacity:
+                self._local.popitem(last=False)
+
+    def _finish_lookup(self, keys: list, found: dict, remote_keys: list, remote: list) -> dict:
+        from_redis = {key: raw for key, raw in zip(remote_keys, remote) if raw is not None}
+        self._set_local(from_redis)
+        found.update(from_redis)
+        self._record("redis_hits", len(from_redis))
+        self._record("misses", len(set(keys)) - len(found))
+        return {key: decode_embedding(raw) for key, raw in found.items()}
+
+    def get_many(self, keys: list) -> dict:
+        ## returns {key: embedding} for every key found in either tier
+        found = self._get_local(keys)
+        self._record("local_hits", len(found))
+        remote_keys = [key for key in dict.fromkeys(keys) if key not in found]
+        remote = []
+        if remote_keys:
+            try:
+                remote = get_redis().mget(remote_keys)
+            except redis.RedisError as e:
+                print(f"Embedding cache unavailable: {str(e)}")
+                remote = [None] * len(remote_keys)
+        return self._finish_lookup(keys, found, remote_keys, remote)
+
+    async def aget_many(self, keys: list) -> dict:
+        found = self._get_local(keys)
+        self._record("local_hits", len(found))
+        remote_keys = [key for key in dict.fromkeys(keys) if key not in found]
+        remote = []
+        if remote_keys:
+            try:
+                remote = await get_async_redis().mget(remote_keys)
+            except redis.RedisError as e:
+                print(f"Embedding cache unavailable: {str(e)}")
+                remote = [None] * len(remote_keys)
+        return self._finish_lookup(keys, found, remote_keys, remote)
+
+    def set_many(self, items: dict):
+        encoded = {key: encode_embedding(embedding) for key, embedding in items.items()}
+        self._set_local(encoded)
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            for key, raw in encoded.items():
+                pipe.set(key, raw, ex=self.ttl)
+            pipe.execute()
+        except redis.RedisError as e:
+            print(f"Embedding cache unavailable: {str(e)}")
+
+    async def aset_many(self, items: dict):
+        encoded = {key: encode_embedding(embedding) for key, embedding in items.items()}
+        self._set_local(encoded)
+        try:
+            pipe = get_async_redis().pipeline(transaction=False)
+            for key, raw in encoded.items():
+                pipe.set(key, raw, ex=self.ttl)
+            await pipe.execute()
+        except redis.RedisError as e:
+            print(f"Embedding cache unavailable: {str(e)}")
+
+
+embedding_cache = EmbeddingCache(settings.EMBEDDING_CACHE_SIZE, settings.EMBEDDING_CACHE_TTL)
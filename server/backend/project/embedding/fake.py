@@ -0,0 +1,49 @@
+import asyncio
+import hashlib
+import random
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+# Offline stand-in for the Voyage clients (EMBEDDING_PROVIDER=fake). Same text, same vector -
+# seeded by its hash and normalized like Voyage's - so caching, dedup and retrieval behave
+# as they would against the API, just without meaning
+DIMENSIONS = 512
+
+
+def fake_embedding(text: str, dimensions: int = DIMENSIONS) -> list:
+    # input_type is left out so a text embedded as a query lands on the same text as a document
+    seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "big")
+    vector = np.random.default_rng(seed).normal(size=dimensions)
+    return (vector / np.linalg.norm(vector)).tolist()
+
+
+@dataclass
+class FakeEmbeddingsObject:
+    embeddings: list
+    total_tokens: int = 0
+
+
+class FakeClient:
+    ## voyageai.Client.embed, after a log-normal delay like FakeClaude's - median latency_ms,
+    ## spread latency_sigma
+    def __init__(self, latency_ms: float = 0, latency_sigma: float = 0.5):
+        self.latency_ms = latency_ms
+        self.latency_sigma = latency_sigma
+
+    def _latency(self) -> float:
+        if self.latency_ms <= 0:
+            return 0.0
+        return random.lognormvariate(0, self.latency_sigma) * self.latency_ms / 1000
+
+    def embed(self, texts: list, model: str = None, input_type: str = None) -> FakeEmbeddingsObject:
+        time.sleep(self._latency())
+        return FakeEmbeddingsObject([fake_embedding(text) for text in texts])
+
+
+class FakeAsyncClient(FakeClient):
+    ## voyageai.AsyncClient.embed
+    async def embed(self, texts: list, model: str = None, input_type: str = None) -> FakeEmbeddingsObject:
+        await asyncio.sleep(self._latency())
+        return FakeEmbeddingsObject([fake_embedding(text) for text in texts])
@@ -1,11 +1,83 @@
+import aiohttp
 import voyageai
+from concurrent.futures import ThreadPoolExecutor
 from project.config import settings
+from project.embedding.cache import embedding_cache, embedding_key
+from project.embedding.batcher import EmbeddingBatcher, split_batches
+from project.embedding.fake import FakeClient, FakeAsyncClient
+from project.metrics import EMBEDDING_TOKENS, timed
+from project.utils.ratelimit import RateLimiter
+from project.utils.tokens import estimate_tokens
 from opentelemetry import trace
 from opentelemetry.trace import StatusCode
 
-vo = voyageai.Client() # automatically uses the environment variable VOYAGE_API_KEY - in config.py
+if settings.EMBEDDING_PROVIDER == "fake":
+    # offline - own model name so fake vectors never land in the real embedding cache
+    vo = FakeClient(settings.FAKE_EMBEDDING_LATENCY_MS, settings.FAKE_EMBEDDING_LATENCY_SIGMA)
+    vo_async = FakeAsyncClient(settings.FAKE_EMBEDDING_LATENCY_MS, settings.FAKE_EMBEDDING_LATENCY_SIGMA)
+    MODEL = "fake-voyage"
+    voyage_limiter = RateLimiter("voyage", 0, 0)
+else:
+    vo = voyageai.Client() # automatically uses the environment variable VOYAGE_API_KEY - in config.py
+    vo_async = voyageai.AsyncClient()
+    MODEL = "voyage-3-lite"
+    voyage_limiter = RateLimiter("voyage", settings.VOYAGE_RPM, settings.VOYAGE_TPM)
+
+# Shared aiohttp session for the async client. Without it voyageai opens (and tears down)
+# a new session on every call. https://docs.aiohttp.org/en/stable/client_reference.html#connectors
+_aio_session: aiohttp.ClientSession = None
+
+
+async def open_voyage_pool():
+    global _aio_session
+    _aio_session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=settings.VOYAGE_POOL_SIZE)
+    )
+
+
+async def close_voyage_pool():
+    global _aio_session
+    if _aio_session:
+        await _aio_session.close()
+        _aio_session = None
+
+
+async def _embed_async(texts: list, input_type: str):
+    if _aio_session is not None:
+        voyageai.aiosession.set(_aio_session)
+    await voyage_limiter.aacquire(sum(estimate_tokens(text) for text in texts))
+    result = await vo_async.embed(texts, model=MODEL, input_type=input_type)
+    return result.embeddings
+
+
+# Concurrent requests in the web process share Voyage round trips
+embedding_batcher = EmbeddingBatcher(
+    _embed_async,
+    window_ms=settings.EMBEDDING_BATCH_WINDOW_MS,
+    max_batch=settings.EMBEDDING_BATCH_SIZE,
+    max_tokens=settings.EMBEDDING_BATCH_TOKENS,
+)
+
+
+def _prepare_texts(texts: list | str, single: bool):
+    if isinstance(texts, str):
+        texts = [texts]
+    if single:
+        texts = [texts[0]]
+    return texts
+
+
+def _cache_misses(texts: list, keys: list, found: dict):
+    ## unique (key, text) pairs that still need to go to Voyage, in input order
+    misses = {}
+    for key, text in zip(keys, texts):
+        if key not in found and key not in misses:
+            misses[key] = text
+    return misses
+
 
 def voyage_embedding(texts: list | str, query: bool = False, single: bool = True):
+    ## Blocking - only for celery workers and scripts. Use async_voyage_embedding in endpoints
     tracer = trace.get_tracer(__name__)
     with tracer.start_as_current_span("voyage_embedding", openinference_span_kind="embedding") as span:
         span.set_input({"query": query, "texts": texts})
@@ -14,22 +86,84 @@ def voyage_embedding(texts: list | str, query: bool = False, single: bool = True
         if isinstance(texts, str):
             texts = [texts]
         span.set_attribute("num_texts", len(texts))
-        if single:
-            texts = [texts] if isinstance(texts, str) else [texts[0]]
-        elif isinstance(texts, str):
+        texts = _prepare_texts(texts, single)
+
+        try:
+            input_type = "query" if query else "document"
+            keys = [embedding_key(MODEL, input_type, text) for text in texts]
+            found = embedding_cache.get_many(keys)
+            misses = _cache_misses(texts, keys, found)
+            span.set_attribute("cache_hits", len(texts) - len(misses))
+            if misses:
+                # celery work - waits behind chat requests when the budget runs low
+                tokens = sum(estimate_tokens(text) for text in misses.values())
+                voyage_limiter.acquire(tokens)
+                with timed("embedding"):
+                    result = vo.embed(list(misses.values()), model=MODEL, input_type=input_type)
+                EMBEDDING_TOKENS.inc(tokens)
+                fresh = dict(zip(misses.keys(), result.embeddings))
+                embedding_cache.set_many(fresh)
+                found.update(fresh)
+            embeddings = [found[key] for key in keys]
+            if single:
+                span.set_output({"result": embeddings[0]})
+                span.set_status(StatusCode.OK)
+            else:
+                span.set_output({"result": embeddings})
+                span.set_status(StatusCode.OK)
+            return embeddings[0] if single else embeddings
+        except Exception as e:
+            print(f"Error getting embedding: {str(e)}")
+            span.set_status(StatusCode.ERROR)
+            return None
+
+
+def voyage_embedding_batched(texts: list, query: bool = False):
+    ## For bulk work in celery workers - embeds provider-sized batches concurrently on a
+    ## bounded thread pool. Results are in input order, None if any batch failed
+    batches = split_batches(texts, settings.EMBEDDING_BATCH_SIZE, settings.EMBEDDING_BATCH_TOKENS)
+    with ThreadPoolExecutor(max_workers=settings.EMBEDDING_WORKERS) as pool:
+        results = list(pool.map(lambda batch: voyage_embedding(batch, query, single=False), batches))
+
+    if any(result is None for result in results):
+        return None
+    return [embedding for result in results for embedding in result]
+
+
+async def async_voyage_embedding(texts: list | str, query: bool = False, single: bool = True):
+    ## Same contract as voyage_embedding, but doesn't block the event loop
+    tracer = trace.get_tracer(__name__)
+    with tracer.start_as_current_span("voyage_embedding", openinference_span_kind="embedding") as span:
+        span.set_input({"query": query, "texts": texts})
+        if texts is None:
+            return None
+        if isinstance(texts, str):
             texts = [texts]
+        span.set_attribute("num_texts", len(texts))
+        texts = _prepare_texts(texts, single)
 
         try:
             input_type = "query" if query else "document"
-            result = vo.embed(texts, model="voyage-3-lite", input_type=input_type)
+            keys = [embedding_key(MODEL, input_type, text) for text in texts]
+            found = await embedding_cache.aget_many(keys)
+            misses = _cache_misses(texts, keys, found)
+            span.set_attribute("cache_hits", len(texts) - len(misses))
+            if misses:
+                with timed("embedding"):
+                    embedded = await embedding_batcher.embed(list(misses.values()), input_type)
+                EMBEDDING_TOKENS.inc(sum(estimate_tokens(text) for text in misses.values()))
+                fresh = dict(zip(misses.keys(), embedded))
+                await embedding_cache.aset_many(fresh)
+                found.update(fresh)
+            embeddings = [found[key] for key in keys]
             if single:
-                span.set_output({"result": result.embeddings[0]})
+                span.set_output({"result": embeddings[0]})
                 span.set_status(StatusCode.OK)
             else:
-                span.set_output({"result": result.embeddings})
+                span.set_output({"result": embeddings})
                 span.set_status(StatusCode.OK)
-            return result.embeddings[0] if single else result.embeddings
+            return embeddings[0] if single else embeddings
         except Exception as e:
             print(f"Error getting embedding: {str(e)}")
             span.set_status(StatusCode.ERROR)
-            return None
\ No newline at end of file
+            return None
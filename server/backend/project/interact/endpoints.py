@@ -1,19 +1,29 @@
-import random
+import asyncio
+import os
+import time
 from uuid import uuid4
 from datetime import datetime, timezone, timedelta
-from fastapi import APIRouter, Request, Depends, HTTPException, Response, status, UploadFile, File
+from fastapi import APIRouter, Request, Depends, HTTPException, Response, status, UploadFile, File, Query
+from fastapi.responses import StreamingResponse
 
 from sqlalchemy import update, select, func
 from sqlalchemy.ext.asyncio import AsyncSession
-from celery import chain
 
-from project.database import get_db_sess
+from project.database import get_db_sess, get_db_conn
+from project.config import settings
+from project.metrics import RETRIEVAL_CACHE, STAGE_SECONDS, timed
+from project.websockets import sio
 
-from project.interact.models import Memory, Interaction, Exchange
-from project.interact.utils import load_history, extract_context, record_exchange, validate_file_extension
-from project.knowledge.utils import get_topics, extract_knowledge, format_knowledge
-from project.embedding.voyage import voyage_embedding
-from project.prompt.claude import claude_call, claude_belief_prompt, claude_style_prompt
+from project.interact.models import Memory, Interaction, WritingSample
+from project.analysis.models import UploadJob
+from project.interact.utils import load_recent_history, history_tokens, extract_context, record_exchange, validate_file_extension, format_sse, save_upload, claim_summary
+from project.knowledge.utils import retrieve_knowledge
+from project.knowledge.cache import get_cached_knowledge, cache_knowledge, async_bump_knowledge_version
+from project.embedding.voyage import async_voyage_embedding
+from project.prompt.claude import async_claude_call, async_claude_stream
+from project.prompt.assembler import assemble_belief_prompt, assemble_style_prompt
+from project.utils.db_types import exact_l2_distance
+from project.utils.tokens import token_chars
 from project.analysis import tasks
 
 from opentelemetry import trace
@@ -26,57 +36,89 @@ interact_router = APIRouter(
 # ------------------------------------------------------------------------------
 # INTERACTION ENDPOINTS ********************************************************
 # ------------------------------------------------------------------------------
+async def _gen_beliefs(data: dict, session: AsyncSession):
+    ## Retrieval plus the belief stage of a chat turn. Returns (message, belief generation)
+    row = (await session.execute(
+        select(Interaction.summary, Interaction.summarized_until)
+        .where(Interaction.id == data["id"])
+    )).first()
+    summary, since = row if row else (None, None)
+    with timed("load_history"):
+        history = await load_recent_history(data["id"], session, limit=2 * settings.HISTORY_WINDOW_EXCHANGES,
+                                            since=since)
+    message = data["message"].strip()
+    history.append({"role": "user", "content": message} )
+    recent = 2 * settings.HISTORY_RECENT_EXCHANGES
+    if history_tokens(history[:-recent] if recent else history) > settings.HISTORY_SUMMARY_TOKENS:
+        # only the turns before the recent ones get summarized - compacted in the background,
+        # this turn still sends the full unsummarized history. One run at a time, turns
+        # arriving while it's queued would only repeat its Claude call
+        if await claim_summary(data["id"]):
+            tasks.summarize_interaction.delay(data["id"])
+    context = extract_context(history, token_chars(settings.RETRIEVAL_CONTEXT_TOKENS))
+
+    tracer = trace.get_tracer(__name__)
+    with tracer.start_as_current_span("get_knowledge", openinference_span_kind="retriever") as retrieve_span:
+        retrieve_span.set_input({"context": context})
+        context_embedding = await async_voyage_embedding([context], query=False)
+        with timed("retrieval_cache"):
+            knowledge_dict, version = await get_cached_knowledge(data["id"], context_embedding)
+        retrieve_span.set_attribute("cache_hit", knowledge_dict is not None)
+        RETRIEVAL_CACHE.labels("miss" if knowledge_dict is None else "hit").inc()
+        if knowledge_dict is None:
+            knowledge_dict = await retrieve_knowledge(context_embedding, session)
+            await cache_knowledge(data["id"], context_embedding, knowledge_dict, version)
+
+        for topic in knowledge_dict:
+            for i in range(len(knowledge_dict[topic]["beliefs"])):
+                retrieve_span.set_attribute(f"retrieval.documents.{i}.document.content", "\n\n".join(knowledge_dict[topic]["beliefs"][i]["memories"]))
+                retrieve_span.set_attribute(f"retrieval.documents.{i}.document.id", knowledge_dict[topic]["beliefs"][i]["belief"])
+        retrieve_span.set_status(StatusCode.OK)
+        
+    with tracer.start_as_current_span("gen_beliefs", openinference_span_kind="llm") as belief_span, timed("gen_beliefs"):
+        belief_prompt, usage = assemble_belief_prompt(knowledge_dict, history, summary)
+        belief_span.set_input({"knowledge": belief_prompt[0]["content"]})
+        for section, tokens in usage.items():
+            belief_span.set_attribute(f"prompt_tokens.{section}", tokens)
+        generation = await async_claude_call(belief_prompt)
+        belief_span.set_output({"result": str(generation)})
+        belief_span.set_status(StatusCode.OK)
+    return message, generation
+
+
+async def _style_prompt(generation: str, session: AsyncSession):
+    # exemplar from the precomputed pool - a few dozen rows at most, whatever the corpus size
+    if settings.STYLE_SAMPLE_NEAREST:
+        generation_embedding = await async_voyage_embedding([generation], query=False)
+        # exact - the memory HNSW index would rank the whole table, not the pool
+        order = exact_l2_distance(Memory.embedding, generation_embedding)
+    else:
+        order = func.random()
+    with timed("style_sample"):
+        rows = (await session.execute(
+            select(Memory.text)
+            .join_from(WritingSample, Memory, WritingSample.memory_id == Memory.id)
+            .order_by(order)
+            .limit(1)
+        )).all()
+    samples = [row[0] for row in rows]
+    prompt, _ = assemble_style_prompt(generation, samples)
+    return prompt
+
+
 @interact_router.post("/message")
 async def message_self(request: Request, session: AsyncSession = Depends(get_db_sess)):
     data = await request.json()
-
-    res = (await session.execute(
-        select(Exchange.id, Exchange.text)
-        .where(Exchange.interaction_id == data["id"])
-        .order_by(Exchange.created_time.asc())
-    )).all()
-
-    history = load_history(res)
-    message = data["message"].strip()
-    history.append({"role": "user", "content": message} )
-    context = extract_context(history, 1000)
     
     tracer = trace.get_tracer(__name__)
     with tracer.start_as_current_span("interact_message", openinference_span_kind="chain") as span:
         span.set_input({"prompt": data})
-        with tracer.start_as_current_span("get_knowledge", openinference_span_kind="retriever") as retrieve_span:
-            retrieve_span.set_input({"context": context})
-            context_embedding = voyage_embedding([context], query=False)
-            topic_ids = await get_topics(context_embedding, session)
-            knowledge_dict = await extract_knowledge(context_embedding, topic_ids, session)
-            knowledge = format_knowledge(knowledge_dict)
-
-            for topic in knowledge_dict:
-                for i in range(len(knowledge_dict[topic]["beliefs"])):
-                    retrieve_span.set_attribute(f"retrieval.documents.{i}.document.content", "\n\n".join(knowledge_dict[topic]["beliefs"][i]["memories"]))
-                    retrieve_span.set_attribute(f"retrieval.documents.{i}.document.id", knowledge_dict[topic]["beliefs"][i]["belief"])
-            retrieve_span.set_status(StatusCode.OK)
-            
-        with tracer.start_as_current_span("gen_beliefs", openinference_span_kind="llm") as belief_span:
-            belief_span.set_input({"knowledge": knowledge})
-            belief_prompt = claude_belief_prompt(knowledge, history)
-            generation = claude_call(belief_prompt)
-            belief_span.set_output({"result": str(generation)})
-            belief_span.set_status(StatusCode.OK)
-
-        with tracer.start_as_current_span("gen_styles", openinference_span_kind="llm") as style_span:
+        message, generation = await _gen_beliefs(data, session)
+
+        with tracer.start_as_current_span("gen_styles", openinference_span_kind="llm") as style_span, timed("gen_styles"):
             style_span.set_input({"beliefs": generation})
-            rows = (await session.execute(
-                select(Memory.text)
-            )).all()
-            memories = [row[0] for row in rows]
-            sample = random.sample(memories, 1)
-            outline = {
-                "message": generation,
-                "writing_samples": sample
-            }
-            outline = claude_style_prompt(outline)
-            generation = claude_call(outline)
+            outline = await _style_prompt(generation, session)
+            generation = await async_claude_call(outline)
             style_span.set_output({"result": str(generation)})
             style_span.set_status(StatusCode.OK)
     
@@ -85,6 +127,78 @@ async def message_self(request: Request, session: AsyncSession = Depends(get_db_
     await record_exchange(message, generation, data["id"], session)
     return {"response": generation}
 
+
+@interact_router.post("/message/stream")
+async def message_self_stream(request: Request, session: AsyncSession = Depends(get_db_sess)):
+    ## Same pipeline as /message, but style-stage tokens are pushed as they arrive - to the
+    ## interaction's socket.io room ("token" / "done" events) and as server-sent events.
+    ## A failed generation ends with an "error" event instead of "done"
+    data = await request.json()
+    interaction_id = data["id"]
+
+    tracer = trace.get_tracer(__name__)
+    with tracer.start_as_current_span("interact_message", openinference_span_kind="chain") as span:
+        span.set_input({"prompt": data})
+        message, generation = await _gen_beliefs(data, session)
+        outline = await _style_prompt(generation, session)
+        span.set_status(StatusCode.OK)
+
+    async def record(response: str):
+        # the request's session is closed once the response starts, so record on a fresh one
+        async with AsyncSession(bind=await get_db_conn(), expire_on_commit=False) as record_session:
+            await record_exchange(message, response, interaction_id, record_session)
+
+    async def stream():
+        tokens = []
+        failed = False
+        recorded = False
+        try:
+            with tracer.start_as_current_span("gen_styles", openinference_span_kind="llm") as style_span:
+                style_span.set_input({"beliefs": generation})
+                # gen_styles only counts time waiting on Claude - not time suspended at a
+                # yield while a slow client reads, or emitting to the room
+                generating = 0.0
+                resumed = time.perf_counter()
+                try:
+                    async for token in async_claude_stream(outline):
+                        generating += time.perf_counter() - resumed
+                        resumed = None
+                        if not tokens:
+                            STAGE_SECONDS.labels("gen_styles_first_token").observe(generating)
+                        tokens.append(token)
+                        await sio.emit("token", {"id": interaction_id, "token": token}, room=interaction_id)
+                        yield format_sse("token", {"token": token})
+                        resumed = time.perf_counter()
+                except Exception as e:
+                    print(f"Error streaming response: {str(e)}")
+                    failed = True
+                    style_span.set_status(StatusCode.ERROR)
+                else:
+                    style_span.set_status(StatusCode.OK)
+                finally:
+                    if resumed is not None:
+                        generating += time.perf_counter() - resumed
+                    STAGE_SECONDS.labels("gen_styles").observe(generating)
+                response = "".join(tokens)
+                style_span.set_output({"result": response})
+
+            # recorded before the final event, so the next turn's history has it
+            if response:
+                recorded = True
+                await asyncio.shield(record(response))
+            if failed:
+                await sio.emit("error", {"id": interaction_id, "response": response}, room=interaction_id)
+                yield format_sse("error", {"error": "Response generation failed", "response": response})
+            else:
+                await sio.emit("done", {"id": interaction_id, "response": response}, room=interaction_id)
+                yield format_sse("done", {"response": response})
+        finally:
+            # client went away mid-stream - keep the part it was shown
+            if tokens and not recorded:
+                await asyncio.shield(record("".join(tokens)))
+
+    return StreamingResponse(stream(), media_type="text/event-stream")
+
 @interact_router.post("/create")
 async def interact(session: AsyncSession = Depends(get_db_sess)):
     id = uuid4()
@@ -131,7 +245,7 @@ async def get_interactions(id: str, session: AsyncSession = Depends(get_db_sess)
 @interact_router.post("/memory/update")
 async def update_memory(request: Request, session: AsyncSession = Depends(get_db_sess)):
     data = await request.json() 
-    embedding = voyage_embedding([data["text"]], query=False)
+    embedding = await async_voyage_embedding([data["text"]], query=False)
 
     try:
         await session.execute(
@@ -141,6 +255,7 @@ async def update_memory(request: Request, session: AsyncSession = Depends(get_db
                     embedding=embedding)
         )
         await session.commit()
+        await async_bump_knowledge_version()
         return {"id": data["id"]}
     except:
         await session.rollback()
@@ -192,7 +307,10 @@ async def get_memories(id: str, session: AsyncSession = Depends(get_db_sess)):
 
 
 @interact_router.post("/upload")
-async def upload_memories(file: UploadFile = File(...)) -> dict:    
+async def upload_memories(file: UploadFile = File(...), parallelism: int = Query(None, ge=1),
+                          session: AsyncSession = Depends(get_db_sess)) -> dict:
+    ## Queues the upload pipeline for a file. Progress is reported per chunk by
+    ## /analysis/task/{task_id}, and a failed job can be resumed from /analysis/upload/{job_id}/resume
     ALLOWED_EXTENSIONS = { 
         '.txt',  # Text files
         '.docx',  # Microsoft Word (new)
@@ -205,15 +323,18 @@ async def upload_memories(file: UploadFile = File(...)) -> dict:
             detail=f"Invalid file type. Allowed types: {', '.join(ALLOWED_EXTENSIONS)}"
         )
 
-    content = await file.read()
+    path = await save_upload(file)
     tracer = trace.get_tracer(__name__)
     with tracer.start_as_current_span("UPLOAD") as span:
-        span.set_input({"filename": file.filename, "content_size": len(content)})
+        span.set_input({"filename": file.filename, "content_size": os.path.getsize(path)})
         headers = {}
         inject(headers)
-        # celery task
-        pipe = chain(tasks.gen_file_memories.s(content, file.filename), 
-                    tasks.gen_new_knowledge.s(headers=headers),
-                    tasks.cluster_memories.s()).apply_async()
+        # the job row carries the path on the shared volume, not the content
+        job = UploadJob(id=uuid4(), filename=file.filename, path=path)
+        session.add(job)
+        await session.commit()
+        pipe = tasks.upload_pipeline(str(job.id), headers, parallelism).apply_async()
+        job.task_id = str(pipe.id)
+        await session.commit()
         span.set_status(StatusCode.OK)
-    return {"task_id": str(pipe.id)}
+    return {"task_id": str(pipe.id), "job_id": str(job.id)}
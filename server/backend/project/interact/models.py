@@ -1,10 +1,10 @@
 from typing import List
 import uuid
-from sqlalchemy import Column, Integer, Float, Text, Boolean, ForeignKey, DateTime, types, text
+from sqlalchemy import Column, Integer, BigInteger, Float, Text, Boolean, ForeignKey, DateTime, Sequence, types, text
 from sqlalchemy.sql import func, false, true
 from sqlalchemy.orm import mapped_column, Mapped, relationship
 from project.database import Base
-from project.utils.db_types import Embedding
+from project.utils.db_types import Embedding, hnsw_index
 
 
 class Interaction(Base):
@@ -21,6 +21,10 @@ class Interaction(Base):
     # Order is Assertiveness, Agreeableness, Humor Rate, Topic Switching, Question Asking, Elaboration
     behavior: Mapped[List[float]] = mapped_column(Embedding(6), nullable=True)
 
+    # Rolling summary of every exchange up to summarized_until (analysis.tasks.summarize_interaction)
+    summary = mapped_column(Text, nullable=True)
+    summarized_until = Column(DateTime(timezone=True), nullable=True)
+
     memories : Mapped[List["Memory"]] = relationship(cascade="save-update")
     exchanges : Mapped[List["Exchange"]] = relationship(cascade="save-update")
 
@@ -48,6 +52,7 @@ class Memory(Base):
     created_time = Column(DateTime(timezone=True), server_default=func.now())
     version_id = mapped_column(Integer, nullable=False, server_default="1")
     __mapper_args__ = {"version_id_col": version_id}
+    __table_args__ = (hnsw_index("memory_embedding_hnsw_idx"),)
 
 
 class Exchange(Base):
@@ -63,3 +68,18 @@ class Exchange(Base):
     created_time = Column(DateTime(timezone=True), server_default=func.now())
     version_id = mapped_column(Integer, nullable=False, server_default="1")
     __mapper_args__ = {"version_id_col": version_id}
+
+
+class WritingSample(Base):
+    ## Small fixed-size reservoir of memories used as style exemplars, so a chat turn only
+    ## reads a few memory rows (by primary key). Maintained by analysis.tasks.update_writing_samples
+    __tablename__ = "writing_sample"
+    slot = mapped_column(Integer, primary_key=True, autoincrement=False)
+    memory_id: Mapped[uuid.UUID] = mapped_column(ForeignKey("memory.id", name="memory_id_writing_sample_fkey", ondelete='CASCADE', onupdate='CASCADE'), nullable=False)
+    # reservoir position of the memory - a slot only ever moves to a later one
+    position = mapped_column(BigInteger, nullable=False)
+
+
+# Reservoir positions for new memories. nextval never blocks and isn't rolled back, so
+# concurrent uploads always get distinct positions
+writing_sample_positions = Sequence("writing_sample_position_seq", start=0, minvalue=0, metadata=Base.metadata)
@@ -1,12 +1,22 @@
+import os
+from contextlib import suppress
+from datetime import datetime, timezone
 import orjson as json
 from uuid import uuid4
 
-from fastapi import HTTPException
+import redis
+from fastapi import HTTPException, UploadFile, status
+from fastapi.responses import JSONResponse
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy import update, select, func
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from project.interact.models import Memory, Exchange, Interaction
 from project.analysis.utils import truncate
+from project.cache import get_async_redis
+from project.config import settings
+from project.metrics import timed
+from project.utils.tokens import estimate_tokens
 
 ALLOWED_EXTENSIONS = {
     '.txt',  # Text files
@@ -14,15 +24,66 @@ ALLOWED_EXTENSIONS = {
     '.odt',  # OpenDocument
 }
 
+# multipart boundaries and part headers around the file
+UPLOAD_FORM_OVERHEAD = 64 * 1024
+
 def validate_file_extension(filename: str) -> bool:
     return any(filename.lower().endswith(ext) for ext in ALLOWED_EXTENSIONS)
+
+
+class UploadSizeLimit:
+    ## ASGI middleware - answers 413 from the Content-Length header, before Starlette reads and
+    ## spools the body. Requests without one (chunked) are only stopped by save_upload
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            length = dict(scope["headers"]).get(b"content-length", b"")
+            if length.isdigit() and int(length) > settings.UPLOAD_MAX_BYTES + UPLOAD_FORM_OVERHEAD:
+                response = JSONResponse(
+                    status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                    content={"detail": f"File too large. Max size is {settings.UPLOAD_MAX_BYTES} bytes"}
+                )
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
     
 
+async def save_upload(file: UploadFile) -> str:
+    ## Streams an upload to UPLOAD_DIR and returns its path. Workers read it from the shared
+    ## volume, so the content never goes through the broker. Raises 413 past UPLOAD_MAX_BYTES -
+    ## by then Starlette has spooled the whole body, so the limit is enforced up front by
+    ## UploadSizeLimit (Content-Length), and this only catches requests without one
+    extension = os.path.splitext(file.filename)[1].lower()
+    path = os.path.join(settings.UPLOAD_DIR, f"{uuid4()}{extension}")
+    size = 0
+    try:
+        with open(path, "wb") as out:
+            while chunk := await file.read(settings.UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > settings.UPLOAD_MAX_BYTES:
+                    raise HTTPException(
+                        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+                        detail=f"File too large. Max size is {settings.UPLOAD_MAX_BYTES} bytes"
+                    )
+                await run_in_threadpool(out.write, chunk)
+    except BaseException:
+        # open() itself may have failed - its error is the one to report
+        with suppress(FileNotFoundError):
+            os.remove(path)
+        raise
+    return path
+
 def raw(message: dict):
     text = message["role"] + ": "
     text += message["content"] + "\n"
     return text
 
+def format_sse(event: str, data: dict):
+    # https://html.spec.whatwg.org/multipage/server-sent-events.html#event-stream-interpretation
+    return f"event: {event}\ndata: {json.dumps(data).decode('utf-8')}\n\n"
+
 def load_history(rows):
     history = []
     for row in rows:
@@ -48,6 +109,111 @@ def extract_context(history: list, limit: int):
         context = truncated + context
     return context
 
+def history_tokens(history: list):
+    return estimate_tokens("".join(raw(message) for message in history))
+
+def history_key(interaction_id: str):
+    return f"history:{interaction_id}"
+
+def history_since_key(interaction_id: str):
+    return f"history:{interaction_id}:since"
+
+def summary_key(interaction_id: str):
+    # set while a summarize_interaction run is queued or running
+    return f"history:{interaction_id}:summarizing"
+
+async def claim_summary(interaction_id: str) -> bool:
+    ## True if the caller should queue summarize_interaction - no other run is pending. The
+    ## task clears the key when it finishes. Without redis every turn over the threshold queues
+    ## one, as before (the task itself skips runs another already covered)
+    try:
+        return bool(await get_async_redis().set(summary_key(interaction_id), 1, nx=True,
+                                                ex=settings.HISTORY_SUMMARY_LOCK_TTL))
+    except redis.RedisError as e:
+        print(f"History cache unavailable: {str(e)}")
+        return True
+
+def history_entry(exchange_id, messages: list) -> bytes:
+    # sorted set member - the exchange id keeps it unique, so writing it twice is a no-op
+    return json.dumps({"id": str(exchange_id), "messages": messages})
+
+def history_score(since) -> float:
+    # exchanges are scored by created_time, so `since` maps onto the same scale
+    return since.timestamp() if since is not None else 0.0
+
+# Drops exchanges folded into the summary from the cached set and moves its "complete since"
+# marker up to match (KEYS: set, marker. ARGV: new summarized_until score)
+PRUNE_HISTORY_SCRIPT = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+local since = redis.call('GET', KEYS[2])
+if since and tonumber(since) < tonumber(ARGV[1]) then
+    redis.call('SET', KEYS[2], ARGV[1], 'KEEPTTL')
+end
+return 0
+"""
+
+async def load_recent_history(interaction_id: str, session: AsyncSession, limit: int = None,
+                              since=None):
+    ## Messages of an interaction, oldest first. Served from a redis sorted set of exchanges
+    ## (scored by created_time) that record_exchange adds to, rebuilt from the exchange table
+    ## on a miss. A rebuild records the `since` it is complete from, and the set is only read
+    ## by callers that need no older exchanges - adds and rebuilds are idempotent, so neither
+    ## can drop an exchange the other wrote.
+    ## limit only returns the last `limit` messages, since skips exchanges that are already
+    ## in the interaction's summary
+    key = history_key(interaction_id)
+    since_key = history_since_key(interaction_id)
+    score = history_score(since)
+    try:
+        pipe = get_async_redis().pipeline(transaction=True)
+        pipe.get(since_key)
+        if limit:
+            # exchanges hold two messages - read just enough of them, newest first
+            pipe.zrevrangebyscore(key, "+inf", f"({score}", start=0, num=(limit + 1) // 2)
+        else:
+            pipe.zrangebyscore(key, f"({score}", "+inf")
+        cached_since, cached = await pipe.execute()
+        if cached_since is not None and float(cached_since) <= score:
+            entries = reversed(cached) if limit else cached
+            history = [message for entry in entries for message in json.loads(entry)["messages"]]
+            return history[-limit:] if limit else history
+    except redis.RedisError as e:
+        print(f"History cache unavailable: {str(e)}")
+
+    query = (
+        select(Exchange.id, Exchange.text, Exchange.created_time)
+        .where(Exchange.interaction_id == interaction_id)
+        .order_by(Exchange.created_time.asc())
+    )
+    if since is not None:
+        query = query.where(Exchange.created_time > since)
+    res = (await session.execute(query)).all()
+    history = load_history(res)
+
+    if res:
+        try:
+            pipe = get_async_redis().pipeline(transaction=True)
+            pipe.zadd(key, {history_entry(row[0], json.loads(row[1])["messages"]): row[2].timestamp()
+                            for row in res})
+            pipe.expire(key, settings.HISTORY_CACHE_TTL)
+            pipe.set(since_key, score, ex=settings.HISTORY_CACHE_TTL)
+            await pipe.execute()
+        except redis.RedisError as e:
+            print(f"History cache unavailable: {str(e)}")
+    return history[-limit:] if limit else history
+
+async def append_history(interaction_id: str, exchange_id, created_time, messages: list):
+    # Added whether or not the set is cached yet - until a rebuild sets its marker it is
+    # not read, and the rebuild's own copy of this exchange is the same member
+    key = history_key(interaction_id)
+    try:
+        pipe = get_async_redis().pipeline(transaction=True)
+        pipe.zadd(key, {history_entry(exchange_id, messages): created_time.timestamp()})
+        pipe.expire(key, settings.HISTORY_CACHE_TTL)
+        await pipe.execute()
+    except redis.RedisError as e:
+        print(f"History cache unavailable: {str(e)}")
+
 async def record_exchange(message: str, generation: str, interaction_id: str, 
                           session: AsyncSession):
     exchange = {
@@ -58,9 +224,15 @@ async def record_exchange(message: str, generation: str, interaction_id: str,
     }
     formatted = json.dumps(exchange).decode('utf-8')
 
-    to_save = Exchange(
-        id=str(uuid4()), text=formatted, 
-        interaction_id=interaction_id
-    )
-    session.add(to_save)
-    await session.commit()
+    with timed("record_exchange"):
+        # created_time set here rather than by the database - it is the exchange's cache score
+        exchange_id = str(uuid4())
+        created_time = datetime.now(timezone.utc)
+        to_save = Exchange(
+            id=exchange_id, text=formatted, 
+            interaction_id=interaction_id,
+            created_time=created_time
+        )
+        session.add(to_save)
+        await session.commit()
+        await append_history(interaction_id, exchange_id, created_time, exchange["messages"])
@@ -0,0 +1,87 @@
+import numpy as np
+import orjson as json
+import redis
+
+from project.cache import get_redis, get_async_redis
+from project.config import settings
+
+# Bumped whenever beliefs, memories or their links change. Cached retrievals remember the
+# version they were built from and are ignored once it moves
+KNOWLEDGE_VERSION_KEY = "knowledge:version"
+
+
+def retrieval_key(interaction_id: str):
+    return f"retrieval:{interaction_id}"
+
+
+def cosine_distance(a: list, b: list) -> float:
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    if a.shape != b.shape:
+        return 1.0
+    norm = np.linalg.norm(a) * np.linalg.norm(b)
+    # zero vectors, or NaN from null components, match nothing
+    if not np.isfinite(norm) or norm == 0:
+        return 1.0
+    return float(1 - np.dot(a, b) / norm)
+
+
+def bump_knowledge_version():
+    ## for celery tasks
+    try:
+        get_redis().incr(KNOWLEDGE_VERSION_KEY)
+    except redis.RedisError as e:
+        print(f"Retrieval cache unavailable: {str(e)}")
+
+
+async def async_bump_knowledge_version():
+    try:
+        await get_async_redis().incr(KNOWLEDGE_VERSION_KEY)
+    except redis.RedisError as e:
+        print(f"Retrieval cache unavailable: {str(e)}")
+
+
+async def get_cached_knowledge(interaction_id: str, context_embedding: list):
+    ## Returns (knowledge bundle or None, knowledge version). The bundle is reused when the
+    ## conversation hasn't moved - the new context is within RETRIEVAL_CACHE_DISTANCE (cosine)
+    ## of the one it was retrieved for, and nothing changed since. Pass the version on to
+    ## cache_knowledge so a change during retrieval isn't cached as current
+    if settings.RETRIEVAL_CACHE_DISTANCE <= 0:
+        return None, None
+    try:
+        pipe = get_async_redis().pipeline(transaction=False)
+        pipe.get(KNOWLEDGE_VERSION_KEY)
+        pipe.get(retrieval_key(interaction_id))
+        version, cached = await pipe.execute()
+    except redis.RedisError as e:
+        print(f"Retrieval cache unavailable: {str(e)}")
+        return None, None
+
+    version = int(version or 0)
+    if cached is None:
+        return None, version
+    try:
+        cached = json.loads(cached)
+        if cached["version"] != version:
+            return None, version
+        embedding, knowledge = cached["embedding"], cached["knowledge"]
+    except (ValueError, KeyError, TypeError) as e:
+        # a malformed entry is a miss - the next cache_knowledge overwrites it
+        print(f"Retrieval cache entry unreadable: {str(e)}")
+        return None, version
+    if not isinstance(embedding, list) or \
+            cosine_distance(embedding, context_embedding) > settings.RETRIEVAL_CACHE_DISTANCE:
+        return None, version
+    return knowledge, version
+
+
+async def cache_knowledge(interaction_id: str, context_embedding: list, knowledge: dict,
+                          version: int):
+    if version is None:
+        return
+    payload = {"version": version, "embedding": context_embedding, "knowledge": knowledge}
+    try:
+        await get_async_redis().set(retrieval_key(interaction_id), json.dumps(payload),
+                                    ex=settings.RETRIEVAL_CACHE_TTL)
+    except redis.RedisError as e:
+        print(f"Retrieval cache unavailable: {str(e)}")
@@ -7,7 +7,8 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from project.database import get_db_sess
 
 from project.knowledge.models import Topic, TopicBelief, Belief
-from project.embedding.voyage import voyage_embedding
+from project.embedding.voyage import async_voyage_embedding
+from project.knowledge.cache import async_bump_knowledge_version
 
 knowledge_router = APIRouter(
     prefix="/knowledge",
@@ -16,7 +17,7 @@ knowledge_router = APIRouter(
 @knowledge_router.post("/belief/update")
 async def update_beliefs(request: Request, session: AsyncSession = Depends(get_db_sess)):
     data = await request.json() 
-    embedding = voyage_embedding(data["text"], query=False)
+    embedding = await async_voyage_embedding(data["text"], query=False)
 
     try:
         await session.execute(
@@ -25,6 +26,7 @@ async def update_beliefs(request: Request, session: AsyncSession = Depends(get_d
             .values(text=data["text"], embedding=embedding, type=None)
         )
         await session.commit()
+        await async_bump_knowledge_version()
         return {"id": data["id"]}
     except:
         await session.rollback()
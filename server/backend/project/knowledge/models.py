@@ -4,7 +4,7 @@ from sqlalchemy import Column, Integer, Text, String, ForeignKey, types, text
 from sqlalchemy.sql import func, false, true
 from sqlalchemy.orm import mapped_column, Mapped, relationship
 from project.database import Base
-from project.utils.db_types import Embedding
+from project.utils.db_types import Embedding, hnsw_index
 from project.interact.models import Memory
 
 
@@ -15,6 +15,7 @@ class Category(Base):
     embedding : Mapped[List[float]] = mapped_column(Embedding(512), nullable=True)
 
     topics: Mapped[List["Topic"]] = relationship(cascade="save-update")
+    __table_args__ = (hnsw_index("category_embedding_hnsw_idx"),)
 
 
 class Topic(Base):
@@ -30,6 +31,7 @@ class Topic(Base):
     category_id : Mapped[uuid.UUID] = mapped_column(ForeignKey("category.id", name="category_id_topic_fkey", ondelete='SET NULL', onupdate='CASCADE'), nullable=True)
     # Maps to association table defined below
     belief_ids: Mapped[List["TopicBelief"]] = relationship(cascade="all, delete",back_populates="topic")
+    __table_args__ = (hnsw_index("topic_embedding_hnsw_idx"),)
 
 
 class Belief(Base):
@@ -47,6 +49,7 @@ class Belief(Base):
 
     version_id = mapped_column(Integer, nullable=False, server_default="1")
     __mapper_args__ = {"version_id_col": version_id}
+    __table_args__ = (hnsw_index("belief_embedding_hnsw_idx"),)
 
 
 # Association Tables *******************************************************
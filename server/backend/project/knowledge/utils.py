@@ -1,37 +1,34 @@
 from datetime import datetime, timezone
 from fastapi import HTTPException
 
-from sqlalchemy import update, select, func
+from sqlalchemy import update, select, func, true, bindparam
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from project.interact.models import Memory, Exchange, Interaction
 from project.knowledge.models import TopicBelief, Topic, Belief, BeliefMemory
 from project.embedding.voyage import voyage_embedding
+from project.metrics import timed
+from project.utils.db_types import Embedding, exact_l2_distance, hnsw_ef_search
 from project.analysis.utils import truncate
 from project.analysis import tasks
 
 from opentelemetry import trace
 from opentelemetry.trace.status import StatusCode
 
+# candidate beliefs per topic that the type quotas pick from
+BELIEF_CANDIDATES = 50
+
 async def get_topics(context_embedding: list, session: AsyncSession):
     tracer = trace.get_tracer(__name__)
-    with tracer.start_as_current_span("get_topics", openinference_span_kind="unknown") as span:
+    with tracer.start_as_current_span("get_topics", openinference_span_kind="unknown") as span, timed("get_topics"):
         span.set_input({"embedding": context_embedding})
-        subquery = (
-            select(Topic.id, Topic.name, Topic.category_id,
-                Topic.embedding.l2_distance(context_embedding).label('distance'),
-                func.rank().over(
-                    order_by=Topic.embedding.l2_distance(context_embedding),
-                    partition_by=Topic.category_id,
-                ).label('rank'))
-            .subquery()
-        )
-
+        # The 2 closest topics overall are always within the top 2 of their own
+        # category, so a plain ORDER BY ... LIMIT gives the same result as ranking
+        # per category - and lets the planner walk the HNSW index
+        await session.execute(hnsw_ef_search())
         query_results = (await session.execute(
-            select(subquery.c.id, subquery.c.name, subquery.c.category_id,
-                    subquery.c.rank, subquery.c.distance)
-            .where(subquery.c.rank <= 2)
-            .order_by(subquery.c.distance)
+            select(Topic.id, Topic.name, Topic.category_id)
+            .order_by(Topic.embedding.l2_distance(context_embedding))
             .limit(2)
         )).all()
         
@@ -48,25 +45,26 @@ async def get_topics(context_embedding: list, session: AsyncSession):
 async def extract_knowledge(context_embedding: list, topics: list, 
                             session: AsyncSession):
     tracer = trace.get_tracer(__name__)
-    with tracer.start_as_current_span("extract_knowledge", openinference_span_kind="unknown") as span:
+    with tracer.start_as_current_span("extract_knowledge", openinference_span_kind="unknown") as span, timed("extract_knowledge"):
         span.set_input({"embedding": context_embedding, "topic_ids": topics})
-        subquery = (
+        # top BELIEF_CANDIDATES beliefs per topic - ORDER BY ... LIMIT inside a LATERAL join.
+        # Exact distances, the beliefs are filtered by topic (see exact_l2_distance)
+        belief_distance = exact_l2_distance(Belief.embedding, context_embedding)
+        topic_beliefs = (
             select(TopicBelief.belief_id, Belief.text, Belief.type,
-                Topic.name.label('topic'), 
-                func.rank().over(
-                    order_by=Belief.embedding.l2_distance(context_embedding),
-                    partition_by=TopicBelief.topic_id,
-                ).label('rank'))
-            .where(TopicBelief.topic_id.in_(topics))
+                belief_distance.label('distance'))
             .join_from(TopicBelief, Belief, TopicBelief.belief_id == Belief.id)
-            .join_from(TopicBelief, Topic, TopicBelief.topic_id == Topic.id)
-            .subquery()
+            .where(TopicBelief.topic_id == Topic.id)
+            .order_by(belief_distance)
+            .limit(BELIEF_CANDIDATES)
+            .lateral()
         )
         beliefs = (await session.execute(
-            select(subquery.c.belief_id, subquery.c.text, subquery.c.type,
-                    subquery.c.topic, subquery.c.rank)
-            .where(subquery.c.rank <= 50)
-            .order_by(subquery.c.rank)
+            select(topic_beliefs.c.belief_id, topic_beliefs.c.text, topic_beliefs.c.type,
+                    Topic.name.label('topic'))
+            .join_from(Topic, topic_beliefs, true())
+            .where(Topic.id.in_(topics))
+            .order_by(topic_beliefs.c.distance)
         )).all()
 
         topic_map = {}
@@ -92,20 +90,19 @@ async def extract_knowledge(context_embedding: list, topics: list,
                     "topic": topic, "memories": [], "summaries": [],
                     "idx": len(topic_map[topic]["ids"]) - 1 }
         
-        subquery = (
-            select(BeliefMemory.belief_id, Memory.text, Memory.summary,
-                func.rank().over(
-                    order_by=Memory.embedding.l2_distance(context_embedding),
-                    partition_by=BeliefMemory.belief_id
-                ).label('rank'))
-            .where(BeliefMemory.belief_id.in_(belief_ids))
+        # closest linked memory per belief - exact, only the linked memories count
+        belief_memories = (
+            select(Memory.text, Memory.summary)
             .join_from(BeliefMemory, Memory, BeliefMemory.memory_id == Memory.id)
-            .subquery()
+            .where(BeliefMemory.belief_id == Belief.id)
+            .order_by(exact_l2_distance(Memory.embedding, context_embedding))
+            .limit(1)
+            .lateral()
         )
         memories = (await session.execute(
-            select(subquery.c.belief_id, subquery.c.text, subquery.c.summary,
-                    subquery.c.rank)
-            .where(subquery.c.rank <= 1)
+            select(Belief.id, belief_memories.c.text, belief_memories.c.summary)
+            .join_from(Belief, belief_memories, true())
+            .where(Belief.id.in_(belief_ids))
         )).all()
 
         for row in memories:
@@ -127,6 +124,95 @@ async def extract_knowledge(context_embedding: list, topics: list,
     return result
 
 
+def knowledge_query(context_embedding: list):
+    ## get_topics + extract_knowledge as one statement. The embedding is bound once and every
+    ## distance is computed against it in the database:
+    ##   nearest_topics - 2 closest topics (HNSW)
+    ##   by_type        - top BELIEF_CANDIDATES beliefs per topic (LATERAL, exact), ranked per type
+    ##   selected       - at most 2 per type, then the 4 closest per topic
+    ##   final select   - closest linked memory per selected belief (LATERAL, exact, may be missing)
+    ## Only the unfiltered topic lookup uses the HNSW index - the LATERALs rank rows filtered
+    ## by a join, where an index scan could come up short (see exact_l2_distance)
+    query = bindparam("context_embedding", context_embedding, type_=Embedding(len(context_embedding)))
+    topics = (
+        select(Topic.id, Topic.name)
+        .order_by(Topic.embedding.l2_distance(query))
+        .limit(2)
+        .cte("nearest_topics")
+    )
+    belief_distance = exact_l2_distance(Belief.embedding, query)
+    topic_beliefs = (
+        select(TopicBelief.belief_id, Belief.text, Belief.type,
+               belief_distance.label('distance'))
+        .join_from(TopicBelief, Belief, TopicBelief.belief_id == Belief.id)
+        .where(TopicBelief.topic_id == topics.c.id)
+        .order_by(belief_distance)
+        .limit(BELIEF_CANDIDATES)
+        .lateral()
+    )
+    by_type = (
+        select(topics.c.id.label('topic_id'), topics.c.name.label('topic'),
+               topic_beliefs.c.belief_id, topic_beliefs.c.text, topic_beliefs.c.distance,
+               func.row_number().over(
+                   partition_by=(topics.c.id, topic_beliefs.c.type),
+                   order_by=topic_beliefs.c.distance,
+               ).label('type_rank'))
+        .join_from(topics, topic_beliefs, true())
+        .cte("by_type")
+    )
+    by_topic = (
+        select(by_type.c.topic, by_type.c.belief_id, by_type.c.text, by_type.c.distance,
+               func.row_number().over(
+                   partition_by=by_type.c.topic_id,
+                   order_by=by_type.c.distance,
+               ).label('topic_rank'))
+        .where(by_type.c.type_rank <= 2)
+        .subquery()
+    )
+    selected = (
+        select(by_topic)
+        .where(by_topic.c.topic_rank <= 4)
+        .cte("selected")
+    )
+    belief_memories = (
+        select(Memory.text, Memory.summary)
+        .join_from(BeliefMemory, Memory, BeliefMemory.memory_id == Memory.id)
+        .where(BeliefMemory.belief_id == selected.c.belief_id)
+        .order_by(exact_l2_distance(Memory.embedding, query))
+        .limit(1)
+        .lateral()
+    )
+    return (
+        select(selected.c.topic, selected.c.belief_id, selected.c.text,
+               belief_memories.c.text.label('memory'), belief_memories.c.summary)
+        .join_from(selected, belief_memories, true(), isouter=True)
+        .order_by(selected.c.distance)
+    )
+
+
+async def retrieve_knowledge(context_embedding: list, session: AsyncSession):
+    ## Same result as extract_knowledge(get_topics(...)) in a single round trip
+    ## (plus the SET LOCAL for ef_search)
+    tracer = trace.get_tracer(__name__)
+    with tracer.start_as_current_span("retrieve_knowledge", openinference_span_kind="retriever") as span, timed("retrieve_knowledge"):
+        span.set_input({"embedding": context_embedding})
+        # only nearest_topics is HNSW-ordered, the belief LATERALs are exact
+        await session.execute(hnsw_ef_search())
+        rows = (await session.execute(knowledge_query(context_embedding))).all()
+
+        result = {}
+        for row in rows:
+            topic = result.setdefault(row[0], {"beliefs": []})
+            topic["beliefs"].append({
+                "belief": row[2],
+                "memories": [row[3]] if row[3] is not None else [],
+                "summaries": [row[4]] if row[3] is not None else [],
+            })
+        span.set_output({"result": result})
+        span.set_status(StatusCode.OK)
+    return result
+
+
 def format_knowledge(knowledge_dict: dict) -> str:
     ## take a knowledge dict and format it into a returned string. 
     ## double check the intake format in test file - Ben
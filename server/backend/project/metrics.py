@@ -0,0 +1,78 @@
+import time
+from contextlib import contextmanager
+
+from fastapi import APIRouter, Response
+from prometheus_client import REGISTRY, CONTENT_TYPE_LATEST, Counter, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from project.embedding.cache import embedding_cache
+
+# Aggregated counterpart of the Phoenix spans, scraped from /metrics. Per process - each web
+# worker reports its own, celery workers don't serve any
+# https://prometheus.github.io/client_python/
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+STAGE_SECONDS = Histogram(
+    "mirror_stage_seconds",
+    "Latency of chat pipeline stages - embedding, retrieval queries, LLM calls, record_exchange",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+LLM_TOKENS = Counter(
+    "mirror_llm_tokens",
+    "Estimated Claude tokens (utils.tokens), in = prompt and out = response",
+    ["direction"],
+)
+EMBEDDING_TOKENS = Counter(
+    "mirror_embedding_tokens",
+    "Estimated tokens sent to the embedding provider (cache misses only)",
+)
+RETRIEVAL_CACHE = Counter(
+    "mirror_retrieval_cache",
+    "Per-interaction retrieval cache lookups by result",
+    ["result"],
+)
+DB_POOL_WAIT_SECONDS = Histogram(
+    "mirror_db_pool_wait_seconds",
+    "Time to check out a connection from the async database pool, opening one included",
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0),
+)
+
+
+@contextmanager
+def timed(stage: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - start)
+
+
+class EmbeddingCacheCollector:
+    ## embedding_cache keeps its own counts - read them at scrape time instead of mirroring them
+    def collect(self):
+        family = CounterMetricFamily("mirror_embedding_cache", "Embedding cache lookups by result", labels=["result"])
+        for result, count in embedding_cache.stats().items():
+            family.add_metric([result], count)
+        yield family
+
+
+REGISTRY.register(EmbeddingCacheCollector())
+
+
+class TimedAsyncPool(AsyncAdaptedQueuePool):
+    ## AsyncAdaptedQueuePool that records how long each checkout waits for a connection
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            DB_POOL_WAIT_SECONDS.observe(time.perf_counter() - start)
+
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get("/metrics", include_in_schema=False)
+async def metrics():
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,179 @@
+import orjson as json
+
+from project.config import settings
+from project.analysis.utils import truncate
+from project.knowledge.utils import format_knowledge
+from project.prompt.claude import claude_belief_prompt, claude_style_prompt
+from project.utils.tokens import estimate_tokens, token_chars
+
+# Belief prompt sections in priority order, with the share of the budget each is guaranteed.
+# Whatever a section doesn't use is handed to the others in the same order
+BELIEF_SHARES = {
+    "beliefs": 0.2,
+    "history": 0.4,
+    "summary": 0.1,
+    "memories": 0.3,
+}
+
+
+def prompt_tokens(prompt: list) -> int:
+    return sum(estimate_tokens(message["content"]) for message in prompt)
+
+
+def allocate(budget: int, demands: dict, shares: dict) -> dict:
+    ## Splits `budget` between sections. Every section first gets up to its share, then the
+    ## leftover goes out in priority (dict) order. No section gets more than it asked for
+    budget = max(0, budget)
+    grants = {name: min(demand, int(budget * shares.get(name, 0)))
+              for name, demand in demands.items()}
+    left = budget - sum(grants.values())
+    for name, demand in demands.items():
+        extra = min(demand - grants[name], left)
+        if extra > 0:
+            grants[name] += extra
+            left -= extra
+    return grants
+
+
+def _water_fill(budget: int, demands: list) -> list:
+    ## Even split that gives what small items don't need to the bigger ones
+    grants = [0] * len(demands)
+    order = sorted(range(len(demands)), key=lambda idx: demands[idx])
+    for position, idx in enumerate(order):
+        grants[idx] = min(demands[idx], budget // (len(order) - position))
+        budget -= grants[idx]
+    return grants
+
+
+def _ranked_beliefs(knowledge_dict: dict) -> list:
+    ## (topic, belief) pairs interleaved by rank, so a tight budget keeps the best
+    ## beliefs of every topic before the second best of any
+    ranked = []
+    depth = max((len(topic["beliefs"]) for topic in knowledge_dict.values()), default=0)
+    for rank in range(depth):
+        for topic, entry in knowledge_dict.items():
+            if rank < len(entry["beliefs"]):
+                ranked.append((topic, entry["beliefs"][rank]))
+    return ranked
+
+
+def _json_tokens(value) -> int:
+    return estimate_tokens(json.dumps(value).decode('utf-8'))
+
+
+def _topic_tokens(topic: str) -> int:
+    ## what format_knowledge adds for one more topic (name, description, framing)
+    return _json_tokens(format_knowledge({topic: {"beliefs": []}})) - _json_tokens({"topics": {}})
+
+
+def _belief_tokens(belief: dict) -> int:
+    return _json_tokens({"belief": belief["belief"], "memories": [], "summaries": []})
+
+
+def _text_tokens(texts: list) -> int:
+    # +1 per string for the quotes and comma around it in the schema JSON
+    return sum(estimate_tokens(text) + 1 for text in texts if text)
+
+
+def _memory_tokens(belief: dict) -> int:
+    return _text_tokens(belief["memories"] + belief["summaries"])
+
+
+def _fit_history(history: list, budget: int) -> list:
+    ## newest messages first; the oldest one that doesn't fit whole is truncated
+    kept = []
+    for message in reversed(history):
+        tokens = estimate_tokens(message["content"])
+        if tokens <= budget:
+            kept.insert(0, message)
+            budget -= tokens
+            continue
+        if budget > 0:
+            kept.insert(0, {"role": message["role"],
+                            "content": truncate(message["content"], token_chars(budget))})
+        break
+    # the prompt already ends on an assistant turn, so history has to start with the user
+    while kept and (kept[0]["role"] != "user" or not kept[0]["content"]):
+        kept.pop(0)
+    return kept
+
+
+def assemble_belief_prompt(knowledge_dict: dict, history: list, summary: str = None,
+                           budget: int = None):
+    ## claude_belief_prompt cut down to `budget` estimated tokens. The last history message
+    ## (the user's new message) is always sent. Returns (prompt, tokens used per section)
+    budget = settings.PROMPT_TOKEN_BUDGET if budget is None else budget
+    message, earlier = history[-1:], history[:-1]
+    budget -= prompt_tokens(claude_belief_prompt(format_knowledge({}), message))
+
+    ranked = _ranked_beliefs(knowledge_dict)
+    grants = allocate(budget, {
+        "beliefs": sum(_belief_tokens(belief) for _, belief in ranked)
+                   + sum(_topic_tokens(topic) for topic in knowledge_dict),
+        "history": sum(estimate_tokens(message["content"]) for message in earlier),
+        "summary": estimate_tokens(summary),
+        "memories": sum(_memory_tokens(belief) for _, belief in ranked),
+    }, BELIEF_SHARES)
+
+    kept = []
+    left = grants["beliefs"]
+    for topic, belief in ranked:
+        tokens = _belief_tokens(belief)
+        if topic not in (kept_topic for kept_topic, _ in kept):
+            tokens += _topic_tokens(topic)
+        if tokens > left:
+            break
+        kept.append((topic, belief))
+        left -= tokens
+
+    # memory text is cut to fit, the short summaries are kept whole while they fit
+    memory_grants = _water_fill(grants["memories"], [_memory_tokens(belief) for _, belief in kept])
+    fitted = {}
+    for (topic, belief), grant in zip(kept, memory_grants):
+        summaries = [text for text in belief["summaries"] if text]
+        summary_tokens = _text_tokens(summaries)
+        if summary_tokens > grant:
+            summaries, summary_tokens = [], 0
+        memories = [text for text in belief["memories"] if text]
+        share = (grant - summary_tokens) // max(1, len(memories))
+        memories = [truncate(text, token_chars(share - 1)) for text in memories]
+        fitted.setdefault(topic, {"beliefs": []})["beliefs"].append({
+            "belief": belief["belief"],
+            "memories": [text for text in memories if text],
+            "summaries": summaries,
+        })
+
+    history = _fit_history(earlier, grants["history"]) + message
+    summary = truncate(summary, token_chars(grants["summary"])) if summary else None
+    prompt = claude_belief_prompt(format_knowledge(fitted), history, summary)
+    usage = {
+        "beliefs": grants["beliefs"] - left,
+        "memories": sum(_memory_tokens(belief) for topic in fitted.values()
+                        for belief in topic["beliefs"]),
+        "history": sum(estimate_tokens(message["content"]) for message in history),
+        "summary": estimate_tokens(summary),
+        "total": prompt_tokens(prompt),
+    }
+    return prompt, usage
+
+
+def assemble_style_prompt(generation: str, samples: list, budget: int = None):
+    ## claude_style_prompt with writing samples added until `budget` estimated tokens.
+    ## The message to rewrite is always sent. Returns (prompt, tokens used)
+    budget = settings.STYLE_PROMPT_TOKEN_BUDGET if budget is None else budget
+    budget -= prompt_tokens(claude_style_prompt({"message": generation, "writing_samples": []}))
+
+    fitted = []
+    for sample in samples:
+        # +1 for the quotes and comma around it
+        tokens = estimate_tokens(sample) + 1
+        if tokens > budget:
+            sample = truncate(sample, token_chars(budget - 1))
+            if sample:
+                fitted.append(sample)
+            break
+        fitted.append(sample)
+        budget -= tokens
+
+    prompt = claude_style_prompt({"message": generation, "writing_samples": fitted})
+    return prompt, prompt_tokens(prompt)
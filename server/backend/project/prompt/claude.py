@@ -1,7 +1,12 @@
+import asyncio
 import orjson as json
 import anthropic
 from project.config import settings
+from project.metrics import LLM_TOKENS, timed
+from project.utils.ratelimit import RateLimiter
+from project.utils.tokens import estimate_tokens
 from langchain_anthropic import ChatAnthropic
+from project.prompt.fake import FakeClaude
 from phoenix.otel import register
 from openinference.instrumentation.langchain import LangChainInstrumentor
 # from opentelemetry import trace as trace_api
@@ -15,16 +20,68 @@ tracer_provider = register(project_name="mirror")
 LangChainInstrumentor().instrument(tracer_provider=tracer_provider)
 
 # client = anthropic.Anthropic(api_key=settings.ANTHROPIC_API_KEY)
-llm = ChatAnthropic(
-    model="claude-3-5-sonnet-20241022",
-    max_tokens=1000,
-    temperature=0,
-    system=""
-)
+# part of the analysis cache key - changing it re-analyzes uploads
+if settings.LLM_PROVIDER == "fake":
+    CLAUDE_MODEL = "fake-claude"
+    llm = FakeClaude(latency_ms=settings.FAKE_LLM_LATENCY_MS, latency_sigma=settings.FAKE_LLM_LATENCY_SIGMA)
+    claude_limiter = RateLimiter("anthropic", 0, 0)
+else:
+    CLAUDE_MODEL = "claude-3-5-sonnet-20241022"
+    llm = ChatAnthropic(
+        model=CLAUDE_MODEL,
+        max_tokens=1000,
+        temperature=0,
+        system=""
+    )
+    claude_limiter = RateLimiter("anthropic", settings.ANTHROPIC_RPM, settings.ANTHROPIC_TPM)
+
+# Caps in-flight Claude requests per web process. ChatAnthropic caches its AsyncAnthropic
+# client, so all calls also share one connection pool.
+_llm_semaphore = asyncio.Semaphore(settings.CLAUDE_MAX_CONCURRENCY)
+
+
+def _input_tokens(prompt: list) -> int:
+    return sum(estimate_tokens(message["content"]) for message in prompt)
 
 def claude_call(prompt: list):
-    message = llm.invoke(prompt)
+    ## Blocking - only for celery workers and scripts. Use async_claude_call in endpoints.
+    ## Background priority - waits behind chat requests when the budget runs low
+    tokens = _input_tokens(prompt)
+    claude_limiter.acquire(tokens)
+    with timed("llm"):
+        message = llm.invoke(prompt)
+    LLM_TOKENS.labels("in").inc(tokens)
+    LLM_TOKENS.labels("out").inc(estimate_tokens(message.content))
+    return message.content
+
+
+async def async_claude_call(prompt: list):
+    tokens = _input_tokens(prompt)
+    await claude_limiter.aacquire(tokens)
+    async with _llm_semaphore:
+        with timed("llm"):
+            message = await llm.ainvoke(prompt)
+    LLM_TOKENS.labels("in").inc(tokens)
+    LLM_TOKENS.labels("out").inc(estimate_tokens(message.content))
     return message.content
+
+
+async def async_claude_stream(prompt: list):
+    ## Yields text as Claude generates it
+    tokens = _input_tokens(prompt)
+    await claude_limiter.aacquire(tokens)
+    LLM_TOKENS.labels("in").inc(tokens)
+    generated = []
+    async with _llm_semaphore:
+        with timed("llm_stream"):
+            async for chunk in llm.astream(prompt):
+                content = chunk.content
+                if isinstance(content, list):
+                    content = "".join(block.get("text", "") for block in content if isinstance(block, dict))
+                if content:
+                    generated.append(content)
+                    yield content
+    LLM_TOKENS.labels("out").inc(estimate_tokens("".join(generated)))
     # full_response = ""
     # for block in message.content: 
     #     if hasattr(block, 'text'):  # Ensure we only process text blocks
@@ -32,7 +89,7 @@ def claude_call(prompt: list):
     # return full_response
     
 
-def claude_belief_prompt(knowledge: dict, history: list):
+def claude_belief_prompt(knowledge: dict, history: list, summary: str = None):
     base = ('You are to play the role of a person with the beliefs, memories ' \
             'and opinions defined in the provided JSON schema. You should ' \
             'respond to queries fully in-character, and never acknowledge that ' \
@@ -44,8 +101,14 @@ def claude_belief_prompt(knowledge: dict, history: list):
     prompt = [
         {"role": "user", "content": base + schema},
         {"role": "assistant", "content": "Understood."},
-    ] + history
-    return prompt
+    ]
+    if summary:
+        # older turns, compacted by analysis.tasks.summarize_interaction
+        prompt += [
+            {"role": "user", "content": "Summary of our conversation so far:\n" + summary},
+            {"role": "assistant", "content": "Understood."},
+        ]
+    return prompt + history
     
 
 def claude_style_prompt(outline: dict):
@@ -79,6 +142,25 @@ def claude_belief_analysis(schema: dict, passage: str):
     return prompt
 
 
+def claude_summarize_history(summary: str, formatted: str):
+    base = 'You are given the earlier part of a conversation between a user and an assistant, ' \
+    + 'along with a summary of everything before it (if any). Write an updated summary that ' \
+    + 'merges the previous summary with the new messages. Keep names, facts, opinions and ' \
+    + 'commitments either side stated, and drop small talk. Write it from the assistant\'s ' \
+    + 'point of view in no more than a few short paragraphs. ' \
+    + 'Please write your results in the following format:\n'
+
+    schema = json.dumps({"summary": "[SUMMARY]"}).decode('utf-8')
+    previous = json.dumps({"previous_summary": summary or ""}).decode('utf-8')
+
+    prompt = [
+        {"role": "user", "content": base + schema},
+        {"role": "assistant", "content": "Understood."},
+        {"role": "user", "content": previous + "\n" + formatted}
+    ]
+    return prompt
+
+
 def claude_norm_exchange(formatted: str):
     base = 'You are given a conversation between a subject and a psychologist. ' \
     + 'For each of the subject\'s messages, please rephrase their response so ' \
@@ -0,0 +1,103 @@
+import asyncio
+import hashlib
+import random
+import re
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional
+
+import orjson as json
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+# Offline stand-in for ChatAnthropic (LLM_PROVIDER=fake). Answers are templated from the
+# prompt - the JSON prompts (belief analysis, history summary, exchange normalization) get
+# JSON their callers parse, the role-play prompts get plain text - and are the same for the
+# same prompt. Only the latency is random
+FAKE_TOPICS = ["Career", "Health", "Relationships", "Hobbies", "Education", "Travel", "Family", "Money"]
+FAKE_BELIEF_TYPES = ["core belief", "key opinion", "emotional reflection"]
+
+
+def _text(message: BaseMessage) -> str:
+    content = message.content
+    if isinstance(content, list):
+        content = "".join(block.get("text", "") for block in content if isinstance(block, dict))
+    return content
+
+
+def _words(text: str) -> list:
+    return re.findall(r"[A-Za-z']{4,}", text) or ["things"]
+
+
+def fake_response(messages: List[BaseMessage]) -> str:
+    ## templated answer for one of the prompts in prompt.claude
+    instructions = _text(messages[0])
+    latest = _text(messages[-1])
+    rng = random.Random(hashlib.sha256(latest.encode("utf-8")).digest())
+    words = _words(latest)
+
+    if "psychologist analyzing a subject" in instructions:
+        topics = rng.sample(FAKE_TOPICS, 2)
+        analysis = {"topics": {"topics": [
+            {"topic": topic, "beliefs": [
+                {"belief": f"{topic} matters because of {rng.choice(words).lower()}",
+                 "type": rng.choice(FAKE_BELIEF_TYPES)}
+                for _ in range(2)
+            ]}
+            for topic in topics
+        ]}}
+        return json.dumps(analysis).decode("utf-8")
+    if "earlier part of a conversation" in instructions:
+        return json.dumps({"summary": "We talked about " + ", ".join(words[:12]) + "."}).decode("utf-8")
+    if "conversation between a subject and a psychologist" in instructions:
+        return json.dumps({"user_messages": [latest], "summary": "I talked about " + ", ".join(words[:12]) + "."}).decode("utf-8")
+    return "When it comes to " + " ".join(words[-6:]).lower() + ", I have thought about it a lot. " \
+        + " ".join(rng.choice(words).lower() for _ in range(24)) + "."
+
+
+class FakeClaude(BaseChatModel):
+    ## Chat model with ChatAnthropic's interface. Each call takes a log-normal delay - median
+    ## latency_ms, spread latency_sigma - which streaming spreads over the chunks
+    latency_ms: float = 800.0
+    latency_sigma: float = 0.5
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-claude"
+
+    def _latency(self) -> float:
+        if self.latency_ms <= 0:
+            return 0.0
+        return random.lognormvariate(0, self.latency_sigma) * self.latency_ms / 1000
+
+    def _result(self, messages: List[BaseMessage]) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=fake_response(messages)))])
+
+    def _chunks(self, messages: List[BaseMessage]) -> list:
+        return re.findall(r"\S+\s*", fake_response(messages))
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        time.sleep(self._latency())
+        return self._result(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                         run_manager: Any = None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self._latency())
+        return self._result(messages)
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager: Any = None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        chunks = self._chunks(messages)
+        delay = self._latency() / max(1, len(chunks))
+        for chunk in chunks:
+            time.sleep(delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=chunk))
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                       run_manager: Any = None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        chunks = self._chunks(messages)
+        delay = self._latency() / max(1, len(chunks))
+        for chunk in chunks:
+            await asyncio.sleep(delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=chunk))
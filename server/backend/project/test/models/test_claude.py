@@ -2,7 +2,8 @@ import sys
 from pathlib import Path
 import anthropic
 from project.config import settings
-from project.prompt.claude import claude_call, claude_belief_prompt
+import pytest
+from project.prompt.claude import claude_call, async_claude_call, claude_belief_prompt, claude_style_prompt
 
 # Add Python path when running tests
 project_root = str(Path(__file__).parents[3])
@@ -42,5 +43,17 @@ def test_claude_integration():
     except Exception as e:
         print("Error calling Claude:", str(e))
 
+
+@pytest.mark.asyncio
+async def test_async_claude_call():
+    outline = {
+        "message": "I think AI should be developed responsibly.",
+        "writing_samples": ["Honestly, I just love building things. Always have."]
+    }
+    response = await async_claude_call(claude_style_prompt(outline))
+    assert isinstance(response, str)
+    assert len(response) > 0
+
+
 if __name__ == "__main__":
     test_claude_integration()
\ No newline at end of file
@@ -1,22 +1,52 @@
-from project.analysis.tasks import gen_new_knowledge, gen_file_memories
-from project.interact.models import Memory
-from project.knowledge.models import Category, Topic, TopicBelief, Belief
+from project.analysis import tasks
+from project.analysis.tasks import analyze_memories, persist_knowledge, gen_file_memories, update_writing_samples, summarize_interaction, cluster_memories, dedup_topics, consolidate_topics, expire_uploads
+from project.interact.models import Memory, Interaction, Exchange
+from project.interact.utils import PRUNE_HISTORY_SCRIPT
+from project.knowledge.models import Category, Topic, TopicBelief, Belief, BeliefMemory
+from project.analysis.models import UploadJob, UploadChunk
 from sqlalchemy.orm import Session
 from sqlalchemy import update, select, func
+from sqlalchemy.dialects import postgresql
 from unittest import mock
+import pytest
 from uuid import uuid4
+from datetime import datetime, timezone, timedelta
 import orjson as json
 
 # pytest project/test/tasks/test_analysis.py -v -s   
+def direction(idx: int):
+    # orthogonal embeddings - parallel ones would be merged as duplicate topics
+    vector = [0] * 512
+    vector[idx * 128:(idx + 1) * 128] = [1] * 128
+    return vector
+
+def upload_job(sync_session: Session, memory_ids: list, stage: str = "embedded"):
+    # job whose chunks are the given memories
+    job_id = str(uuid4())
+    sync_session.add(UploadJob(id=job_id, filename="story.txt"))
+    sync_session.flush()
+    for seq, memory_id in enumerate(memory_ids):
+        sync_session.add(UploadChunk(job_id=job_id, seq=seq, memory_id=memory_id, stage=stage))
+    sync_session.commit()
+    return job_id
+
+def analysis_response(knowledge: str):
+    # {topic: {"beliefs": [...]}} in the shape of the belief analysis schema
+    knowledge = json.loads(knowledge)
+    return json.dumps({"topics": {"topics": [
+        {"topic": topic, "beliefs": [{"belief": belief["text"], "type": belief["type"]} for belief in item["beliefs"]]}
+        for topic, item in knowledge.items()
+    ]}})
+
 def test_gen_new_knowledge(sync_session: Session):
     memory_ids = [str(uuid4()) for _ in range(4)]
     for i in range(4):
         sync_session.add(Memory(id=memory_ids[i], text="test" + str(i), summary="test" + str(i), embedding=[i] * 512))
     sync_session.commit()
     
-    sync_session.add(Category(id=str(uuid4()), name="Hobby", embedding=[0] * 512))
-    sync_session.add(Category(id=str(uuid4()), name="Relationship", embedding=[10] * 512))
-    sync_session.add(Category(id=str(uuid4()), name="Education", embedding=[100] * 512))
+    sync_session.add(Category(id=str(uuid4()), name="Hobby", embedding=direction(0)))
+    sync_session.add(Category(id=str(uuid4()), name="Relationship", embedding=direction(1)))
+    sync_session.add(Category(id=str(uuid4()), name="Education", embedding=direction(2)))
     sync_session.commit()
 
     with mock.patch('project.analysis.tasks.get_sync_sess') as mocked_session:
@@ -85,17 +115,22 @@ def test_gen_new_knowledge(sync_session: Session):
                 }
             }),
         ]
-        with mock.patch('project.analysis.tasks.claude_call', side_effect=claude_responses) as mocked_claude:  
-            embedding_responses = [
-                [[1] * 512, [11] * 512, [99] * 512,],
-                [[1.1] * 512, [1.2] * 512, [1.3] * 512, [1.4] * 512, [1.5] * 512, [1.6] * 512, [1.7] * 512, [1.8] * 512,],
-                [[11.1] * 512, [11.2] * 512, [11.3] * 512, [11.4] * 512, [11.5] * 512, [11.6] * 512, [11.7] * 512, [11.8] * 512,],
-                [[99.1] * 512, [99.2] * 512],
-            ]
-            with mock.patch('project.analysis.tasks.voyage_embedding', side_effect=embedding_responses) as mocked_embedding:  
-                gen_new_knowledge(memory_ids)
+        claude_responses = [analysis_response(response) for response in claude_responses]
+        job_id = upload_job(sync_session, memory_ids)
+        with mock.patch('project.analysis.tasks.claude_call', side_effect=claude_responses) as mocked_claude, \
+            mock.patch('project.analysis.tasks.bump_knowledge_version'):
+            topic_embeddings = [direction(0), direction(1), direction(2)]
+            belief_embeddings = [[1.1] * 512, [1.2] * 512, [1.3] * 512, [1.4] * 512, [1.5] * 512, [1.6] * 512, [1.7] * 512, [1.8] * 512,] \
+                + [[11.1] * 512, [11.2] * 512, [11.3] * 512, [11.4] * 512, [11.5] * 512, [11.6] * 512, [11.7] * 512, [11.8] * 512,] \
+                + [[99.1] * 512, [99.2] * 512]
+            with mock.patch('project.analysis.tasks.voyage_embedding', return_value=topic_embeddings) as mocked_embedding, \
+                mock.patch('project.analysis.tasks.voyage_embedding_batched', return_value=belief_embeddings) as mocked_batched:
+                # same work gen_new_knowledge fans out through a chord
+                results = [analyze_memories(job_id, [0, 1], {}), analyze_memories(job_id, [2, 3], {})]
+                persist_knowledge(results, job_id, {})
                 assert mocked_claude.call_count == 4
-                assert mocked_embedding.call_count == 4
+                assert mocked_embedding.call_count == 1
+                assert mocked_batched.call_count == 1
                 topics = sync_session.scalars(
                     select(Topic)
                     .order_by(Topic.name)
@@ -134,9 +169,84 @@ def test_gen_new_knowledge(sync_session: Session):
                     select(TopicBelief)
                 ).all()
                 assert len(topic_beliefs) == 18
+
+                stages = sync_session.scalars(select(UploadChunk.stage).where(UploadChunk.job_id == job_id)).all()
+                assert stages == ["persisted"] * 4
+                job = sync_session.get(UploadJob, job_id)
+                assert len(job.belief_ids) == 18
+
+                # a rerun finds nothing left to analyze or persist
+                analyze_memories(job_id, [0, 1, 2, 3], {})
+                persist_knowledge([], job_id, {})
+                assert mocked_claude.call_count == 4
+                assert sync_session.scalar(select(func.count(Belief.id))) == 18
+
+
+def test_analyze_memories_resume(sync_session: Session):
+    memory_ids = [str(uuid4()) for _ in range(3)]
+    for i in range(3):
+        sync_session.add(Memory(id=memory_ids[i], text="test" + str(i), embedding=[i] * 512))
+    sync_session.commit()
+    job_id = upload_job(sync_session, memory_ids)
+
+    response = analysis_response(json.dumps({"Cooking": {"beliefs": [{"text": "Salt early", "type": "key opinion"}]}}))
+    with mock.patch('project.analysis.tasks.get_sync_sess') as mocked_session:
+        mocked_session.return_value = sync_session
+        # Claude fails on the second chunk - the first keeps its analysis
+        with mock.patch('project.analysis.tasks.claude_call', side_effect=[response, RuntimeError("overloaded")]):
+            with pytest.raises(RuntimeError):
+                analyze_memories(job_id, [0, 1, 2], {})
+
+        # the retry only asks about the chunks still unanalyzed
+        with mock.patch('project.analysis.tasks.claude_call', side_effect=[response, "not json"]) as mocked_claude:
+            assert analyze_memories(job_id, [0, 1, 2], {}) == 2
+            assert mocked_claude.call_count == 2
+
+    chunks = sync_session.scalars(
+        select(UploadChunk)
+        .where(UploadChunk.job_id == job_id)
+        .order_by(UploadChunk.seq)
+    ).all()
+    assert [chunk.stage for chunk in chunks] == ["analyzed"] * 3
+    assert chunks[0].analysis == {"Cooking": {"beliefs": [{"belief": "Salt early", "type": "opinion"}]}}
+    assert chunks[1].analysis == chunks[0].analysis
+    # an unparseable answer isn't asked again
+    assert chunks[2].analysis == {}
+
+
+def test_analyze_memories_cache(sync_session: Session):
+    memory_ids = [str(uuid4()) for _ in range(3)]
+    for i, text in enumerate(["same passage", "same passage", "new passage"]):
+        sync_session.add(Memory(id=memory_ids[i], text=text, embedding=[i] * 512))
+    sync_session.commit()
+    first_job = upload_job(sync_session, memory_ids[:1])
+    second_job = upload_job(sync_session, memory_ids[1:])
+
+    response = analysis_response(json.dumps({"Cooking": {"beliefs": [{"text": "Salt early", "type": "key opinion"}]}}))
+    with mock.patch('project.analysis.tasks.get_sync_sess') as mocked_session, \
+         mock.patch('project.analysis.tasks.claude_call', return_value=response) as mocked_claude:
+        mocked_session.return_value = sync_session
+        analyze_memories(first_job, [0], {})
+        assert mocked_claude.call_count == 1
+        # the re-uploaded passage is answered from the cache, only the new one reaches Claude
+        analyze_memories(second_job, [0, 1], {})
+        assert mocked_claude.call_count == 2
+
+        # a new schema is a new prompt - nothing cached applies
+        with mock.patch('project.analysis.tasks.get_belief_analysis_schema', return_value={"topics": "changed"}):
+            third_job = upload_job(sync_session, memory_ids[:1])
+            analyze_memories(third_job, [0], {})
+            assert mocked_claude.call_count == 3
+
+    analyses = sync_session.scalars(
+        select(UploadChunk.analysis)
+        .where(UploadChunk.job_id == second_job)
+        .order_by(UploadChunk.seq)
+    ).all()
+    assert analyses == [{"Cooking": {"beliefs": [{"belief": "Salt early", "type": "opinion"}]}}] * 2
             
 
-def test_gen_file_memories(sync_session: Session):
+def test_gen_file_memories(sync_session: Session, tmp_path):
     story = 'The sea surrounded him. His gaze was drawn out into the hypnotic swell and surge of emerald. It mixed with the smudges across the sky and the boughs of the clouds. Hanging grey swirled and the emerald curves clawed up. Everything shifted together in a menagerie of cold, wet colours. Lao tried to look away from the tearing, rising, and falling of the ocean and sky but he couldn’t. He was transfixed.\n\n' \
     + 'Something moved up beside him, but Lao could still not take his eyes from the horizons. The blurred shape started to hum next to him and despite the proximity Lao could barely hear the noise over the roaring call of the foaming waves. But the humming persisted and it seemed to grow louder drowning the sound of the sea.\n\n' \
     + 'Lao shook his head to clear it and turned to the figure beside him. "Abbott?" The long arms of the sloth were draped over a walking cane and he beamed with his characteristic grin. “What are you doing out here?”\n\n' \
@@ -146,12 +256,25 @@ def test_gen_file_memories(sync_session: Session):
     + 'Long arms slowly retreated and rested back on the tip of the walking stick. Hui looked at Lao with his cool, shining eyes. “Well we shall start with bringing you back, shall we?”\n\n' \
     + 'Something small fell out from Lao’s belly as his mind whirled around the possibilities of what Hui had said. Had something happened to Akiko? Was Clamshell okay? He opened his mouth but Hui cut him off again, waving one of his long clawed hands in Lao’s direction. “No no. To bring you back to the here and now. There’s only one reason a person gets a thousand yard stare in their eyes and then keeps looking.”\n\n' \
     + 'A chill ran up Lao’s spine. He knew what the old sloth was talking about. Those moments when he wasn’t sure if he was standing on the shore of the waves, the brief sensation of standing at the bottom of the ocean, or his mind spreading and showing him glimpses of illuminated fish swimming through utter blackness alongside the visions of whales floating through cerulean. Neither the thief, the priest, or the monk, Lao’s power came from the ocean itself and he was risking losing himself to it.\n\n'
-    data = bytes(story, 'utf-8')
+    path = tmp_path / "upload.txt"
+    path.write_bytes(bytes(story, 'utf-8'))
 
     with mock.patch('project.analysis.tasks.get_sync_sess') as mocked_function:
         mocked_function.return_value = sync_session
-        memory_ids = gen_file_memories(data, "story.txt", 50)
+        job_id = str(uuid4())
+        sync_session.add(UploadJob(id=job_id, filename="story.txt", path=str(path)))
+        sync_session.commit()
+        assert gen_file_memories(job_id, 50) == job_id
+        assert not path.exists()
+        assert sync_session.get(UploadJob, job_id).path is None
+        memory_ids = sync_session.scalars(
+            select(UploadChunk.memory_id)
+            .where(UploadChunk.job_id == job_id, UploadChunk.stage == "embedded")
+        ).all()
         assert len(memory_ids) > 0
+        # resumed - the committed chunks aren't read again
+        assert gen_file_memories(job_id, 50) == job_id
+        assert sync_session.scalar(select(func.count(UploadChunk.seq)).where(UploadChunk.job_id == job_id)) == len(memory_ids)
         results = sync_session.scalars(
             select(Memory)
             .where(Memory.id.in_(memory_ids))
@@ -160,4 +283,244 @@ def test_gen_file_memories(sync_session: Session):
         texts = [result.text for result in results]
         for text in texts:
             assert text in story.replace("\n\n", " ")
-        
\ No newline at end of file
+
+        # committed a batch at a time - a failed run keeps its file and resumes after the last batch
+        path.write_bytes(bytes(story, 'utf-8'))
+        partial_id = str(uuid4())
+        sync_session.add(UploadJob(id=partial_id, filename="story.txt", path=str(path)))
+        sync_session.commit()
+        embed = tasks.voyage_embedding_batched
+        def failing_embed(batch, query=False):
+            if sync_session.scalar(select(func.count(UploadChunk.seq)).where(UploadChunk.job_id == partial_id)) >= 2:
+                raise RuntimeError("voyage down")
+            return embed(batch, query=query)
+        with mock.patch.object(tasks.settings, 'BULK_INSERT_BATCH_SIZE', 1), \
+             mock.patch.object(tasks.settings, 'EMBEDDING_BATCH_SIZE', 1), \
+             mock.patch.object(tasks.settings, 'EMBEDDING_WORKERS', 1):
+            with mock.patch('project.analysis.tasks.voyage_embedding_batched', side_effect=failing_embed):
+                with pytest.raises(RuntimeError):
+                    gen_file_memories(partial_id, 50)
+            assert path.exists()
+            assert gen_file_memories(partial_id, 50) == partial_id
+        assert not path.exists()
+        rows = sync_session.execute(
+            select(UploadChunk.seq, Memory.text)
+            .join(Memory, Memory.id == UploadChunk.memory_id)
+            .where(UploadChunk.job_id == partial_id)
+            .order_by(UploadChunk.seq)
+        ).all()
+        assert [row[0] for row in rows] == list(range(len(memory_ids)))
+        assert sorted(row[1] for row in rows) == sorted(texts)
+
+def test_expire_uploads(sync_session: Session, tmp_path):
+    kept, expired = tmp_path / "kept.txt", tmp_path / "expired.txt"
+    kept.write_bytes(b"recent")
+    expired.write_bytes(b"old")
+    kept_id, expired_id = str(uuid4()), str(uuid4())
+    sync_session.add(UploadJob(id=kept_id, filename="kept.txt", path=str(kept), status="failed"))
+    sync_session.add(UploadJob(id=expired_id, filename="expired.txt", path=str(expired), status="failed",
+                               updated_time=datetime.now(timezone.utc) - timedelta(days=30)))
+    sync_session.commit()
+
+    expire_uploads(sync_session)
+    assert kept.exists() and not expired.exists()
+    assert sync_session.get(UploadJob, kept_id).status == "failed"
+    job = sync_session.get(UploadJob, expired_id)
+    assert job.status == "expired" and job.path is None
+
+
+
+def written_samples(db_session):
+    # rows of the writing_sample upsert, in slot order
+    upsert = db_session.execute.call_args.args[0]
+    params = upsert.compile(dialect=postgresql.dialect()).params
+    rows = [{column: params[f"{column}_m{idx}"] for column in ("slot", "memory_id", "position")}
+            for idx in range(len([key for key in params if key.startswith("slot_m")]))]
+    return sorted(rows, key=lambda row: row["slot"])
+
+def test_update_writing_samples():
+    db_session = mock.MagicMock()
+    memories = [{"id": str(uuid4()), "text": "sample" + str(i), "embedding": [i] * 512} for i in range(5)]
+    with mock.patch('project.analysis.tasks.settings') as mocked_settings:
+        mocked_settings.STYLE_SAMPLE_POOL_SIZE = 8
+        # pool not full yet - every memory gets the slot of its position
+        db_session.scalars.return_value.all.return_value = [2, 3, 4, 5, 6]
+        update_writing_samples(db_session, memories)
+        samples = written_samples(db_session)
+        assert [sample["slot"] for sample in samples] == [2, 3, 4, 5, 6]
+        assert [sample["memory_id"] for sample in samples] == [memory["id"] for memory in memories]
+        upsert = str(db_session.execute.call_args.args[0].compile(dialect=postgresql.dialect()))
+        # a slot never goes back to an earlier position, whichever upload commits last
+        assert "ON CONFLICT (slot) DO UPDATE" in upsert
+        assert "WHERE writing_sample.position < excluded.position" in upsert
+
+        # pool full - only ever replaces existing slots
+        db_session.reset_mock()
+        many = [{"id": str(uuid4()), "text": "more" + str(i), "embedding": [i] * 512} for i in range(1000)]
+        db_session.scalars.return_value.all.return_value = list(range(8, 1008))
+        update_writing_samples(db_session, many)
+        slots = [sample["slot"] for sample in written_samples(db_session)]
+        assert 0 < len(slots) <= 8
+        assert all(0 <= slot < 8 for slot in slots)
+        assert len(set(slots)) == len(slots)
+
+        # nothing drawn - nothing written
+        db_session.reset_mock()
+        db_session.scalars.return_value.all.return_value = [10 ** 9]
+        with mock.patch('project.analysis.tasks.random.randint', return_value=10 ** 9):
+            update_writing_samples(db_session, memories[:1])
+        db_session.execute.assert_not_called()
+
+def test_summarize_interaction(sync_session: Session):
+    interaction_id = str(uuid4())
+    sync_session.add(Interaction(id=interaction_id))
+    start = datetime.now(timezone.utc)
+    for i in range(6):
+        exchange = {"messages": [
+            {"role": "user", "content": "question " + str(i) + " " + "word " * 50},
+            {"role": "assistant", "content": "answer " + str(i)}
+        ]}
+        sync_session.add(Exchange(id=str(uuid4()), text=json.dumps(exchange).decode('utf-8'),
+                                  interaction_id=interaction_id, created_time=start + timedelta(seconds=i)))
+    sync_session.commit()
+
+    with mock.patch('project.analysis.tasks.get_sync_sess') as mocked_session, \
+         mock.patch('project.analysis.tasks.claude_call') as mocked_claude, \
+         mock.patch('project.analysis.tasks.get_redis') as mocked_redis, \
+         mock.patch('project.analysis.tasks.settings') as mocked_settings:
+        mocked_session.return_value = sync_session
+        mocked_claude.return_value = json.dumps({"summary": "They asked six questions"})
+        mocked_settings.HISTORY_RECENT_EXCHANGES = 2
+        mocked_settings.HISTORY_SUMMARY_TOKENS = 100
+        summarize_interaction(interaction_id)
+
+        interaction = sync_session.scalars(select(Interaction).where(Interaction.id == interaction_id)).one()
+        assert interaction.summary == "They asked six questions"
+        # the last two exchanges stay verbatim
+        assert interaction.summarized_until == start + timedelta(seconds=3)
+        prompt = mocked_claude.call_args.args[0][-1]["content"]
+        assert "question 3" in prompt and "question 4" not in prompt
+        # the summarized exchanges leave the cached set
+        mocked_redis.return_value.register_script.assert_called_once_with(PRUNE_HISTORY_SCRIPT)
+        mocked_redis.return_value.register_script.return_value.assert_called_once_with(
+            keys=["history:" + interaction_id, "history:" + interaction_id + ":since"],
+            args=[(start + timedelta(seconds=3)).timestamp()])
+        # and the next run can be queued
+        mocked_redis.return_value.delete.assert_called_once_with("history:" + interaction_id + ":summarizing")
+
+        # under the threshold now - nothing more to fold in
+        mocked_claude.reset_mock()
+        summarize_interaction(interaction_id)
+        mocked_claude.assert_not_called()
+
+        # another run moved the summary on during the Claude call - its summary is kept
+        for i in range(6, 12):
+            exchange = {"messages": [
+                {"role": "user", "content": "question " + str(i) + " " + "word " * 50},
+                {"role": "assistant", "content": "answer " + str(i)}
+            ]}
+            sync_session.add(Exchange(id=str(uuid4()), text=json.dumps(exchange).decode('utf-8'),
+                                      interaction_id=interaction_id, created_time=start + timedelta(seconds=i)))
+        sync_session.commit()
+
+        def concurrent_run(prompt):
+            sync_session.execute(
+                update(Interaction)
+                .where(Interaction.id == interaction_id)
+                .values(summary="The other run", summarized_until=start + timedelta(seconds=5))
+            )
+            sync_session.commit()
+            return json.dumps({"summary": "Stale summary"})
+        mocked_claude.side_effect = concurrent_run
+        summarize_interaction(interaction_id)
+        interaction = sync_session.scalars(
+            select(Interaction)
+            .where(Interaction.id == interaction_id)
+            .execution_options(populate_existing=True)
+        ).one()
+        assert interaction.summary == "The other run"
+
+def test_cluster_memories(sync_session: Session):
+    old_memories = [str(uuid4()) for _ in range(3)]
+    new_memories = [str(uuid4()) for _ in range(2)]
+    old_beliefs = [str(uuid4()) for _ in range(3)]
+    new_beliefs = [str(uuid4()) for _ in range(1)]
+    for i, memory_id in enumerate(old_memories + new_memories):
+        sync_session.add(Memory(id=memory_id, text="memory" + str(i), embedding=[i] * 512))
+    for i, belief_id in enumerate(old_beliefs + new_beliefs):
+        sync_session.add(Belief(id=belief_id, text="belief" + str(i), type="value", embedding=[i + 0.1] * 512))
+    # already linked - the insert must not fail on it
+    sync_session.add(BeliefMemory(belief_id=old_beliefs[2], memory_id=new_memories[0]))
+    sync_session.commit()
+    job_id = upload_job(sync_session, new_memories, stage="persisted")
+    sync_session.get(UploadJob, job_id).belief_ids = new_beliefs
+    sync_session.commit()
+
+    with mock.patch('project.analysis.tasks.get_sync_sess') as mocked_session, \
+         mock.patch('project.analysis.tasks.bump_knowledge_version') as mocked_bump, \
+         mock.patch('project.analysis.tasks.settings') as mocked_settings:
+        mocked_session.return_value = sync_session
+        mocked_settings.BELIEF_MEMORY_LINKS = 1
+        assert cluster_memories(job_id) == job_id
+        mocked_bump.assert_called_once()
+
+    job = sync_session.get(UploadJob, job_id)
+    assert job.status == "done"
+    stages = sync_session.scalars(select(UploadChunk.stage).where(UploadChunk.job_id == job_id)).all()
+    assert stages == ["linked"] * 2
+
+    links = sync_session.execute(select(BeliefMemory.belief_id, BeliefMemory.memory_id)).all()
+    links = {(str(row[0]), str(row[1])) for row in links}
+    assert links == {
+        # closest belief of each new memory (embeddings 3 and 4) is the new belief (3.1),
+        # which is also the new belief's closest memory
+        (new_beliefs[0], new_memories[0]),
+        (new_beliefs[0], new_memories[1]),
+        (old_beliefs[2], new_memories[0]),
+    }
+
+def test_dedup_topics():
+    names = ["Career", "career growth", "Romance", "my job"]
+    embeddings = [[1, 0, 0], [0.99, 0.1, 0], [0, 1, 0], [0.95, 0, 0.2]]
+    with mock.patch('project.analysis.tasks.settings') as mocked_settings:
+        mocked_settings.TOPIC_MERGE_DISTANCE = 0.05
+        assert dedup_topics(names, embeddings) == {"career growth": "Career", "my job": "Career"}
+        mocked_settings.TOPIC_MERGE_DISTANCE = 0.001
+        assert dedup_topics(names, embeddings) == {}
+
+def test_consolidate_topics(sync_session: Session):
+    category_id = str(uuid4())
+    sync_session.add(Category(id=category_id, name="Career", embedding=[1] * 512))
+    topic_ids = [str(uuid4()) for _ in range(3)]
+    # "career growth" is the biggest, "my job" points the same way, "romance" doesn't
+    embeddings = [[1] * 512, [1] * 511 + [1.1], [1] * 256 + [-1] * 256]
+    names = ["my job", "career growth", "romance"]
+    for topic_id, name, embedding in zip(topic_ids, names, embeddings):
+        sync_session.add(Topic(id=topic_id, name=name, embedding=embedding, category_id=category_id))
+    belief_counts = [1, 2, 1]
+    for topic_id, count in zip(topic_ids, belief_counts):
+        for i in range(count):
+            belief_id = str(uuid4())
+            sync_session.add(Belief(id=belief_id, text="belief", type="value", embedding=[i] * 512))
+            sync_session.add(TopicBelief(topic_id=topic_id, belief_id=belief_id))
+    sync_session.commit()
+
+    with mock.patch('project.analysis.tasks.get_sync_sess') as mocked_session, \
+         mock.patch('project.analysis.tasks.bump_knowledge_version'):
+        mocked_session.return_value = sync_session
+        assert consolidate_topics() == {"merged": 1}
+
+    remaining = sync_session.execute(select(Topic.name)).scalars().all()
+    assert sorted(remaining) == ["career growth", "romance"]
+    beliefs = sync_session.scalar(select(func.count()).where(TopicBelief.topic_id == topic_ids[1]))
+    assert beliefs == 3
+
+def test_consolidate_topics_failure():
+    # a failed run is retried and reported as failed, not as a successful None
+    db_session = mock.MagicMock()
+    db_session.execute.side_effect = RuntimeError("connection lost")
+    with mock.patch('project.analysis.tasks.get_sync_sess') as mocked_session:
+        mocked_session.return_value.__enter__.return_value = db_session
+        with pytest.raises(RuntimeError):
+            consolidate_topics()
+    db_session.rollback.assert_called_once()
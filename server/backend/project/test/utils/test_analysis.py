@@ -1,6 +1,8 @@
 import orjson as json
-from project.analysis.utils import format_exchange, truncate, extract_text_from_file, chunk_exchange, chunk_file
+from project.analysis.utils import format_exchange, truncate, extract_text_from_file, chunk_exchange, chunk_file, chunk_paragraphs, iter_file_chunks, analysis_key
 from docx import Document
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
 from odf.opendocument import OpenDocumentText
 from odf.text import P
 import io
@@ -232,4 +234,54 @@ def test_chunk_file():
     end1_pos = full_text.find("UNIQUE_END_1")
     start2_pos = full_text.find("UNIQUE_START_2")
     assert start1_pos < end1_pos, "First paragraph markers out of order"
-    assert end1_pos < start2_pos, "First and second paragraphs out of order"
\ No newline at end of file
+    assert end1_pos < start2_pos, "First and second paragraphs out of order"
+
+
+def test_chunk_paragraphs():
+    # long paragraphs are split into limit-sized chunks of their own, short ones packed
+    paragraphs = ["one two", "three", " ".join(str(i) for i in range(7)), "", "four five"]
+    assert list(chunk_paragraphs(paragraphs, limit=3)) == ["one two three", "0 1 2", "3 4 5", "6", "four five"]
+
+def test_iter_file_chunks(tmp_path):
+    path = tmp_path / "journal.txt"
+    with open(path, "w") as journal:
+        for day in range(2000):
+            journal.write(f"Day {day}\nwent for a run\n\n")
+    chunks = list(iter_file_chunks(str(path), "journal.txt", limit=60))
+    assert chunks == chunk_file(path.read_bytes(), "journal.txt", limit=60)
+    assert chunks[0].startswith("Day 0\nwent for a run Day 1")
+    assert all(len(chunk.split()) <= 60 for chunk in chunks)
+
+    doc = Document()
+    doc.add_paragraph("Before the table")
+    doc.add_table(rows=1, cols=1).cell(0, 0).text = "Inside the table"
+    doc.add_paragraph("After\tthe table")
+    doc.save(tmp_path / "journal.docx")
+    # same paragraphs python-docx reads
+    assert list(iter_file_chunks(str(tmp_path / "journal.docx"), "journal.docx")) == ["Before the table After\tthe table"]
+
+    # hyperlink text stays where it is in the sentence
+    doc = Document()
+    paragraph = doc.add_paragraph("Read ")
+    hyperlink = OxmlElement("w:hyperlink")
+    hyperlink.set(qn("r:id"), "rId9")
+    link_run = OxmlElement("w:r")
+    link_text = OxmlElement("w:t")
+    link_text.text = "the article"
+    link_run.append(link_text)
+    hyperlink.append(link_run)
+    paragraph._p.append(hyperlink)
+    paragraph.add_run(" before Friday.")
+    doc.save(tmp_path / "links.docx")
+    assert list(iter_file_chunks(str(tmp_path / "links.docx"), "links.docx")) == ["Read the article before Friday."]
+
+
+def test_analysis_key():
+    prompt = [{"role": "user", "content": "guidelines"}, {"role": "user", "content": "passage"}]
+    key = analysis_key(prompt, "model-a")
+    assert len(key) == 64
+    assert analysis_key([dict(message) for message in prompt], "model-a") == key
+    # a new model, template or passage is a new analysis
+    assert analysis_key(prompt, "model-b") != key
+    assert analysis_key([{"role": "user", "content": "new guidelines"}, prompt[1]], "model-a") != key
+    assert analysis_key([prompt[0], {"role": "user", "content": "other passage"}], "model-a") != key
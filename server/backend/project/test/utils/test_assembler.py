@@ -0,0 +1,62 @@
+from project.prompt.assembler import allocate, assemble_belief_prompt, assemble_style_prompt, prompt_tokens
+import orjson as json
+
+# pytest project/test/utils/test_assembler.py -v -s
+def test_allocate():
+    shares = {"a": 0.5, "b": 0.5}
+    assert allocate(100, {"a": 30, "b": 30}, shares) == {"a": 30, "b": 30}
+    # what "a" doesn't need goes to "b"
+    assert allocate(100, {"a": 10, "b": 200}, shares) == {"a": 10, "b": 90}
+    # both over - each keeps its share
+    assert allocate(100, {"a": 200, "b": 200}, shares) == {"a": 50, "b": 50}
+    # leftover goes out in priority order
+    assert allocate(100, {"a": 200, "b": 200}, {"a": 0.2, "b": 0.2}) == {"a": 80, "b": 20}
+    assert allocate(-5, {"a": 10}, shares) == {"a": 0}
+
+def knowledge():
+    return {
+        "Martial Arts": {"beliefs": [
+            {"belief": "Consistency is key", "memories": ["word " * 500], "summaries": ["I train daily"]},
+            {"belief": "Pain builds strength", "memories": ["word " * 500], "summaries": [None]},
+        ]},
+        "Romance": {"beliefs": [
+            {"belief": "Communication is critical", "memories": ["word " * 500], "summaries": ["We talked"]},
+        ]},
+    }
+
+def test_assemble_belief_prompt():
+    history = []
+    for i in range(20):
+        history += [{"role": "user", "content": "question " * 40}, {"role": "assistant", "content": "answer " * 40}]
+    history.append({"role": "user", "content": "latest message"})
+
+    # plenty of room - nothing is cut
+    prompt, usage = assemble_belief_prompt(knowledge(), history[-3:], "summary", budget=100000)
+    assert prompt[-3:] == history[-3:]
+    assert "word " * 499 in prompt[0]["content"]
+
+    prompt, usage = assemble_belief_prompt(knowledge(), history, "summary " * 400, budget=1500)
+    assert usage["total"] <= 1500
+    assert prompt[-1] == {"role": "user", "content": "latest message"}
+    # history is cut from the oldest end and still starts on a user turn
+    assert prompt[4]["role"] == "user"
+    assert len(prompt) < len(history) + 4
+    schema = json.loads(prompt[0]["content"].split("Schema:\n")[1])
+    beliefs = [belief["belief"] for topic in schema["topics"].values() for belief in topic["beliefs"]]
+    assert beliefs == ["Consistency is key", "Pain builds strength", "Communication is critical"]
+    memory = schema["topics"]["Martial Arts"]["beliefs"][0]["memories"][0]
+    assert 0 < len(memory) < len("word " * 500)
+
+    # no room for knowledge at all - the new message still goes out
+    prompt, usage = assemble_belief_prompt(knowledge(), history, None, budget=0)
+    assert prompt[-1]["content"] == "latest message"
+    assert usage["beliefs"] == 0 and usage["memories"] == 0
+
+def test_assemble_style_prompt():
+    samples = ["first " * 100, "second " * 1000]
+    prompt, tokens = assemble_style_prompt("rewrite me", samples, budget=600)
+    outline = json.loads(prompt[-1]["content"])
+    assert outline["message"] == "rewrite me"
+    assert outline["writing_samples"][0] == samples[0]
+    assert 0 < len(outline["writing_samples"][1]) < len(samples[1])
+    assert tokens == prompt_tokens(prompt) <= 600
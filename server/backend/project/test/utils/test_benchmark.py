@@ -0,0 +1,41 @@
+from benchmark.data import topic_centers, clustered, draw_queries, unit
+from benchmark.retrieval import percentiles, recall_at_k, knowledge_beliefs
+from benchmark.__main__ import parse_args
+import numpy as np
+import pytest
+
+## run in docker container with command: pytest project/test/utils/test_benchmark.py -v -s
+def test_percentiles():
+    summary = percentiles([float(ms) for ms in range(1, 101)])
+    assert summary == {"runs": 100, "p50_ms": 50.5, "p95_ms": 95.05, "p99_ms": 99.01}
+    assert percentiles([])["p50_ms"] is None
+
+def test_recall_at_k():
+    assert recall_at_k(["a", "b", "c"], ["a", "b", "d", "e"]) == 0.5
+    assert recall_at_k(["b", "a"], ["a", "b"]) == 1.0
+    assert recall_at_k([], []) == 1.0
+    knowledge = {"Cooking": {"beliefs": [{"belief": "Salt early"}, {"belief": "Taste often"}]}}
+    assert knowledge_beliefs(knowledge) == ["Salt early", "Taste often"]
+
+def test_synthetic_embeddings():
+    centers = topic_centers(0, 5)
+    assert np.array_equal(centers, topic_centers(0, 5))
+    assert np.allclose(np.linalg.norm(centers, axis=1), 1.0)
+
+    rng = np.random.default_rng(1)
+    assignment = np.array([0, 0, 3])
+    vectors = clustered(rng, centers, assignment, 0.03)
+    assert vectors.shape == (3, 512)
+    assert np.allclose(np.linalg.norm(vectors, axis=1), 1.0, atol=1e-5)
+    # each vector is closest to its own topic
+    assert list(np.argmax(vectors @ centers.T, axis=1)) == [0, 0, 3]
+
+    queries = draw_queries(rng, centers, 4)
+    assert len(queries) == 4 and len(queries[0]) == 512
+    assert np.allclose(unit(np.array(queries)), queries, atol=1e-5)
+
+def test_parse_args_needs_database():
+    # the run drops every table - there is no default database to wipe by accident
+    with pytest.raises(SystemExit):
+        parse_args([])
+    assert parse_args(["--database-url", "postgresql://scratch/bench"]).database_url == "postgresql://scratch/bench"
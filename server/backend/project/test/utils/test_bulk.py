@@ -0,0 +1,62 @@
+from project.utils.bulk import bulk_insert, copy_rows, column_encoder, encode_vector, encode_uuid, \
+    encode_timestamptz, CopyStream, COPY_HEADER, COPY_TRAILER
+from project.interact.models import Memory
+from project.knowledge.models import Belief, BeliefMemory
+from sqlalchemy.orm import Session
+from sqlalchemy import select
+from datetime import datetime, timezone
+from unittest import mock
+from uuid import uuid4, UUID
+import struct
+
+# pytest project/test/utils/test_bulk.py -v -s
+def test_encoders():
+    assert encode_vector([1.0, -2.0]) == struct.pack(">hhff", 2, 0, 1.0, -2.0)
+    assert encode_uuid("12345678-1234-5678-1234-567812345678") == UUID("12345678-1234-5678-1234-567812345678").bytes
+    assert encode_timestamptz(datetime(2000, 1, 1, 0, 0, 1, tzinfo=timezone.utc)) == struct.pack(">q", 1000000)
+    assert column_encoder(Memory.__table__.c.embedding.type) is encode_vector
+    assert column_encoder(Memory.__table__.c.id.type) is encode_uuid
+
+def test_copy_rows():
+    rows = [{"id": "12345678-1234-5678-1234-567812345678", "text": "hi", "impact": None}]
+    columns = ["id", "text", "impact"]
+    encoders = [column_encoder(Memory.__table__.c[column].type) for column in columns]
+    payload = CopyStream(copy_rows(rows, columns, encoders))
+    # read in small pieces, the way copy_expert pulls it
+    data = b""
+    while chunk := payload.read(7):
+        data += chunk
+    assert data == COPY_HEADER + struct.pack(">h", 3) \
+        + struct.pack(">i", 16) + UUID(rows[0]["id"]).bytes \
+        + struct.pack(">i", 2) + b"hi" \
+        + struct.pack(">i", -1) + COPY_TRAILER
+
+def test_bulk_insert_fallback():
+    db_session = mock.MagicMock()
+    db_session.get_bind.return_value.dialect.name = "sqlite"
+    rows = [{"id": str(uuid4()), "text": str(i)} for i in range(5)]
+    with mock.patch('project.utils.bulk.settings') as mocked_settings:
+        mocked_settings.BULK_INSERT_BATCH_SIZE = 2
+        bulk_insert(db_session, Memory, rows)
+    assert [len(call.args[1]) for call in db_session.execute.call_args_list] == [2, 2, 1]
+    bulk_insert(db_session, Memory, [])
+    assert db_session.execute.call_count == 3
+
+def test_bulk_insert_copy(sync_session: Session):
+    memories = [{"id": str(uuid4()), "text": "memory" + str(i), "embedding": [i / 10] * 512, "impact": 0.0}
+                for i in range(50)]
+    bulk_insert(sync_session, Memory, memories)
+    belief_id = str(uuid4())
+    bulk_insert(sync_session, Belief, [{"id": belief_id, "text": "belief", "type": "value", "embedding": [1] * 512}])
+    links = [{"belief_id": belief_id, "memory_id": memory["id"]} for memory in memories[:3]]
+    bulk_insert(sync_session, BeliefMemory, links)
+    # duplicates are skipped instead of failing the COPY
+    bulk_insert(sync_session, BeliefMemory, links + [{"belief_id": belief_id, "memory_id": memories[3]["id"]}],
+                on_conflict_do_nothing=True)
+    sync_session.commit()
+
+    stored = sync_session.scalars(select(Memory).where(Memory.id == memories[7]["id"])).one()
+    assert stored.text == "memory7"
+    assert stored.embedding[0] == float(struct.unpack(">f", struct.pack(">f", 0.7))[0])
+    assert stored.version_id == 1 and stored.created_time is not None
+    assert len(sync_session.scalars(select(BeliefMemory).where(BeliefMemory.belief_id == belief_id)).all()) == 4
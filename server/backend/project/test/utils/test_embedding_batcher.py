@@ -0,0 +1,88 @@
+from project.embedding.batcher import EmbeddingBatcher, split_batches
+import asyncio
+import pytest
+
+## run in docker container with command: pytest project/test/utils/test_embedding_batcher.py -v -s
+class FakeEmbed:
+    def __init__(self):
+        self.calls = []
+
+    async def __call__(self, texts, input_type):
+        self.calls.append((list(texts), input_type))
+        await asyncio.sleep(0)
+        return [[float(len(text))] for text in texts]
+
+
+@pytest.mark.asyncio
+async def test_batcher_coalesces_concurrent_requests():
+    embed = FakeEmbed()
+    batcher = EmbeddingBatcher(embed, window_ms=5, max_batch=128, max_tokens=10000)
+    texts = ["a" * i for i in range(1, 11)]
+    results = await asyncio.gather(*[batcher.embed([text], "document") for text in texts])
+    assert len(embed.calls) == 1
+    # every caller gets back the embedding for its own text
+    assert [result[0][0] for result in results] == [float(len(text)) for text in texts]
+
+    # input types never share a call
+    await asyncio.gather(batcher.embed(["x"], "query"), batcher.embed(["y"], "document"))
+    assert sorted(call[1] for call in embed.calls[1:]) == ["document", "query"]
+
+
+@pytest.mark.asyncio
+async def test_batcher_limits():
+    embed = FakeEmbed()
+    batcher = EmbeddingBatcher(embed, window_ms=1000, max_batch=4, max_tokens=10000)
+    results = await batcher.embed(["text"] * 10, "document")
+    assert len(results) == 10
+    assert [len(call[0]) for call in embed.calls] == [4, 4, 2]
+
+    embed.calls.clear()
+    batcher = EmbeddingBatcher(embed, window_ms=5, max_batch=128, max_tokens=10)
+    # each text is ~5 tokens, so only 2 fit per call
+    await batcher.embed(["x" * 20] * 5, "document")
+    assert [len(call[0]) for call in embed.calls] == [2, 2, 1]
+
+
+@pytest.mark.asyncio
+async def test_batcher_errors():
+    async def failing(texts, input_type):
+        raise RuntimeError("voyage down")
+
+    batcher = EmbeddingBatcher(failing, window_ms=1, max_batch=8, max_tokens=1000)
+    with pytest.raises(RuntimeError):
+        await batcher.embed(["a", "b"], "document")
+
+
+@pytest.mark.asyncio
+async def test_batcher_isolates_failing_caller():
+    class RejectingEmbed(FakeEmbed):
+        async def __call__(self, texts, input_type):
+            self.calls.append((list(texts), input_type))
+            if "bad" in texts:
+                raise ValueError("invalid input")
+            return [[float(len(text))] for text in texts]
+
+    embed = RejectingEmbed()
+    batcher = EmbeddingBatcher(embed, window_ms=5, max_batch=128, max_tokens=10000)
+    results = await asyncio.gather(batcher.embed(["a"], "document"),
+                                   batcher.embed(["bad", "bb"], "document"),
+                                   batcher.embed(["ccc"], "document"),
+                                   return_exceptions=True)
+    assert results[0] == [[1.0]]
+    assert isinstance(results[1], ValueError)
+    assert results[2] == [[3.0]]
+    # the shared call, then one per caller
+    assert len(embed.calls) == 4
+    assert embed.calls[0][0] == ["a", "bad", "bb", "ccc"]
+
+
+def test_split_batches():
+    texts = ["text " + str(i) for i in range(10)]
+    batches = split_batches(texts, max_items=4, max_tokens=1000)
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+    assert [text for batch in batches for text in batch] == texts
+
+    texts = ["x" * 40, "x" * 40, "x" * 400, "x" * 4]
+    batches = split_batches(texts, max_items=100, max_tokens=25)
+    assert batches == [["x" * 40, "x" * 40], ["x" * 400], ["x" * 4]]
+    assert split_batches([], 4, 100) == []
@@ -0,0 +1,44 @@
+from project.embedding.cache import EmbeddingCache, embedding_key, encode_embedding
+from unittest import mock
+import numpy as np
+import redis
+
+## run in docker container with command: pytest project/test/utils/test_embedding_cache.py -v -s
+def test_embedding_key():
+    key = embedding_key("voyage-3-lite", "document", "hello")
+    assert key == embedding_key("voyage-3-lite", "document", "hello")
+    assert key != embedding_key("voyage-3-lite", "query", "hello")
+    assert key != embedding_key("voyage-3", "document", "hello")
+    assert key.startswith("embedding:")
+
+def test_embedding_cache_tiers():
+    remote = mock.MagicMock()
+    remote.mget.side_effect = lambda keys: [encode_embedding([9.0] * 4) if key == "c" else None for key in keys]
+    with mock.patch('project.embedding.cache.get_redis', return_value=remote):
+        cache = EmbeddingCache(capacity=2, ttl=60)
+        cache.set_many({"a": [1.0] * 4, "b": [2.0] * 4})
+        assert remote.pipeline.return_value.set.call_count == 2
+
+        found = cache.get_many(["a", "b", "c", "d"])
+        assert np.allclose(found["a"], [1.0] * 4)
+        assert np.allclose(found["b"], [2.0] * 4)
+        assert np.allclose(found["c"], [9.0] * 4)
+        assert "d" not in found
+        # only the local misses go to redis
+        remote.mget.assert_called_once_with(["c", "d"])
+        assert cache.stats() == {"local_hits": 2, "redis_hits": 1, "misses": 1}
+
+        # "c" was promoted into the LRU, which evicted "a"
+        remote.mget.reset_mock()
+        cache.get_many(["a"])
+        remote.mget.assert_called_once_with(["a"])
+
+def test_embedding_cache_redis_down():
+    remote = mock.MagicMock()
+    remote.mget.side_effect = redis.ConnectionError("down")
+    remote.pipeline.return_value.execute.side_effect = redis.ConnectionError("down")
+    with mock.patch('project.embedding.cache.get_redis', return_value=remote):
+        cache = EmbeddingCache(capacity=8, ttl=60)
+        assert cache.get_many(["a"]) == {}
+        cache.set_many({"a": [1.0] * 4})
+        assert np.allclose(cache.get_many(["a"])["a"], [1.0] * 4)
@@ -0,0 +1,60 @@
+from project.embedding.fake import FakeClient, FakeAsyncClient, fake_embedding
+from project.prompt.fake import FakeClaude, fake_response
+from project.prompt.claude import claude_belief_analysis, claude_summarize_history, claude_style_prompt
+from project.analysis.schemas import get_belief_analysis_schema
+from project.analysis.tasks import knowledge_from_analysis
+from langchain_core.messages import HumanMessage
+import orjson as json
+import numpy as np
+import asyncio
+
+## run in docker container with command: pytest project/test/utils/test_fake_providers.py -v -s
+def test_fake_embedding():
+    embedding = fake_embedding("hello")
+    assert len(embedding) == 512
+    assert all(isinstance(x, float) for x in embedding)
+    assert np.isclose(np.linalg.norm(embedding), 1.0)
+    assert embedding == fake_embedding("hello")
+    assert embedding != fake_embedding("hello there")
+
+    result = FakeClient().embed(["a", "b"], model="voyage-3-lite", input_type="query")
+    assert result.embeddings == [fake_embedding("a"), fake_embedding("b")]
+    result = asyncio.run(FakeAsyncClient().embed(["a"], model="voyage-3-lite", input_type="document"))
+    assert result.embeddings == [fake_embedding("a")]
+
+def test_fake_embedding_latency():
+    assert FakeClient()._latency() == 0
+    client = FakeAsyncClient(latency_ms=50, latency_sigma=0.5)
+    delays = [client._latency() for _ in range(200)]
+    # log-normal around the median, not a fixed delay
+    assert all(delay > 0 for delay in delays)
+    assert len(set(delays)) > 1
+    assert 0.03 < float(np.median(delays)) < 0.08
+    assert FakeClient(latency_ms=50, latency_sigma=0)._latency() == 0.05
+
+def test_fake_claude_templates():
+    llm = FakeClaude(latency_ms=0)
+    passage = "I spent the whole weekend climbing with my brother and we argued about money."
+    analysis = llm.invoke(claude_belief_analysis(get_belief_analysis_schema(), passage)).content
+    assert analysis == llm.invoke(claude_belief_analysis(get_belief_analysis_schema(), passage)).content
+    knowledge = knowledge_from_analysis(json.loads(analysis))
+    assert len(knowledge) == 2
+    for item in knowledge.values():
+        assert {belief["type"] for belief in item["beliefs"]} <= {"value", "opinion", "emotion"}
+
+    summary = llm.invoke(claude_summarize_history(None, "[user]: I love hiking\n")).content
+    assert "hiking" in json.loads(summary)["summary"]
+
+    styled = llm.invoke(claude_style_prompt({"message": "Hiking clears my head", "samples": []})).content
+    assert isinstance(styled, str) and styled
+
+def test_fake_claude_stream():
+    llm = FakeClaude(latency_ms=0)
+    messages = [HumanMessage(content="Tell me about your weekend")]
+
+    async def stream():
+        return [chunk.content async for chunk in llm.astream(messages)]
+
+    chunks = asyncio.run(stream())
+    assert len(chunks) > 1
+    assert "".join(chunks) == fake_response(messages)
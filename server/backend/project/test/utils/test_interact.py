@@ -1,4 +1,12 @@
-from project.interact.utils import extract_context, load_history, validate_file_extension, raw, record_exchange
+from project.interact.utils import extract_context, load_history, validate_file_extension, raw, record_exchange, format_sse, load_recent_history, history_tokens, history_entry, save_upload, UploadSizeLimit, UPLOAD_FORM_OVERHEAD, claim_summary
+from project.config import settings
+from datetime import datetime, timezone, timedelta
+from fastapi import HTTPException, UploadFile
+import io
+from unittest import mock
+import orjson as json
+import pytest
+import redis
 
 # pytest project/test/utils/test_interact.py -v -s
 def test_raw():
@@ -63,3 +71,120 @@ def test_validate_file_extension():
     assert validate_file_extension("document.odt") is True
     assert validate_file_extension("document.docx") is True
     assert validate_file_extension("document.pdf") is False
+
+def test_format_sse():
+    assert format_sse("token", {"token": "Hi"}) == 'event: token\ndata: {"token":"Hi"}\n\n'
+    assert format_sse("done", {"response": "a\nb"}) == 'event: done\ndata: {"response":"a\\nb"}\n\n'
+
+@pytest.mark.asyncio
+async def test_load_recent_history():
+    messages = [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello"}]
+    later = [{"role": "user", "content": "How are you?"}, {"role": "assistant", "content": "Fine"}]
+    entries = [history_entry("e1", messages), history_entry("e2", later)]
+    remote = mock.MagicMock()
+    pipe = remote.pipeline.return_value
+    session = mock.AsyncMock()
+
+    # cache hit - no database round trip, and only the exchanges `limit` needs
+    pipe.execute = mock.AsyncMock(return_value=[b"0.0", entries])
+    with mock.patch('project.interact.utils.get_async_redis', return_value=remote):
+        assert await load_recent_history("id", session) == messages + later
+        session.execute.assert_not_called()
+        pipe.zrangebyscore.assert_called_with("history:id", "(0.0", "+inf")
+        # newest first when limited
+        pipe.execute = mock.AsyncMock(return_value=[b"0.0", entries[1:]])
+        assert await load_recent_history("id", session, limit=1) == later[1:]
+        pipe.zrevrangebyscore.assert_called_with("history:id", "+inf", "(0.0", start=0, num=1)
+        pipe.execute = mock.AsyncMock(return_value=[b"0.0", entries[::-1]])
+        assert await load_recent_history("id", session, limit=3) == messages[1:] + later
+        pipe.zrevrangebyscore.assert_called_with("history:id", "+inf", "(0.0", start=0, num=2)
+
+    # complete only from later than `since` - the summary moved back, or a rebuild hasn't
+    # marked the set yet: rebuilt from the exchange table and merged into the set
+    start = datetime.now(timezone.utc)
+    since = start - timedelta(seconds=1)
+    session.execute.return_value.all = mock.Mock(return_value=[
+        ("e1", json.dumps({"messages": messages}), start),
+        ("e2", json.dumps({"messages": later}), start + timedelta(seconds=1)),
+    ])
+    for cached_since in (str(start.timestamp()).encode(), None):
+        pipe.execute = mock.AsyncMock(side_effect=[[cached_since, entries[1:]], None])
+        with mock.patch('project.interact.utils.get_async_redis', return_value=remote):
+            assert await load_recent_history("id", session, limit=1, since=since) == later[1:]
+        pipe.zadd.assert_called_with("history:id", {entries[0]: start.timestamp(),
+                                                    entries[1]: start.timestamp() + 1})
+        pipe.set.assert_called_with("history:id:since", since.timestamp(), ex=settings.HISTORY_CACHE_TTL)
+
+@pytest.mark.asyncio
+async def test_record_exchange():
+    remote = mock.MagicMock()
+    pipe = remote.pipeline.return_value
+    pipe.execute = mock.AsyncMock()
+    session = mock.MagicMock()
+    session.commit = mock.AsyncMock()
+    with mock.patch('project.interact.utils.get_async_redis', return_value=remote):
+        await record_exchange("Hi", "Hello", "id", session)
+    saved = session.add.call_args.args[0]
+    # same member a rebuild from this row writes, so the two can't duplicate it
+    member = history_entry(saved.id, json.loads(saved.text)["messages"])
+    pipe.zadd.assert_called_once_with("history:id", {member: saved.created_time.timestamp()})
+
+@pytest.mark.asyncio
+async def test_claim_summary():
+    remote = mock.MagicMock()
+    with mock.patch('project.interact.utils.get_async_redis', return_value=remote):
+        remote.set = mock.AsyncMock(return_value=True)
+        assert await claim_summary("id")
+        remote.set.assert_awaited_once_with("history:id:summarizing", 1, nx=True,
+                                            ex=settings.HISTORY_SUMMARY_LOCK_TTL)
+        # a run is already queued
+        remote.set = mock.AsyncMock(return_value=None)
+        assert not await claim_summary("id")
+        # no redis - queue it anyway
+        remote.set = mock.AsyncMock(side_effect=redis.ConnectionError("down"))
+        assert await claim_summary("id")
+
+def test_history_tokens():
+    assert history_tokens([]) == 0
+    history = [{"role": "user", "content": "a" * 93}, {"role": "assistant", "content": "b" * 88}]
+    # "user: " + 93 + "\n" and "assistant: " + 88 + "\n" - 200 characters
+    assert history_tokens(history) == 50
+
+@pytest.mark.asyncio
+async def test_save_upload(tmp_path):
+    with mock.patch('project.interact.utils.settings') as mocked_settings:
+        mocked_settings.UPLOAD_DIR = str(tmp_path)
+        mocked_settings.UPLOAD_CHUNK_SIZE = 4
+        mocked_settings.UPLOAD_MAX_BYTES = 10
+        path = await save_upload(UploadFile(io.BytesIO(b"hello there"[:10]), filename="Notes.TXT"))
+        assert path.startswith(str(tmp_path)) and path.endswith(".txt")
+        assert open(path, "rb").read() == b"hello ther"
+
+        with pytest.raises(HTTPException) as exc:
+            await save_upload(UploadFile(io.BytesIO(b"hello there"), filename="notes.txt"))
+        assert exc.value.status_code == 413
+        # the partial file is cleaned up
+        assert [str(file) for file in tmp_path.iterdir()] == [path]
+
+        # the open() error is reported, not the failed clean-up
+        mocked_settings.UPLOAD_DIR = str(tmp_path / "missing")
+        with pytest.raises(FileNotFoundError) as exc:
+            await save_upload(UploadFile(io.BytesIO(b"hello"), filename="notes.txt"))
+        assert exc.value.__context__ is None
+
+@pytest.mark.asyncio
+async def test_upload_size_limit():
+    app = mock.AsyncMock()
+    send = mock.AsyncMock()
+    middleware = UploadSizeLimit(app)
+    with mock.patch('project.interact.utils.settings') as mocked_settings:
+        mocked_settings.UPLOAD_MAX_BYTES = 10
+        # rejected from the header, before the body is read
+        too_large = str(10 + UPLOAD_FORM_OVERHEAD + 1).encode()
+        await middleware({"type": "http", "headers": [(b"content-length", too_large)]}, mock.AsyncMock(), send)
+        app.assert_not_called()
+        assert send.call_args_list[0].args[0]["status"] == 413
+
+        await middleware({"type": "http", "headers": [(b"content-length", b"10")]}, mock.AsyncMock(), send)
+        await middleware({"type": "http", "headers": []}, mock.AsyncMock(), send)
+        assert app.await_count == 2
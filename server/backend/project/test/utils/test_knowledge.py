@@ -1,7 +1,8 @@
 from sqlalchemy.ext.asyncio import AsyncSession
-from project.knowledge.utils import get_topics, extract_knowledge, format_knowledge
+from project.knowledge.utils import get_topics, extract_knowledge, retrieve_knowledge, format_knowledge, knowledge_query
 from project.knowledge.models import Topic, TopicBelief, Belief, Category, BeliefMemory
 from project.interact.models import Memory
+from sqlalchemy.dialects import postgresql
 from uuid import uuid4
 import pytest
 
@@ -284,6 +285,55 @@ async def test_extract_knowledge(async_session: AsyncSession):
     assert knowledge["Romance"]["beliefs"][3]["memories"][2] == "Memory3: " + belief
 
 
+@pytest.mark.asyncio
+async def test_retrieve_knowledge(async_session: AsyncSession):
+    category_id = str(uuid4())
+    async_session.add(Category(id=category_id, name="Hobby", embedding=[0] * 512))
+    types = ["emotion", "emotion", "emotion", "value", "value", "opinion", "opinion"]
+    for t in range(3):
+        topic_id = str(uuid4())
+        async_session.add(Topic(id=topic_id, name="Topic" + str(t), embedding=[t * 2] * 512,
+                                category_id=category_id))
+        for idx, type in enumerate(types):
+            belief_id = str(uuid4())
+            async_session.add(Belief(id=belief_id, text=f"Belief {t}-{idx}", type=type,
+                                     embedding=[t * 2 + idx * 0.1] * 512))
+            async_session.add(TopicBelief(topic_id=topic_id, belief_id=belief_id))
+            # the last belief of every topic has no memories
+            if idx == len(types) - 1:
+                continue
+            for i in range(2):
+                memory_id = str(uuid4())
+                async_session.add(Memory(id=memory_id, text=f"Memory{i}: {t}-{idx}",
+                                         summary="Summary" + str(i), embedding=[1 - i] * 512))
+                async_session.add(BeliefMemory(memory_id=memory_id, belief_id=belief_id))
+    await async_session.commit()
+
+    knowledge = await retrieve_knowledge([1] * 512, async_session)
+    topic_ids = await get_topics([1] * 512, async_session)
+    assert knowledge == await extract_knowledge([1] * 512, topic_ids, async_session)
+
+    # 2 closest topics, quotas of 2 per type and 4 per topic applied in the query
+    assert set(knowledge) == {"Topic0", "Topic1"}
+    assert [belief["belief"] for belief in knowledge["Topic0"]["beliefs"]] == \
+        ["Belief 0-6", "Belief 0-5", "Belief 0-4", "Belief 0-3"]
+    assert [belief["belief"] for belief in knowledge["Topic1"]["beliefs"]] == \
+        ["Belief 1-0", "Belief 1-1", "Belief 1-3", "Belief 1-4"]
+    assert knowledge["Topic0"]["beliefs"][0]["memories"] == []
+    assert knowledge["Topic1"]["beliefs"][0]["memories"] == ["Memory0: 1-0"]
+    assert knowledge["Topic1"]["beliefs"][0]["summaries"] == ["Summary0"]
+
+
+def test_knowledge_query_exact_laterals():
+    # only the unfiltered topic lookup may use the HNSW index (<->), the LATERALs rank rows
+    # filtered by a join with the l2_distance() function
+    sql = str(knowledge_query([0.1] * 512).compile(dialect=postgresql.dialect()))
+    assert sql.count("<->") == 1
+    assert "ORDER BY topic.embedding <->" in sql
+    assert "ORDER BY l2_distance(belief.embedding" in sql
+    assert "ORDER BY l2_distance(memory.embedding" in sql
+
+
 def test_format_knowledge():
     # Test with all types of knowledge present
     full_knowledge = {
@@ -0,0 +1,53 @@
+from project.knowledge.cache import get_cached_knowledge, cache_knowledge, cosine_distance
+from unittest import mock
+import orjson as json
+import pytest
+import redis
+
+## run in docker container with command: pytest project/test/utils/test_knowledge_cache.py -v -s
+def test_cosine_distance():
+    assert cosine_distance([1, 0], [1, 0]) == pytest.approx(0)
+    assert cosine_distance([1, 0], [0, 1]) == pytest.approx(1)
+    assert cosine_distance([1, 0], [2, 0]) == pytest.approx(0)
+    assert cosine_distance([0, 0], [1, 0]) == 1.0
+    assert cosine_distance([1, None], [1, 0]) == 1.0
+    assert cosine_distance([1, 0, 0], [1, 0]) == 1.0
+
+@pytest.mark.asyncio
+async def test_get_cached_knowledge():
+    knowledge = {"Martial Arts": {"beliefs": [{"belief": "Consistency is key", "memories": [], "summaries": []}]}}
+    cached = json.dumps({"version": 3, "embedding": [1.0, 0.0], "knowledge": knowledge})
+    remote = mock.MagicMock()
+    pipe = remote.pipeline.return_value
+    with mock.patch('project.knowledge.cache.get_async_redis', return_value=remote), \
+         mock.patch('project.knowledge.cache.settings') as mocked_settings:
+        mocked_settings.RETRIEVAL_CACHE_DISTANCE = 0.05
+        pipe.execute = mock.AsyncMock(return_value=[b"3", cached])
+        # same subject
+        assert await get_cached_knowledge("id", [1.0, 0.1]) == (knowledge, 3)
+        # conversation moved on
+        assert await get_cached_knowledge("id", [1.0, 1.0]) == (None, 3)
+        # knowledge changed since
+        pipe.execute = mock.AsyncMock(return_value=[b"4", cached])
+        assert await get_cached_knowledge("id", [1.0, 0.0]) == (None, 4)
+        # nothing cached for the interaction yet
+        pipe.execute = mock.AsyncMock(return_value=[None, None])
+        assert await get_cached_knowledge("id", [1.0, 0.0]) == (None, 0)
+
+        # malformed entries are misses
+        for entry in (b"not json", json.dumps({"version": 4}),
+                      json.dumps({"version": 4, "embedding": None, "knowledge": knowledge}),
+                      json.dumps({"version": 4, "embedding": [None, 1.0], "knowledge": knowledge})):
+            pipe.execute = mock.AsyncMock(return_value=[b"4", entry])
+            assert await get_cached_knowledge("id", [1.0, 0.0]) == (None, 4)
+
+        pipe.execute = mock.AsyncMock(side_effect=redis.ConnectionError("down"))
+        assert await get_cached_knowledge("id", [1.0, 0.0]) == (None, None)
+        remote.set = mock.AsyncMock()
+        await cache_knowledge("id", [1.0, 0.0], knowledge, None)
+        remote.set.assert_not_called()
+        await cache_knowledge("id", [1.0, 0.0], knowledge, 4)
+        assert json.loads(remote.set.call_args.args[1])["version"] == 4
+
+        mocked_settings.RETRIEVAL_CACHE_DISTANCE = 0
+        assert await get_cached_knowledge("id", [1.0, 0.0]) == (None, None)
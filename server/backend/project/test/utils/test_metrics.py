@@ -0,0 +1,44 @@
+from project.metrics import REGISTRY, STAGE_SECONDS, TimedAsyncPool, timed, metrics
+from unittest import mock
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+import asyncio
+import pytest
+
+## run in docker container with command: pytest project/test/utils/test_metrics.py -v -s
+def stage_count(stage: str):
+    return REGISTRY.get_sample_value("mirror_stage_seconds_count", {"stage": stage}) or 0
+
+def test_timed():
+    before = stage_count("test_stage")
+    with timed("test_stage"):
+        pass
+    # observed even when the stage fails
+    with pytest.raises(ValueError):
+        with timed("test_stage"):
+            raise ValueError("failed")
+    assert stage_count("test_stage") == before + 2
+    assert STAGE_SECONDS.labels("test_stage")._sum.get() >= 0
+
+def test_embedding_cache_collector():
+    with mock.patch('project.metrics.embedding_cache') as mocked_cache:
+        mocked_cache.stats.return_value = {"local_hits": 3, "redis_hits": 2, "misses": 1}
+        assert REGISTRY.get_sample_value("mirror_embedding_cache_total", {"result": "local_hits"}) == 3
+        assert REGISTRY.get_sample_value("mirror_embedding_cache_total", {"result": "misses"}) == 1
+
+def test_metrics_endpoint():
+    with timed("test_stage"):
+        pass
+    response = asyncio.run(metrics())
+    body = response.body.decode("utf-8")
+    assert response.media_type.startswith("text/plain")
+    for name in ("mirror_stage_seconds_bucket", "mirror_llm_tokens", "mirror_embedding_tokens",
+                 "mirror_retrieval_cache", "mirror_db_pool_wait_seconds", "mirror_embedding_cache"):
+        assert name in body
+
+def test_timed_pool():
+    assert issubclass(TimedAsyncPool, AsyncAdaptedQueuePool)
+    before = REGISTRY.get_sample_value("mirror_db_pool_wait_seconds_count") or 0
+    with mock.patch.object(AsyncAdaptedQueuePool, '_do_get', return_value="connection"):
+        pool = TimedAsyncPool(lambda: None)
+        assert pool._do_get() == "connection"
+    assert REGISTRY.get_sample_value("mirror_db_pool_wait_seconds_count") == before + 1
@@ -0,0 +1,47 @@
+from project.utils.ratelimit import RateLimiter, BUCKET_SCRIPT
+from unittest import mock
+import asyncio
+import redis
+
+## run in docker container with command: pytest project/test/utils/test_ratelimit.py -v -s
+def test_acquire_waits():
+    remote = mock.MagicMock()
+    # short on budget twice, then charged
+    remote.register_script.return_value.side_effect = [250, 500, 0]
+    with mock.patch('project.utils.ratelimit.get_redis', return_value=remote), \
+         mock.patch('project.utils.ratelimit.time.sleep') as mocked_sleep, \
+         mock.patch('project.utils.ratelimit.settings') as mocked_settings:
+        mocked_settings.RATE_LIMIT_RESERVE = 0.2
+        limiter = RateLimiter("voyage", 100, 1000)
+        assert limiter.acquire(40) == 0.75
+        remote.register_script.assert_called_once_with(BUCKET_SCRIPT)
+        assert [call.args[0] for call in mocked_sleep.call_args_list] == [0.25, 0.5]
+        script = remote.register_script.return_value
+        script.assert_called_with(keys=["ratelimit:voyage:requests", "ratelimit:voyage:tokens"],
+                                  args=[100, 1000, 40, 0.2])
+
+        # interactive callers may use the reserve
+        script.side_effect = None
+        script.return_value = 0
+        limiter.acquire(40, interactive=True)
+        script.assert_called_with(keys=limiter.keys, args=[100, 1000, 40, 0])
+
+def test_acquire_disabled_or_down():
+    remote = mock.MagicMock()
+    with mock.patch('project.utils.ratelimit.get_redis', return_value=remote):
+        assert RateLimiter("anthropic", 0, 0).acquire(10) == 0.0
+        remote.register_script.assert_not_called()
+
+        # redis down - calls go through rather than fail
+        remote.register_script.return_value.side_effect = redis.ConnectionError("down")
+        assert RateLimiter("anthropic", 50, 40000).acquire(10) == 0.0
+
+def test_aacquire_waits():
+    remote = mock.MagicMock()
+    remote.register_script.return_value = mock.AsyncMock(side_effect=[100, 0])
+    with mock.patch('project.utils.ratelimit.get_async_redis', return_value=remote), \
+         mock.patch('project.utils.ratelimit.asyncio.sleep', new=mock.AsyncMock()) as mocked_sleep:
+        limiter = RateLimiter("anthropic", 50, 40000)
+        assert asyncio.run(limiter.aacquire(300)) == 0.1
+        mocked_sleep.assert_awaited_once_with(0.1)
+        remote.register_script.return_value.assert_awaited_with(keys=limiter.keys, args=[50, 40000, 300, 0])
@@ -1,4 +1,4 @@
-from project.embedding.voyage import voyage_embedding
+from project.embedding.voyage import voyage_embedding, async_voyage_embedding
 import pytest
 import numpy as np
 
@@ -64,3 +64,20 @@ def test_voyage_embedding():
     emb2 = voyage_embedding(text)
     assert np.allclose(emb1, emb2)  # Same input should give same embedding
 
+
+@pytest.mark.asyncio
+async def test_async_voyage_embedding():
+    text = "This is a test sentence."
+    embedding = await async_voyage_embedding(text)
+    assert embedding is not None
+    assert len(embedding) == 512
+    # async and sync clients should agree
+    assert np.allclose(embedding, voyage_embedding(text))
+
+    texts = ["First sentence.", "Second sentence.", "Third sentence."]
+    multiple_embeddings = await async_voyage_embedding(texts, single=False)
+    assert len(multiple_embeddings) == len(texts)
+    assert all(len(emb) == 512 for emb in multiple_embeddings)
+
+    assert await async_voyage_embedding(None) is None
+    assert await async_voyage_embedding("") is None
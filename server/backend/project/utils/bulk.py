@@ -0,0 +1,160 @@
+import struct
+import uuid
+from datetime import datetime, timezone
+
+import numpy as np
+import sqlalchemy.types as types
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+from pgvector.sqlalchemy import Vector
+from project.config import settings
+
+# PostgreSQL binary COPY framing
+# https://www.postgresql.org/docs/current/sql-copy.html#id-1.9.3.55.9.4
+COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+COPY_TRAILER = struct.pack(">h", -1)
+NULL_FIELD = struct.pack(">i", -1)
+POSTGRES_EPOCH = datetime(2000, 1, 1, tzinfo=timezone.utc)
+
+
+def encode_uuid(value) -> bytes:
+    return (value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))).bytes
+
+
+def encode_text(value) -> bytes:
+    return str(value).encode("utf-8")
+
+
+def encode_int4(value) -> bytes:
+    return struct.pack(">i", int(value))
+
+
+def encode_float8(value) -> bytes:
+    return struct.pack(">d", float(value))
+
+
+def encode_bool(value) -> bytes:
+    return b"\x01" if value else b"\x00"
+
+
+def encode_timestamptz(value) -> bytes:
+    # microseconds since 2000-01-01 UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    delta = value - POSTGRES_EPOCH
+    return struct.pack(">q", (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds)
+
+
+def encode_vector(value) -> bytes:
+    # pgvector's vector_recv - int16 dimensions, int16 unused, then big-endian float4s
+    # https://github.com/pgvector/pgvector/blob/master/src/vector.c
+    values = np.asarray(value, dtype=">f4")
+    return struct.pack(">hh", len(values), 0) + values.tobytes()
+
+
+def column_encoder(column_type):
+    ## binary COPY encoder for a column type, None if it has to go through executemany
+    if isinstance(column_type, types.TypeDecorator):
+        column_type = column_type.impl_instance
+    if isinstance(column_type, Vector):
+        return encode_vector
+    if isinstance(column_type, types.Uuid):
+        return encode_uuid
+    if isinstance(column_type, (types.Text, types.String)):
+        return encode_text
+    if isinstance(column_type, types.Boolean):
+        return encode_bool
+    if isinstance(column_type, types.Integer) and not isinstance(column_type, (types.BigInteger, types.SmallInteger)):
+        return encode_int4
+    if isinstance(column_type, types.Float):
+        return encode_float8
+    if isinstance(column_type, types.DateTime) and column_type.timezone:
+        return encode_timestamptz
+    return None
+
+
+def copy_rows(rows: list, columns: list, encoders: list):
+    ## binary COPY payload, one row at a time
+    yield COPY_HEADER
+    field_count = struct.pack(">h", len(columns))
+    for row in rows:
+        fields = [field_count]
+        for column, encode in zip(columns, encoders):
+            value = row.get(column)
+            if value is None:
+                fields.append(NULL_FIELD)
+            else:
+                data = encode(value)
+                fields.append(struct.pack(">i", len(data)) + data)
+        yield b"".join(fields)
+    yield COPY_TRAILER
+
+
+class CopyStream:
+    ## File-like wrapper so psycopg2's copy_expert can pull the payload as it is generated
+    ## instead of from one big buffer
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._buffer = b""
+
+    def read(self, size: int = -1) -> bytes:
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, b""
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+
+def _copy(db_session, table, rows: list, columns: list, encoders: list, on_conflict_do_nothing: bool):
+    cursor = db_session.connection().connection.dbapi_connection.cursor()
+    column_list = ", ".join(f'"{column}"' for column in columns)
+    try:
+        target = table.name
+        if on_conflict_do_nothing:
+            # COPY can't skip conflicting rows - stage them in a temp table and INSERT from it
+            target = f"bulk_{table.name}"
+            cursor.execute(f'CREATE TEMP TABLE IF NOT EXISTS "{target}" '
+                           f'(LIKE "{table.name}" INCLUDING DEFAULTS) ON COMMIT DROP')
+            cursor.execute(f'TRUNCATE "{target}"')
+        stream = CopyStream(copy_rows(rows, columns, encoders))
+        cursor.copy_expert(f'COPY "{target}" ({column_list}) FROM STDIN WITH (FORMAT binary)', stream)
+        if on_conflict_do_nothing:
+            cursor.execute(f'INSERT INTO "{table.name}" ({column_list}) '
+                           f'SELECT {column_list} FROM "{target}" ON CONFLICT DO NOTHING')
+    finally:
+        cursor.close()
+
+
+def _executemany(db_session, model, rows: list, on_conflict_do_nothing: bool):
+    dialect = db_session.get_bind().dialect.name
+    statement = insert(model)
+    if on_conflict_do_nothing and dialect == "postgresql":
+        statement = postgresql.insert(model).on_conflict_do_nothing()
+    elif on_conflict_do_nothing and dialect == "sqlite":
+        statement = sqlite.insert(model).on_conflict_do_nothing()
+    size = settings.BULK_INSERT_BATCH_SIZE
+    for start in range(0, len(rows), size):
+        db_session.execute(statement, rows[start:start + size])
+
+
+def bulk_insert(db_session, model, rows: list, on_conflict_do_nothing: bool = False):
+    ## Writes plain dict rows (every row with the same keys) inside the session's transaction.
+    ## PostgreSQL over psycopg2 streams them with binary COPY - vectors included - everything
+    ## else falls back to batched executemany. Omitted columns get their server defaults
+    if not rows:
+        return
+    # pending ORM objects (foreign key targets) have to reach the database first
+    db_session.flush()
+    table = model.__table__
+    columns = list(rows[0].keys())
+    encoders = [column_encoder(table.c[column].type) for column in columns]
+    bind = db_session.get_bind()
+    if bind.dialect.name == "postgresql" and bind.dialect.driver == "psycopg2" and all(encoders):
+        _copy(db_session, table, rows, columns, encoders, on_conflict_do_nothing)
+    else:
+        _executemany(db_session, model, rows, on_conflict_do_nothing)
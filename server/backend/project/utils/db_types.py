@@ -1,5 +1,8 @@
 import sqlalchemy.types as types
+from sqlalchemy import Float, Index, func, literal, text
+from sqlalchemy.sql.expression import ClauseElement
 from pgvector.sqlalchemy import Vector
+from project.config import settings
 
 class Embedding(types.TypeDecorator):
     impl = Vector
@@ -12,3 +15,31 @@ class Embedding(types.TypeDecorator):
             return value.tolist()
         else:
             return value
+
+
+def hnsw_index(name: str, column: str = "embedding"):
+    # Approximate nearest neighbor index for l2_distance ordering
+    # https://github.com/pgvector/pgvector#hnsw
+    return Index(
+        name, column,
+        postgresql_using="hnsw",
+        postgresql_with={"m": settings.HNSW_M, "ef_construction": settings.HNSW_EF_CONSTRUCTION},
+        postgresql_ops={column: "vector_l2_ops"},
+    )
+
+
+def exact_l2_distance(column, embedding):
+    # Same value as .l2_distance() (the <-> operator), but as a function call the planner
+    # can't serve it from the HNSW index. Use it to rank rows that are filtered by a join:
+    # an index scan would filter its ef_search nearest rows afterwards and silently come
+    # up short, the plain (exact) sort over the filtered rows can't
+    if not isinstance(embedding, ClauseElement):
+        embedding = literal(embedding, column.type)
+    return func.l2_distance(column, embedding, type_=Float)
+
+
+def hnsw_ef_search(ef_search: int = None):
+    # SET LOCAL only lasts until the end of the current transaction
+    # ef_search must be >= the LIMIT of the query or results get cut short
+    ef_search = settings.HNSW_EF_SEARCH if ef_search is None else ef_search
+    return text(f"SET LOCAL hnsw.ef_search = {int(ef_search)}")
@@ -0,0 +1,101 @@
+import asyncio
+import time
+
+import redis
+from project.config import settings
+from project.cache import get_redis, get_async_redis
+
+# Two token buckets per provider (requests and tokens per minute), refilled continuously and
+# checked together in one round trip. Returns 0 once both are charged, else the milliseconds
+# until they could be. Redis' clock is the only clock, so hosts never have to agree on time
+# KEYS: request bucket, token bucket   ARGV: rpm, tpm, tokens wanted, share to leave in the bucket
+BUCKET_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) * 1000 + math.floor(tonumber(clock[2]) / 1000)
+local limits = {tonumber(ARGV[1]), tonumber(ARGV[2])}
+local costs = {1, tonumber(ARGV[3])}
+local reserve = tonumber(ARGV[4])
+local levels = {}
+local wait = 0
+for i = 1, 2 do
+    local limit = limits[i]
+    if limit > 0 then
+        local state = redis.call('HMGET', KEYS[i], 'level', 'ts')
+        local level = tonumber(state[1]) or limit
+        local ts = tonumber(state[2]) or now
+        level = math.min(limit, level + math.max(0, now - ts) * limit / 60000)
+        local floor = limit * reserve
+        -- more than the usable bucket waits for a full one instead of forever
+        costs[i] = math.min(costs[i], limit - floor)
+        local short = costs[i] + floor - level
+        if short > 0 then
+            wait = math.max(wait, math.ceil(short * 60000 / limit))
+        end
+        levels[i] = level
+    end
+end
+if wait > 0 then
+    return wait
+end
+for i = 1, 2 do
+    if limits[i] > 0 then
+        redis.call('HSET', KEYS[i], 'level', tostring(levels[i] - costs[i]), 'ts', now)
+        -- an absent bucket is a full one
+        redis.call('PEXPIRE', KEYS[i], 120000)
+    end
+end
+return 0
+"""
+
+
+class RateLimiter:
+    ## Per-provider rate limits shared by the web processes and every celery worker. Callers
+    ## wait for budget instead of failing. Background callers leave RATE_LIMIT_RESERVE of each
+    ## budget untouched, so chat requests get through while an upload is being analyzed
+    def __init__(self, provider: str, rpm: int, tpm: int):
+        self.keys = [f"ratelimit:{provider}:requests", f"ratelimit:{provider}:tokens"]
+        self.rpm = rpm
+        self.tpm = tpm
+        self._script = None
+        self._async_script = None
+
+    def _args(self, tokens: int, interactive: bool):
+        reserve = 0 if interactive else settings.RATE_LIMIT_RESERVE
+        return [self.rpm, self.tpm, max(0, tokens), reserve]
+
+    def acquire(self, tokens: int = 0, interactive: bool = False) -> float:
+        ## Blocks until the call fits both budgets. Returns the seconds spent waiting
+        if not self.rpm and not self.tpm:
+            return 0.0
+        if self._script is None:
+            self._script = get_redis().register_script(BUCKET_SCRIPT)
+        waited = 0.0
+        while True:
+            try:
+                wait = self._script(keys=self.keys, args=self._args(tokens, interactive))
+            except redis.RedisError as e:
+                # fail open - the provider still enforces its own limits
+                print(f"Rate limiter unavailable: {str(e)}")
+                return waited
+            if not wait:
+                return waited
+            time.sleep(wait / 1000)
+            waited += wait / 1000
+
+    async def aacquire(self, tokens: int = 0, interactive: bool = True) -> float:
+        ## Same as acquire without blocking the event loop
+        if not self.rpm and not self.tpm:
+            return 0.0
+        if self._async_script is None:
+            self._async_script = get_async_redis().register_script(BUCKET_SCRIPT)
+        waited = 0.0
+        while True:
+            try:
+                wait = await self._async_script(keys=self.keys, args=self._args(tokens, interactive))
+            except redis.RedisError as e:
+                print(f"Rate limiter unavailable: {str(e)}")
+                return waited
+            if not wait:
+                return waited
+            await asyncio.sleep(wait / 1000)
+            waited += wait / 1000
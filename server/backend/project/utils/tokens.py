@@ -0,0 +1,17 @@
+import math
+
+# ~4 characters per token holds reasonably well for english prose with both the Voyage
+# and Claude tokenizers
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    ## Local estimate, no tokenizer download or API call
+    if not text:
+        return 0
+    return max(1, math.ceil(len(text) / CHARS_PER_TOKEN))
+
+
+def token_chars(tokens: int) -> int:
+    ## character limit for `truncate` that fits in `tokens`
+    return max(0, tokens) * CHARS_PER_TOKEN